@@ -0,0 +1,135 @@
+# coding: utf-8
+
+"""Generator of synthetic Vale models used by the benchmarks.
+
+    python benchmarks/generate.py --forms 100 --width 20 -o model.vl
+"""
+
+import sys
+import argparse
+
+# derivatives applied to the test and trial functions
+_basis = ['{}', 'dx({})', 'dy({})', 'dx(dx({}))', 'dy(dx({}))']
+
+# coefficients of the terms
+_coefficients = ['alpha', 'phi', 'sin(pi*x)', 'exp(-phi)', '2*pi**2', 'y']
+
+#==============================================================================
+def _coefficient(i, depth):
+    """Returns a coefficient nested in depth levels of parenthesis."""
+    expr = _coefficients[i % len(_coefficients)]
+    for k in range(depth):
+        c = _coefficients[(i + k + 1) % len(_coefficients)]
+        expr = '(1 + {c}*({e}))'.format(c=c, e=expr)
+    return expr
+
+def linear_expression(v, width=1, depth=0, offset=0):
+    """Returns an expression, linear in v, made of width terms."""
+    terms = []
+    for i in range(width):
+        k = offset + i
+        basis = _basis[k % len(_basis)].format(v)
+        terms.append('{}*{}'.format(_coefficient(k, depth), basis))
+    return ' + '.join(terms)
+
+def bilinear_expression(v, u, width=1, depth=0, offset=0):
+    """Returns an expression, bilinear in (v,u), made of width terms."""
+    terms = []
+    for i in range(width):
+        k = offset + i
+        bv = _basis[k % len(_basis)].format(v)
+        bu = _basis[(k + 1) % len(_basis)].format(u)
+        terms.append('{}*{}*{}'.format(_coefficient(k, depth), bv, bu))
+    return ' + '.join(terms)
+
+#==============================================================================
+def generate_model(forms=10, width=1, depth=0, components=2, bcs=2):
+    """Returns the code of a synthetic Vale model.
+
+    forms: int
+        number of linear forms, and of bilinear forms.
+
+    width: int
+        number of terms in the integrand of every form.
+
+    depth: int
+        nesting level of the coefficients of every term.
+
+    components: int
+        number of components of the product space X = V*V*...*V, on which
+        an additional bilinear form is defined.
+
+    bcs: int
+        number of boundary conditions chained with 'and' in the equation.
+    """
+    lines = ['Domain(dim=2)              :: Omega',
+             'FunctionSpace(Omega)       :: V',
+             'VectorFunctionSpace(Omega) :: W',
+             'Field(V)                   :: phi',
+             'Real                       :: alpha',
+             '']
+
+    for i in range(forms):
+        expr = linear_expression('v', width=width, depth=depth, offset=i)
+        lines.append('l{i}(v::V) = < {e} >'.format(i=i, e=expr))
+    lines.append('')
+
+    for i in range(forms):
+        expr = bilinear_expression('v', 'u', width=width, depth=depth,
+                                   offset=i)
+        lines.append('a{i}(v::V, u::V) = < {e} >'.format(i=i, e=expr))
+    lines.append('')
+
+    # ... bilinear form on a product space
+    if components > 0:
+        vs = ['v{}'.format(i) for i in range(components)]
+        us = ['u{}'.format(i) for i in range(components)]
+
+        terms = []
+        for i in range(components):
+            j = (i + 1) % components
+            terms.append('{v}*{u}'.format(v=vs[i], u=us[i]))
+            terms.append('dx({v})*dx({u})'.format(v=vs[i], u=us[j]))
+
+        lines.append('X = {}'.format('*'.join(['V']*components)))
+        lines.append('b(({v})::X, ({u})::X) = < {e} >'.format(
+            v=','.join(vs), u=','.join(us), e=' + '.join(terms)))
+        lines.append('')
+    # ...
+
+    # ... equation with chained boundary conditions
+    lines.append('find u :: V such that')
+    lines.append('  a0(v,u) = l0(v) forall v :: V')
+    for i in range(bcs):
+        lines.append("  and u = 0 on 'Gamma_{}'".format(i + 1))
+    lines.append("  label: 'poisson'")
+    # ...
+
+    return '\n'.join(lines) + '\n'
+
+#==============================================================================
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Generate a synthetic Vale model.')
+
+    parser.add_argument('--forms', type=int, default=10)
+    parser.add_argument('--width', type=int, default=1)
+    parser.add_argument('--depth', type=int, default=0)
+    parser.add_argument('--components', type=int, default=2)
+    parser.add_argument('--bcs', type=int, default=2)
+    parser.add_argument('-o', '--output', default=None)
+
+    args = parser.parse_args(argv)
+
+    code = generate_model(forms=args.forms, width=args.width,
+                          depth=args.depth, components=args.components,
+                          bcs=args.bcs)
+
+    if args.output is None:
+        sys.stdout.write(code)
+    else:
+        with open(args.output, 'w') as f:
+            f.write(code)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+# coding: utf-8
+
+"""Lowering of deeply nested expressions.
+
+    python benchmarks/lowering.py
+
+Builds the AST of (1 + x*(1 + x*(...))) for several nesting depths, without
+parsing it, and compares the time per node of the lowering with an explicit
+stack (vale.syntax.lower) to a recursive lowering, as done by the expr
+properties before. The recursive lowering fails once the depth reaches the
+Python recursion limit.
+"""
+
+import os
+import sys
+import time
+import argparse
+
+base_dir = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, os.path.dirname(base_dir))
+
+from vale.session import Session, get_session
+from vale.syntax import (Expression, Term, Factor, Operand,
+                         lower, hashcons, load_backend)
+
+#==============================================================================
+def factor(op):
+    return Factor(op=op, sign=None, trailer=None, exponent=None)
+
+def nested_expression(depth):
+    """Returns the AST of (1 + x*(1 + x*(...))), and its number of nodes."""
+    expr  = Expression(op=[Term(op=[factor(Operand(op='x'))])])
+    nodes = 4
+    for i in range(depth):
+        inner = factor(Operand(op=expr))
+        term  = Term(op=[factor(Operand(op='x')), '*', inner])
+        one   = Term(op=[factor(Operand(op=1))])
+        expr  = Expression(op=[one, '+', term])
+        nodes += 10
+    return expr, nodes
+
+def lower_recursive(node):
+    """Lowers a node as the expr properties used to: one Python call per
+    node, looking for its cached expression and for the instrumentation."""
+    try:
+        return node._recursive
+    except AttributeError:
+        pass
+
+    instrumentation = get_session().instrumentation
+
+    args = [lower_recursive(c) for c in node._children()]
+
+    # measured as in vale.syntax.lower, so that both are compared alike
+    if instrumentation is None:
+        node._recursive = hashcons(node._lower(*args))
+
+    else:
+        instrumentation.begin('lower')
+        try:
+            node._recursive = hashcons(node._lower(*args))
+        finally:
+            instrumentation.end(node.__class__.__name__)
+
+    return node._recursive
+
+def lowering_time(depth, method):
+    """Returns the lowering time per node of an expression of the given
+    depth, or None if the recursion limit is reached."""
+    from sympy import Symbol
+    from sympy.core.cache import clear_cache
+
+    expr, nodes = nested_expression(depth)
+
+    # otherwise the second method finds the expressions in the sympy cache
+    clear_cache()
+
+    session = Session()
+    with session:
+        session.define('x', Symbol('x'))
+
+        tb = time.perf_counter()
+        try:
+            method(expr)
+        except RecursionError:
+            return None
+        return (time.perf_counter() - tb) / nodes
+
+#==============================================================================
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('depths', nargs='*', type=int,
+                        default=[10, 50, 100, 500, 2000, 10000])
+    args = parser.parse_args(argv)
+
+    load_backend()
+
+    # warm up
+    lowering_time(10, lower)
+
+    print('{:>8s} {:>14s} {:>14s}'.format('depth', 'stack/node',
+                                          'recursive/node'))
+
+    for depth in args.depths:
+        times = [lowering_time(depth, method)
+                 for method in [lower, lower_recursive]]
+
+        txt = ['{:11.2f} us'.format(1e6*t) if not( t is None ) else
+               '{:>14s}'.format('recursion') for t in times]
+        print('{:8d} {} {}'.format(depth, *txt))
+
+if __name__ == '__main__':
+    main()
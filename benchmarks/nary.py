@@ -0,0 +1,78 @@
+# coding: utf-8
+
+"""Scaling of the lowering of long sums with the number of terms.
+
+    python benchmarks/nary.py
+
+For every number of terms, prints the time spent in the lowering of a
+linear form with that many terms, and compares building the sum with one
+n-ary Add to folding it one term at a time. The time per term of the n-ary
+construction stays constant, while it grows linearly for the fold.
+"""
+
+import os
+import sys
+import time
+import argparse
+from functools import reduce
+from operator import add
+
+base_dir = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, os.path.dirname(base_dir))
+sys.path.insert(0, base_dir)
+
+from sympy import Add, Symbol, sin
+
+from vale.parser import Parser
+from vale.instrument import Instrumentation
+
+from generate import generate_model
+
+#==============================================================================
+def lowering_time(n):
+    """Returns the lowering time of a linear form with n terms."""
+    code = generate_model(forms=1, width=n, components=0, bcs=0)
+
+    instrumentation = Instrumentation()
+    Parser(instrumentation=instrumentation).parse(code)
+
+    return instrumentation.report()['phases']['lower']['self_time']
+
+def sum_times(n):
+    """Returns the time to build a sum of n terms with one Add and with a
+    fold."""
+    x = Symbol('x')
+    terms = [sin(i*x)*Symbol('c{}'.format(i)) for i in range(n)]
+
+    tb = time.perf_counter()
+    Add(*terms)
+    nary = time.perf_counter() - tb
+
+    tb = time.perf_counter()
+    reduce(add, terms)
+    fold = time.perf_counter() - tb
+
+    return nary, fold
+
+#==============================================================================
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('sizes', nargs='*', type=int,
+                        default=[50, 100, 200, 400, 800])
+    args = parser.parse_args(argv)
+
+    # warm up: imports of the backend and compilation of the grammar
+    lowering_time(1)
+
+    print('{:>8s} {:>14s} {:>14s} {:>14s}'.format(
+          'terms', 'lower/term', 'Add/term', 'fold/term'))
+
+    for n in args.sizes:
+        lower = lowering_time(n)
+        nary, fold = sum_times(n)
+
+        print('{:8d} {:11.2f} us {:11.2f} us {:11.2f} us'.format(
+              n, 1e6*lower/n, 1e6*nary/n, 1e6*fold/n))
+
+if __name__ == '__main__':
+    main()
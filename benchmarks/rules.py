@@ -0,0 +1,55 @@
+# coding: utf-8
+
+"""Backtracking of the textX parser, rule by rule.
+
+    python benchmarks/rules.py model.vl
+    python benchmarks/rules.py --depth 4
+
+For every rule of the grammar, prints the number of attempts to match it,
+of failures, and of retries, i.e. attempts at a position where the rule was
+already tried. Retries are input parsed again after a backtrack. Without
+file, a synthetic model is profiled.
+"""
+
+import os
+import sys
+import argparse
+
+base_dir = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, os.path.dirname(base_dir))
+sys.path.insert(0, base_dir)
+
+from vale.parser import profile_rules
+
+from generate import generate_model
+
+#==============================================================================
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('filename', nargs='?', default=None)
+    parser.add_argument('--grammar', default=None,
+                        help='textX grammar file, grammar.tx by default')
+    parser.add_argument('--memoization', action='store_true')
+    parser.add_argument('--forms', type=int, default=10)
+    parser.add_argument('--width', type=int, default=1)
+    parser.add_argument('--depth', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    if args.filename is None:
+        code = generate_model(forms=args.forms, width=args.width,
+                              depth=args.depth)
+    else:
+        with open(args.filename) as f:
+            code = f.read()
+
+    grammar = None
+    if args.grammar:
+        with open(args.grammar) as f:
+            grammar = f.read()
+
+    profile = profile_rules(code, grammar=grammar,
+                            memoization=args.memoization)
+    print(profile)
+
+if __name__ == '__main__':
+    main()
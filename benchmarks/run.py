@@ -0,0 +1,222 @@
+# coding: utf-8
+
+"""Benchmarks of the parsing and lowering of synthetic Vale models.
+
+    python benchmarks/run.py -o results.json
+    python benchmarks/run.py --compare base.json results.json
+
+Every scenario times separately the grammar compilation, the textX parse,
+the construction of the syntax objects and the lowering (the declaration
+constructors, sympde objects included), and records the peak memory of a
+full parse. The total is measured without instrumentation. The hand-written parser is benchmarked
+with --backend fast.
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import subprocess
+import tracemalloc
+
+from sympy.core.cache import clear_cache
+
+base_dir = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, os.path.dirname(base_dir))
+sys.path.insert(0, base_dir)
+
+import vale
+from vale.parser import Parser, get_metamodel, clear_metamodel_cache, _classes
+from vale.instrument import Instrumentation
+from vale.fastparser import FastMetamodel
+
+from generate import generate_model
+
+# scenarios: name -> list of generate_model arguments
+SCENARIOS = {
+    'declarations': [dict(forms=n) for n in [10, 50, 200]],
+    'wide':         [dict(forms=2, width=n) for n in [10, 50, 200]],
+    'deep':         [dict(forms=2, depth=n) for n in [1, 4, 16]],
+    'components':   [dict(forms=2, components=n) for n in [2, 8, 32]],
+    'bcs':          [dict(forms=2, bcs=n) for n in [2, 10, 50]],
+}
+
+PHASES = ['compile', 'parse', 'construct', 'lower', 'total']
+
+#==============================================================================
+def run_once(code, grammar, backend='textx'):
+    """Returns the time spent in every phase for a Vale code."""
+    timings = dict((k, 0.) for k in PHASES)
+
+    # ... grammar compilation, without the metamodel cache
+    clear_metamodel_cache()
+
+    tb = time.perf_counter()
+    if backend == 'textx':
+        get_metamodel(grammar, classes=_classes)
+    else:
+        FastMetamodel(classes=_classes)
+    timings['compile'] = time.perf_counter() - tb
+    # ...
+
+    # ... parse only, using a metamodel without user classes
+    if backend == 'textx':
+        raw = get_metamodel(grammar)
+    else:
+        raw = FastMetamodel()
+
+    tb = time.perf_counter()
+    raw.model_from_str(code)
+    timings['parse'] = time.perf_counter() - tb
+    # ...
+
+    # ... full parse, without instrumentation
+    clear_cache()
+    pde = Parser(backend=backend)
+
+    tb = time.perf_counter()
+    pde.parse(code)
+    total = time.perf_counter() - tb
+    # ...
+
+    # ... the lowering is the time spent in the declaration constructors,
+    #     sympde objects included; measured by a second parse
+    clear_cache()
+
+    instrumentation = Instrumentation()
+    pde = Parser(instrumentation=instrumentation, backend=backend)
+    pde.parse(code)
+
+    phases = instrumentation.report()['phases']
+    if 'declaration' in phases:
+        timings['lower'] = phases['declaration']['time']
+    # ...
+
+    # the construction is what is neither textX nor lowering
+    timings['construct'] = max(total - timings['parse'] - timings['lower'], 0.)
+    timings['total'] = timings['compile'] + total
+
+    return timings
+
+def peak_memory(code, backend='textx'):
+    """Returns the peak memory, in bytes, of the parsing of a Vale code."""
+    pde = Parser(backend=backend)
+
+    tracemalloc.start()
+    try:
+        pde.parse(code)
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return peak
+
+def run(scenarios=None, repeat=3, backend='textx'):
+    """Runs the benchmarks and returns the results as a dictionary."""
+    if scenarios is None:
+        scenarios = sorted(SCENARIOS.keys())
+
+    grammar = Parser().grammar
+
+    results = {}
+    for name in scenarios:
+        for kwargs in SCENARIOS[name]:
+            key = '{}/{}'.format(name, ','.join('{}={}'.format(k, v)
+                                 for k,v in sorted(kwargs.items())))
+            code = generate_model(**kwargs)
+
+            # the minimum over the runs is the least noisy estimate
+            runs = [run_once(code, grammar, backend=backend)
+                    for i in range(repeat)]
+            r = dict((k, min(t[k] for t in runs)) for k in PHASES)
+
+            r['lines']       = code.count('\n')
+            r['peak_memory'] = peak_memory(code, backend=backend)
+
+            results[key] = r
+
+            print('{:40s} {:8.4f} s  {:8.1f} KiB'.format(
+                  key, r['total'], r['peak_memory'] / 1024.))
+
+    return results
+
+#==============================================================================
+def metadata(backend='textx'):
+    """Returns the information needed to compare results across commits."""
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', 'HEAD'],
+                                         cwd=base_dir,
+                                         stderr=subprocess.DEVNULL)
+        commit = commit.decode().strip()
+    except Exception:
+        commit = None
+
+    return {'commit':  commit,
+            'vale':    str(vale.__version__),
+            'python':  platform.python_version(),
+            'machine': platform.machine(),
+            'backend': backend,
+            'date':    time.strftime('%Y-%m-%d %H:%M:%S')}
+
+def compare(base, new):
+    """Prints the ratios new/base of the timings of two result files."""
+    with open(base) as f:
+        base = json.load(f)
+    with open(new) as f:
+        new = json.load(f)
+
+    print('base: {}'.format(base['meta'].get('commit')))
+    print('new:  {}'.format(new['meta'].get('commit')))
+
+    header = '{:40s}'.format('') + ''.join('{:>11s}'.format(k)
+                                           for k in PHASES + ['memory'])
+    print(header)
+
+    for key in sorted(new['results']):
+        if not( key in base['results'] ):
+            continue
+
+        b = base['results'][key]
+        n = new['results'][key]
+
+        line = '{:40s}'.format(key)
+        for k in PHASES + ['peak_memory']:
+            if b[k] > 0.:
+                line += '{:>10.2f}x'.format(n[k] / b[k])
+            else:
+                line += '{:>11s}'.format('-')
+        print(line)
+
+#==============================================================================
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run the vale benchmarks.')
+
+    parser.add_argument('scenarios', nargs='*',
+                        help='scenarios to run, among {}'.format(
+                             ', '.join(sorted(SCENARIOS))))
+    parser.add_argument('-r', '--repeat', type=int, default=3)
+    parser.add_argument('-b', '--backend', default='textx',
+                        choices=['textx', 'fast'])
+    parser.add_argument('-o', '--output', default=None,
+                        help='json file in which the results are written')
+    parser.add_argument('--compare', nargs=2, metavar=('BASE', 'NEW'),
+                        help='compare two result files')
+
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    results = run(scenarios=args.scenarios or None, repeat=args.repeat,
+                  backend=args.backend)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'meta': metadata(args.backend), 'results': results},
+                      f, indent=2, sort_keys=True)
+
+if __name__ == '__main__':
+    main()
@@ -39,11 +39,18 @@ except:
     install_requires += ['textx']
 # ...
 
+# ...
+entry_points = {'console_scripts': ['vale-batch = vale.batch:main',
+                                    'vale-daemon = vale.daemon:main',
+                                    'vale-cost = vale.cost:main']}
+# ...
+
 def setup_package():
     setup(packages=packages, \
           include_package_data=True, \
           zip_safe=True, \
           install_requires=install_requires, \
+          entry_points=entry_points, \
           **setup_args)
 
 if __name__ == "__main__":
@@ -1,4 +1,5 @@
 __version__ = 0.9
 
+from .session import *
 from .parser  import *
 from .syntax  import *
@@ -0,0 +1,197 @@
+# coding: utf-8
+
+import os
+import sys
+import time
+import argparse
+import traceback
+from multiprocessing import Pool
+
+from .parser import Parser, dump_model
+
+# Parser of the current worker process
+_parser = None
+
+#======================================================================
+class BatchResult(object):
+    """Class representing the result of the compilation of a Vale file.
+
+    * filename: the compiled file
+    * namespace: the lowered namespace, if it is not written to a file
+    * output: the file in which the namespace is serialized, if any
+    * error: the traceback of the error, if the compilation failed
+    * elapsed: the compilation time in seconds
+    """
+    def __init__(self, filename, namespace=None, output=None, error=None,
+                 elapsed=0.):
+        self.filename  = filename
+        self.namespace = namespace
+        self.output    = output
+        self.error     = error
+        self.elapsed   = elapsed
+
+    @property
+    def ok(self):
+        return self.error is None
+
+#======================================================================
+class BatchReport(object):
+    """Class representing the results of a batch compilation."""
+    def __init__(self, results, elapsed):
+        self.results = results
+        self.elapsed = elapsed
+
+    @property
+    def failures(self):
+        return [r for r in self.results if not r.ok]
+
+    @property
+    def throughput(self):
+        """Number of compiled files per second."""
+        if self.elapsed <= 0.:
+            return 0.
+        return len(self.results) / self.elapsed
+
+    def __str__(self):
+        return ('{n} files compiled in {t:.3f} s ({r:.2f} files/s), '
+                '{f} failed'.format(n=len(self.results), t=self.elapsed,
+                                    r=self.throughput,
+                                    f=len(self.failures)))
+
+#======================================================================
+def find_files(paths, ext='.vl'):
+    """Returns the Vale files given by a list of files and directories."""
+    filenames = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for f in sorted(files):
+                    if f.endswith(ext):
+                        filenames.append(os.path.join(root, f))
+        else:
+            filenames.append(path)
+
+    return filenames
+
+def _output_names(filenames, output_dir):
+    """Returns the serialization file of every Vale file, keeping the
+    directory structure below the common directory of the files."""
+    filenames = [os.path.abspath(f) for f in filenames]
+    if len(filenames) == 1:
+        root = os.path.dirname(filenames[0])
+    else:
+        root = os.path.commonpath([os.path.dirname(f) for f in filenames])
+
+    outputs = []
+    for f in filenames:
+        name = os.path.splitext(os.path.relpath(f, root))[0]
+        outputs.append(os.path.join(output_dir, '{}.pkl'.format(name)))
+
+    return outputs
+
+#======================================================================
+def _init_worker(cache_dir):
+    # the metamodel is compiled once per worker
+    global _parser
+    _parser = Parser(cache_dir=cache_dir)
+
+def _compile(task):
+    filename, output = task
+
+    tb = time.time()
+    try:
+        ast = _parser.parse_from_file(filename)
+
+        if output is None:
+            namespace = dict(ast.namespace)
+
+        else:
+            namespace = None
+
+            dirname = os.path.dirname(output)
+            if not os.path.isdir(dirname):
+                os.makedirs(dirname)
+
+            if not dump_model(ast, output):
+                raise ValueError('could not serialize {}'.format(filename))
+
+        return BatchResult(filename, namespace=namespace, output=output,
+                           elapsed=time.time() - tb)
+
+    except Exception:
+        return BatchResult(filename, error=traceback.format_exc(),
+                           elapsed=time.time() - tb)
+
+#======================================================================
+def compile_files(paths, processes=None, output_dir=None, cache_dir=None):
+    """Compiles Vale files in parallel and returns a BatchReport.
+
+    paths: list
+        Vale files and directories containing Vale files.
+
+    processes: int
+        number of worker processes. By default, the number of cpus.
+
+    output_dir: str
+        directory in which the lowered namespaces are serialized. If not
+        given, the namespaces are returned in the results.
+
+    cache_dir: str
+        directory of the lowered models cache used by the workers.
+
+    A failure is reported in the result of its file and does not stop the
+    compilation of the other files.
+    """
+    filenames = find_files(paths)
+
+    if output_dir is None:
+        outputs = [None]*len(filenames)
+    else:
+        outputs = _output_names(filenames, output_dir)
+
+    tb = time.time()
+
+    results = []
+    if filenames:
+        pool = Pool(processes=processes, initializer=_init_worker,
+                    initargs=(cache_dir,))
+        try:
+            results = pool.map(_compile, list(zip(filenames, outputs)),
+                               chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+
+    return BatchReport(results, time.time() - tb)
+
+#======================================================================
+def main(argv=None):
+    """Console script compiling Vale files in parallel."""
+    parser = argparse.ArgumentParser(
+        description='Compile Vale files using a pool of processes.')
+
+    parser.add_argument('paths', nargs='+',
+                        help='Vale files or directories')
+    parser.add_argument('-j', '--processes', type=int, default=None,
+                        help='number of processes (default: number of cpus)')
+    parser.add_argument('-o', '--output-dir', default=None,
+                        help='directory for the serialized namespaces')
+    parser.add_argument('--cache-dir', default=None,
+                        help='directory of the lowered models cache')
+
+    args = parser.parse_args(argv)
+
+    report = compile_files(args.paths, processes=args.processes,
+                           output_dir=args.output_dir,
+                           cache_dir=args.cache_dir)
+
+    for r in report.failures:
+        sys.stderr.write('> {} failed\n{}\n'.format(r.filename, r.error))
+
+    print(report)
+
+    return 1 if report.failures else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
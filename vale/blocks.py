@@ -0,0 +1,101 @@
+# coding: utf-8
+
+from .kernels import kernel_atoms, terminal_expr
+
+#======================================================================
+class BlockStructure(object):
+    """Class representing the blocks of a bilinear form defined on product
+    spaces, one per (test function, trial function) pair.
+
+    * test_functions, trial_functions: the components of the form
+    * blocks: the nonzero blocks, by (i,j) index of the test and trial
+      functions
+
+    For a linear form, there are no trial functions and the blocks are
+    given by (i,) index of the test functions.
+
+    >>> blocks = get_by_name(ast, 'a13').blocks
+    >>> blocks.nonzero
+    [(0, 0), (0, 1), (1, 0)]
+    >>> print(blocks)
+    """
+    def __init__(self, test_functions, trial_functions, blocks):
+        self.test_functions  = tuple(test_functions)
+        self.trial_functions = tuple(trial_functions)
+        self.blocks          = blocks
+
+    @property
+    def shape(self):
+        if not self.trial_functions:
+            return (len(self.test_functions),)
+        return (len(self.test_functions), len(self.trial_functions))
+
+    @property
+    def nonzero(self):
+        """Returns the indices of the nonzero blocks, sorted."""
+        return sorted(self.blocks.keys())
+
+    def is_zero(self, *key):
+        return not( key in self.blocks )
+
+    def __getitem__(self, key):
+        """Returns the expression of a block, 0 if it is zero."""
+        return self.blocks.get(key, 0)
+
+    def __str__(self):
+        # a pattern of the nonzero blocks
+        tests  = [str(v) for v in self.test_functions]
+        trials = [str(u) for u in self.trial_functions]
+        width  = max(len(x) for x in tests + trials + [''])
+
+        fmt   = '{:>%d}' % width
+        lines = [' '.join(fmt.format(x) for x in [''] + trials)]
+        for i, v in enumerate(tests):
+            if trials:
+                row = ['x' if (i, j) in self.blocks else '.'
+                       for j in range(len(trials))]
+            else:
+                row = ['x' if (i,) in self.blocks else '.']
+            lines.append(' '.join(fmt.format(x) for x in [v] + row))
+
+        return '\n'.join(lines)
+
+#======================================================================
+def function_uses(expr, functions):
+    """Returns the inputs of an integrand, with the set of the given
+    functions used by every input."""
+    return [(atom, set(f for f in functions if atom.has(f)))
+            for atom in kernel_atoms(expr)]
+
+def restrict(expr, uses, kept):
+    """Returns the part of a multilinear integrand using only the kept
+    functions, by setting to zero the inputs, e.g. dx(w), of the others."""
+    kept = set(kept)
+    subs = dict((atom, 0) for atom, used in uses if used - kept)
+    return expr.xreplace(subs)
+
+def block_structure(expr, test_functions, trial_functions=()):
+    """Returns the BlockStructure of a bilinear integrand, or of a linear
+    integrand if no trial functions are given.
+
+    Since the integrand is linear in every function, the block (v,u) is
+    obtained by restricting it to v and u. A block is zero if the result is
+    identically zero. The integrand is first expanded to terminal
+    derivatives, see kernels.terminal_expr.
+    """
+    expr = terminal_expr(expr)
+    uses = function_uses(expr, list(test_functions) + list(trial_functions))
+
+    if trial_functions:
+        pairs = [((i, j), [v, u]) for i, v in enumerate(test_functions)
+                                  for j, u in enumerate(trial_functions)]
+    else:
+        pairs = [((i,), [v]) for i, v in enumerate(test_functions)]
+
+    blocks = {}
+    for key, functions in pairs:
+        block = restrict(expr, uses, functions)
+        if not( block == 0 ):
+            blocks[key] = block
+
+    return BlockStructure(test_functions, trial_functions, blocks)
@@ -0,0 +1,417 @@
+# coding: utf-8
+
+import os
+import stat
+import shutil
+import hashlib
+import tempfile
+import threading
+import subprocess
+import importlib.util
+import importlib.machinery
+
+import numpy as np
+
+from sympy import IndexedBase, Symbol
+from sympy.printing.pycode import PythonCodePrinter
+
+from . import syntax
+from .kernels import get_kernel, kernel_atoms, terminal_expr, _atom_name
+from .blocks import block_structure
+
+# Element kernels already built, by hash of their source and build options,
+# and by form (integrand, functions and build options); and the events of
+# the kernels being built
+_element_kernels = {}
+_element_kernels_by_form = {}
+_element_kernels_building = {}
+_element_kernels_lock = threading.Lock()
+
+# Types of the arguments, given as pyccel annotations
+_types = {'test':     'float[:,:]',
+          'trial':    'float[:,:]',
+          'pair':     'float[:,:,:]',
+          'field':    'float[:]',
+          'constant': 'float'}
+
+_template = '''# coding: utf-8
+# generated by vale, do not edit
+#
+# integrand: {integrand}
+
+import math
+
+def kernel({arguments}):
+    n_quad = weights.shape[0]
+{loops}
+'''
+
+_linear_loops = '''    for i in range(out.shape[0]):
+        s = 0.0
+        for q in range(n_quad):
+            s += weights[q] * ({expr})
+        out[i] = s'''
+
+_bilinear_loops = '''    for i in range(out.shape[0]):
+        for j in range(out.shape[1]):
+            s = 0.0
+            for q in range(n_quad):
+                s += weights[q] * ({expr})
+            out[i, j] = s'''
+
+#======================================================================
+def pyccel_available():
+    """Returns True if pyccel and a C compiler are found."""
+    compiler = os.environ.get('CC', 'gcc')
+    return bool(shutil.which('pyccel') and
+                (shutil.which(compiler) or shutil.which('cc')))
+
+def default_cache_dir():
+    """Returns the directory of the compiled kernels: the kernels directory
+    of VALE_CACHE_DIR if defined, or of the user cache directory
+    (XDG_CACHE_HOME, ~/.cache by default)."""
+    root = os.environ.get('VALE_CACHE_DIR', None)
+    if root is None:
+        root = os.environ.get('XDG_CACHE_HOME', None)
+        if not root:
+            root = os.path.join(os.path.expanduser('~'), '.cache')
+        root = os.path.join(root, 'vale')
+    return os.path.join(root, 'kernels')
+
+def private_folder(folder):
+    """Creates the folder of the compiled kernels if needed, readable and
+    writable by the user only, and checks that no other user can write in
+    it, since the extensions found there are imported. Raises
+    PermissionError otherwise."""
+    if not os.path.isdir(folder):
+        os.makedirs(folder, mode=0o700)
+
+    st = os.stat(folder)
+    if hasattr(os, 'getuid') and not( st.st_uid == os.getuid() ):
+        raise PermissionError('{} is not owned by the user'.format(folder))
+
+    if st.st_mode & (stat.S_IWGRP | stat.S_IWOTH):
+        raise PermissionError('{} is writable by other users'.format(folder))
+
+def _find_extension(folder, name):
+    for suffix in importlib.machinery.EXTENSION_SUFFIXES:
+        filename = os.path.join(folder, name + suffix)
+        if os.path.isfile(filename):
+            return filename
+    return None
+
+def compile_source(source, name, folder):
+    """Compiles a kernel source with pyccel, unless it was already compiled
+    in the folder, and returns its kernel function, or None if the
+    compilation failed.
+
+    The kernel is compiled in a temporary directory, and the extension is
+    then moved to the folder, so that other processes never import a
+    partially written extension. See private_folder."""
+    private_folder(folder)
+
+    extension = _find_extension(folder, name)
+
+    if extension is None:
+        build = tempfile.mkdtemp(prefix='build-', dir=folder)
+        try:
+            filename = os.path.join(build, '{}.py'.format(name))
+            with open(filename, 'w') as f:
+                f.write(source)
+
+            try:
+                subprocess.run(['pyccel', filename], cwd=build,
+                               stdout=subprocess.DEVNULL,
+                               stderr=subprocess.DEVNULL, check=True)
+            except (OSError, subprocess.CalledProcessError):
+                return None
+
+            built = _find_extension(build, name)
+            if built is None:
+                return None
+
+            extension = os.path.join(folder, os.path.basename(built))
+            os.replace(built, extension)
+
+        finally:
+            shutil.rmtree(build, ignore_errors=True)
+
+    spec   = importlib.util.spec_from_file_location(name, extension)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+
+    return module.kernel
+
+#======================================================================
+class ElementKernel(object):
+    """Class computing an element vector or matrix over the quadrature
+    points, for one test function and, for a bilinear form, one trial
+    function.
+
+    The inputs are given by name, as for a Kernel, but are not broadcast:
+
+    * an input of the test function, e.g. dx_v: (n_test, n_quad)
+    * an input of the trial function: (n_trial, n_quad)
+    * an input of both, which the expansion to terminal derivatives should
+      not leave: (n_test, n_trial, n_quad)
+    * a field or a coordinate: (n_quad,)
+    * a constant: a scalar
+
+    The source is a pyccel compatible Python function. It is compiled by
+    pyccel if available, otherwise the integrand is evaluated using NumPy.
+
+    >>> kernel = compile_form(get_by_name(ast, 'a1')).blocks[0, 0]
+    >>> mat = kernel(weights, u=u, v=v)
+    """
+    def __init__(self, expr, test_function, trial_function=None):
+        syntax.load_backend()
+
+        expr  = terminal_expr(expr)
+        atoms = kernel_atoms(expr)
+
+        names = []
+        for atom in atoms:
+            names.append(_atom_name(atom, names))
+
+        # ... the kind of every input
+        kinds = []
+        for atom in atoms:
+            test  = atom.has(test_function)
+            trial = not( trial_function is None ) and atom.has(trial_function)
+            if test and trial:
+                kinds.append('pair')
+            elif test:
+                kinds.append('test')
+            elif trial:
+                kinds.append('trial')
+            elif isinstance(atom, syntax.sym_Constant):
+                kinds.append('constant')
+            else:
+                kinds.append('field')
+        # ...
+
+        self.expr     = expr
+        self.names    = names
+        self.kinds    = dict(zip(names, kinds))
+        self.bilinear = not( trial_function is None )
+        self.source   = self._source(atoms)
+        self.hash     = hashlib.sha1(self.source.encode('utf-8')).hexdigest()
+
+        self.function = None
+        self.compiled = False
+
+    def _source(self, atoms):
+        """Returns the pyccel compatible source of the kernel."""
+        i, j, q = Symbol('i'), Symbol('j'), Symbol('q')
+        indices = {'test':     (i, q),
+                   'trial':    (j, q),
+                   'pair':     (i, j, q),
+                   'field':    (q,)}
+
+        subs = {}
+        for atom, name in zip(atoms, self.names):
+            kind = self.kinds[name]
+            if kind == 'constant':
+                subs[atom] = Symbol(name)
+            else:
+                subs[atom] = IndexedBase(name)[indices[kind]]
+
+        printer = PythonCodePrinter({'standard': 'python3'})
+        expr    = printer.doprint(self.expr.xreplace(subs))
+
+        out = 'float[:,:]' if self.bilinear else 'float[:]'
+        arguments = ['{} : {!r}'.format(name, _types[self.kinds[name]])
+                     for name in self.names]
+        arguments += ["weights : 'float[:]'", 'out : {!r}'.format(out)]
+
+        loops = _bilinear_loops if self.bilinear else _linear_loops
+
+        return _template.format(integrand=self.expr,
+                                arguments=', '.join(arguments),
+                                loops=loops.format(expr=expr))
+
+    def _numpy_function(self):
+        """Returns a function with the signature of the generated kernel,
+        evaluating the integrand using NumPy."""
+        kernel = get_kernel(self.expr)
+        kinds  = [self.kinds[name] for name in kernel.names]
+
+        # ... the inputs are broadcast to (n_test, n_trial, n_quad) for a
+        #     bilinear form, (n_test, n_quad) for a linear form
+        axes = {'trial': (None, slice(None), slice(None))}
+        if self.bilinear:
+            axes['test'] = (slice(None), None, slice(None))
+        # ...
+
+        def function(*args):
+            values  = list(args[:-2])
+            weights, out = args[-2:]
+
+            values = [np.asarray(v)[axes[k]] if k in axes else v
+                      for v, k in zip(values, kinds)]
+
+            shape = out.shape + weights.shape
+            out[...] = np.broadcast_to(kernel(*values), shape).dot(weights)
+
+        return function
+
+    def build(self, folder=None, use_pyccel=None):
+        """Compiles the kernel with pyccel, or uses NumPy if pyccel is not
+        available or the compilation fails."""
+        if use_pyccel is None:
+            use_pyccel = pyccel_available()
+
+        function = None
+        if use_pyccel:
+            if folder is None:
+                folder = default_cache_dir()
+
+            name = 'vale_kernel_{}'.format(self.hash[:16])
+            function = compile_source(self.source, name, folder)
+
+        self.compiled = not( function is None )
+        if function is None:
+            function = self._numpy_function()
+
+        self.function = function
+        return self
+
+    def __call__(self, weights, out=None, **kwargs):
+        """Computes the element vector, or matrix, and returns it. The
+        result is written in out if given."""
+        missing = [name for name in self.names if not( name in kwargs )]
+        if missing:
+            raise TypeError('missing values for {}'.format(', '.join(missing)))
+
+        values  = [kwargs[name] for name in self.names]
+        weights = np.ascontiguousarray(weights, dtype=float)
+
+        if out is None:
+            out = np.zeros(self._shape(kwargs))
+
+        values = [v if self.kinds[name] == 'constant'
+                  else np.ascontiguousarray(v, dtype=float)
+                  for name, v in zip(self.names, values)]
+
+        self.function(*(values + [weights, out]))
+
+        return out
+
+    def _shape(self, values):
+        """Returns the shape of the result, given by the inputs of the test
+        and trial functions."""
+        n_test = n_trial = None
+        for name in self.names:
+            shape = np.shape(values[name])
+            kind  = self.kinds[name]
+            if kind in ('test', 'pair'):
+                n_test = shape[0]
+            if kind == 'trial':
+                n_trial = shape[0]
+            if kind == 'pair':
+                n_trial = shape[1]
+
+        if n_test is None or ( self.bilinear and n_trial is None ):
+            raise TypeError('the size of the result can not be found, '
+                            'out must be given')
+
+        if self.bilinear:
+            return (n_test, n_trial)
+        return (n_test,)
+
+#======================================================================
+class FormKernels(object):
+    """Class representing the element kernels of a linear or bilinear form:
+    one kernel per nonzero block, by index of the test function, or of the
+    (test, trial) pair of functions. See ElementKernel.
+
+    >>> kernels = compile_form(get_by_name(ast, 'a13'))
+    >>> sorted(kernels.blocks)
+    [(0, 0), (0, 1), (1, 0)]
+    """
+    def __init__(self, blocks):
+        self.blocks = blocks
+
+    @property
+    def compiled(self):
+        """True if all the kernels are compiled by pyccel."""
+        return all(k.compiled for k in self.blocks.values())
+
+def get_element_kernel(expr, test_function, trial_function=None,
+                       folder=None, use_pyccel=None):
+    """Returns the ElementKernel of an integrand, built once per process
+    for a given source, folder and use of pyccel.
+
+    The kernels are first looked for by integrand and functions, so that
+    asking again for the kernel of a form neither generates nor hashes its
+    source. The kernels are built outside of the lock, so that different
+    kernels are compiled concurrently; a thread asking for a kernel being
+    built waits for it."""
+    if use_pyccel is None:
+        use_pyccel = pyccel_available()
+    if not use_pyccel:
+        folder = None
+    elif folder is None:
+        folder = default_cache_dir()
+
+    form = (expr, test_function, trial_function, bool(use_pyccel), folder)
+
+    found = _element_kernels_by_form.get(form, None)
+    if not( found is None ):
+        return found
+
+    kernel = ElementKernel(expr, test_function, trial_function)
+    key    = (kernel.hash, bool(use_pyccel), folder)
+
+    # ... the first thread asking for a kernel builds it
+    while True:
+        with _element_kernels_lock:
+            found = _element_kernels.get(key, None)
+            if not( found is None ):
+                _element_kernels_by_form[form] = found
+                return found
+
+            event = _element_kernels_building.get(key, None)
+            if event is None:
+                event = threading.Event()
+                _element_kernels_building[key] = event
+                break
+
+        event.wait()
+    # ...
+
+    try:
+        kernel.build(folder, use_pyccel)
+        with _element_kernels_lock:
+            _element_kernels[key] = kernel
+            _element_kernels_by_form[form] = kernel
+
+    finally:
+        with _element_kernels_lock:
+            del _element_kernels_building[key]
+        event.set()
+
+    return kernel
+
+def compile_form(form, folder=None, use_pyccel=None):
+    """Returns the FormKernels of a linear or bilinear form declaration.
+
+    folder: str
+        directory of the compiled kernels, see default_cache_dir.
+
+    use_pyccel: bool
+        if False, NumPy is used. By default, pyccel is used if available.
+    """
+    tests  = list(form.test_functions)
+    trials = list(form.trial_functions)
+
+    structure = block_structure(form.integrand, tests, trials)
+
+    blocks = {}
+    for key, block in structure.blocks.items():
+        functions = [tests[key[0]]] + [trials[j] for j in key[1:]]
+        blocks[key] = get_element_kernel(block, *functions,
+                                         folder=folder,
+                                         use_pyccel=use_pyccel)
+
+    return FormKernels(blocks)
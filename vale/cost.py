@@ -0,0 +1,206 @@
+# coding: utf-8
+
+import sys
+import argparse
+
+from sympy import Symbol, count_ops
+
+from .kernels import kernel_atoms, terminal_expr, derivative_order
+from .blocks import block_structure
+
+# Operations counted as floating point operations, the other ones being
+# calls to functions such as sin or exp
+_arithmetic = set(['ADD', 'SUB', 'MUL', 'DIV', 'NEG', 'POW'])
+
+#======================================================================
+class FormCost(object):
+    """Class representing the estimated cost of a form or equation, per
+    quadrature point:
+
+    * flops: the arithmetic operations of the integrand, the inputs (basis
+      functions, derivatives, fields) being given
+    * calls: the number of calls to every function, e.g. {'sin': 2}
+    * derivative_order: the highest derivative order of the inputs
+    * blocks: the number of nonzero (test, trial) blocks, or test components
+      for a linear form
+    * shape: the number of (test, trial) blocks, or test components
+    """
+    def __init__(self, name, kind, flops=0, calls=None, derivative_order=0,
+                 blocks=1, shape=(1,)):
+        self.name             = name
+        self.kind             = kind
+        self.flops            = flops
+        self.calls            = calls or {}
+        self.derivative_order = derivative_order
+        self.blocks           = blocks
+        self.shape            = shape
+
+    @property
+    def transcendentals(self):
+        """The total number of function calls."""
+        return sum(self.calls.values())
+
+    def as_dict(self):
+        return {'name':             self.name,
+                'kind':             self.kind,
+                'flops':            self.flops,
+                'calls':            dict(self.calls),
+                'transcendentals':  self.transcendentals,
+                'derivative_order': self.derivative_order,
+                'blocks':           self.blocks,
+                'shape':            self.shape}
+
+    def __str__(self):
+        size = 1
+        for n in self.shape:
+            size *= n
+        calls = ' '.join('{}:{}'.format(k, v)
+                         for k, v in sorted(self.calls.items()))
+        return '{:20s} {:15s} {:8d} {:8d} {:6d} {:>8s}  {}'.format(
+               self.name, self.kind, self.flops, self.transcendentals,
+               self.derivative_order, '{}/{}'.format(self.blocks, size),
+               calls)
+
+#======================================================================
+def operation_counts(expr):
+    """Returns the number of arithmetic operations of an integrand, and the
+    number of calls to every function. The inputs are not counted, the
+    differential operators being expanded to terminal derivatives."""
+    expr  = terminal_expr(expr)
+    atoms = kernel_atoms(expr)
+
+    subs = dict((atom, Symbol('_x{}'.format(i)))
+                for i, atom in enumerate(atoms))
+    ops  = count_ops(expr.xreplace(subs), visual=True)
+
+    flops = 0
+    calls = {}
+    for op, n in ops.as_coefficients_dict().items():
+        if not isinstance(op, Symbol):
+            continue
+
+        name = op.name
+        if name in _arithmetic:
+            flops += int(n)
+        else:
+            calls[name.lower()] = int(n)
+
+    return flops, calls
+
+def form_cost(token):
+    """Returns the FormCost of a form or equation declaration. The cost of
+    an equation is the cost of its two sides."""
+    kind   = token.__class__.__name__
+    tests  = list(getattr(token, 'test_functions', ()))
+    trials = list(getattr(token, 'trial_functions', ()))
+
+    integrand = getattr(token, 'integrand', None)
+    if integrand is None:
+        sides = [(token.lhs_integrand, trials), (token.rhs_integrand, [])]
+    else:
+        sides = [(integrand, trials)]
+
+    cost = FormCost(token.name, kind, blocks=0, shape=None)
+    for expr, functions in sides:
+        expr = terminal_expr(expr)
+
+        flops, calls = operation_counts(expr)
+        cost.flops += flops
+        for k, n in calls.items():
+            cost.calls[k] = cost.calls.get(k, 0) + n
+
+        cost.derivative_order = max(cost.derivative_order,
+                                    derivative_order(expr))
+
+        # the shape of an equation is the one of its left hand side
+        if cost.shape is None:
+            blocks = block_structure(expr, tests, functions)
+            cost.blocks = len(blocks.nonzero)
+            cost.shape  = blocks.shape
+
+    return cost
+
+#======================================================================
+class CostReport(object):
+    """Class representing the costs of the forms and equations of a model,
+    in the order of their declaration.
+
+    >>> report = cost_report(ast)
+    >>> print(report)
+    >>> report['l4'].calls
+    {'sin': 2}
+    """
+    def __init__(self, costs):
+        self.costs = costs
+
+    def __getitem__(self, name):
+        for c in self.costs:
+            if c.name == name:
+                return c
+        raise KeyError(name)
+
+    def sorted(self, key='flops'):
+        """Returns the costs, the most expensive first."""
+        return sorted(self.costs,
+                      key=lambda c: getattr(c, key), reverse=True)
+
+    def as_dict(self):
+        return [c.as_dict() for c in self.costs]
+
+    def __str__(self):
+        lines = ['{:20s} {:15s} {:>8s} {:>8s} {:>6s} {:>8s}  {}'.format(
+                 'name', 'kind', 'flops', 'calls', 'order', 'blocks',
+                 'functions')]
+        lines += [str(c) for c in self.costs]
+        return '\n'.join(lines)
+
+def cost_report(ast):
+    """Returns the CostReport of the forms and equations of an AST."""
+    costs = [form_cost(token) for token in ast.declarations
+             if not( getattr(token, 'integrand', None) is None and
+                     getattr(token, 'lhs_integrand', None) is None )]
+    return CostReport(costs)
+
+#======================================================================
+def main(argv=None):
+    """Console script printing the cost of the forms and equations of Vale
+    files."""
+    from .parser import Parser
+
+    parser = argparse.ArgumentParser(
+        description='Report the estimated cost, per quadrature point, of '
+                    'the forms and equations of Vale files.')
+
+    parser.add_argument('filenames', nargs='+', help='Vale files')
+    parser.add_argument('--sort', default=None,
+                        choices=['flops', 'transcendentals',
+                                 'derivative_order', 'blocks'],
+                        help='sort the forms, the most expensive first')
+    parser.add_argument('--json', action='store_true',
+                        help='print the report as JSON')
+
+    args = parser.parse_args(argv)
+
+    pde = Parser()
+    reports = []
+    for filename in args.filenames:
+        report = cost_report(pde.parse_from_file(filename))
+        if args.sort:
+            report = CostReport(report.sorted(args.sort))
+        reports.append((filename, report))
+
+    if args.json:
+        import json
+        print(json.dumps(dict((f, r.as_dict()) for f, r in reports),
+                         indent=2))
+
+    else:
+        for filename, report in reports:
+            if len(reports) > 1:
+                print('> {}'.format(filename))
+            print(report)
+
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
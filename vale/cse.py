@@ -0,0 +1,107 @@
+# coding: utf-8
+
+from collections import OrderedDict
+
+import numpy as np
+
+from sympy import Symbol, Tuple, cse, count_ops, lambdify, numbered_symbols
+from .kernels import kernel_atoms, terminal_expr, _atom_name
+
+#======================================================================
+class SharedDAG(object):
+    """Class representing the integrands of several forms and equations as
+    one DAG, in which the common subexpressions are computed once.
+
+    * atoms: the inputs, by name, as for a Kernel
+    * terms: the shared subexpressions, as (name, expression) pairs in the
+      order of evaluation; every term uses the inputs and the previous terms
+    * roots: the integrands, by name, using the inputs and the terms
+
+    Evaluating the DAG computes every shared term once for all the
+    quadrature points, and returns the values of all the integrands.
+
+    >>> dag = ast.dag
+    >>> values = dag(u=u, v=v, phi=phi, ...)
+    >>> values['a4']
+    """
+    def __init__(self, roots):
+        """
+        roots: list
+            (name, integrand) pairs.
+        """
+        keys  = [k for k,e in roots]
+        exprs = [terminal_expr(e) for k,e in roots]
+
+        # ... the inputs are replaced by symbols, so that only the sympy
+        #     operations are shared
+        atoms = kernel_atoms(Tuple(*exprs))
+
+        names = []
+        for atom in atoms:
+            names.append(_atom_name(atom, names))
+
+        symbols = [Symbol(name) for name in names]
+        subs    = dict(zip(atoms, symbols))
+        exprs   = [e.xreplace(subs) for e in exprs]
+        # ...
+
+        # ... temporaries are named _t0, _t1, ... to avoid the input names
+        terms, reduced = cse(exprs, symbols=numbered_symbols('_t'))
+        # ...
+
+        self.atoms   = dict(zip(names, atoms))
+        self.names   = names
+        self.terms   = [(str(t), e) for t,e in terms]
+        self.roots   = OrderedDict(zip(keys, reduced))
+        self.function = lambdify(symbols, reduced, modules='numpy',
+                                 dummify=False,
+                                 cse=lambda exprs: (terms, exprs))
+
+        self._exprs = exprs
+
+    def count_ops(self):
+        """Returns the number of operations of the integrands, evaluated
+        separately and using the DAG."""
+        separate = sum(count_ops(e) for e in self._exprs)
+        shared   = (sum(count_ops(e) for t,e in self.terms) +
+                    sum(count_ops(e) for e in self.roots.values()))
+        return separate, shared
+
+    def __call__(self, **kwargs):
+        """Evaluates all the integrands, the inputs being given by name.
+        Returns a dictionary of the values of every integrand."""
+        missing = [name for name in self.names if not( name in kwargs )]
+        if missing:
+            raise TypeError('missing values for {}'.format(', '.join(missing)))
+
+        values = [np.asarray(kwargs[name]) for name in self.names]
+        out = self.function(*values)
+
+        return OrderedDict(zip(self.roots.keys(), out))
+
+    def __str__(self):
+        lines  = ['{} = {}'.format(t, e) for t,e in self.terms]
+        lines += ['{} = {}'.format(k, e) for k,e in self.roots.items()]
+        return '\n'.join(lines)
+
+#======================================================================
+def form_integrands(ast):
+    """Returns the integrands of the forms and equations of an AST, as
+    (name, integrand) pairs. The sides of an equation are named
+    <name>.lhs and <name>.rhs."""
+    roots = []
+    for token in ast.declarations:
+        integrand = getattr(token, 'integrand', None)
+        if not( integrand is None ):
+            roots.append((token.name, integrand))
+
+        lhs = getattr(token, 'lhs_integrand', None)
+        if not( lhs is None ):
+            roots.append(('{}.lhs'.format(token.name), lhs))
+            roots.append(('{}.rhs'.format(token.name), token.rhs_integrand))
+
+    return roots
+
+def common_subexpressions(ast):
+    """Returns the SharedDAG of all the forms and equations of an AST."""
+    return SharedDAG(form_integrands(ast))
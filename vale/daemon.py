@@ -0,0 +1,315 @@
+# coding: utf-8
+
+import os
+import sys
+import stat
+import json
+import time
+import asyncio
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from .parser import Parser
+from .syntax import load_backend
+
+# Methods understood by the daemon
+_methods = ('parse', 'lower', 'stats', 'ping', 'shutdown')
+
+#======================================================================
+class Daemon(object):
+    """Class serving parse requests, keeping a warm parser.
+
+    The metamodel is compiled and the backend imported once, when the daemon
+    is created, so that a request only pays for its own parsing and
+    lowering. Requests and responses are JSON objects, one per line:
+
+    * {"id": 1, "method": "parse", "code": "..."}: returns the declarations
+      of the code, as (name, kind) pairs
+    * {"id": 2, "method": "lower", "filename": "...", "names": ["a1"]}: same
+      as parse, and also returns the lowered objects, as strings; names
+      selects some of them
+    * {"id": 3, "method": "stats"}: returns the number of requests served
+      and the uptime
+    * {"id": 4, "method": "ping"} and {"id": 5, "method": "shutdown"}
+
+    A response is {"id": ..., "ok": true, "result": ...} or
+    {"id": ..., "ok": false, "error": ...}. The requests are handled
+    concurrently, so the responses may be given in another order. With the
+    textX backend the parses are serialized, see Parser, so a daemon
+    serving several clients should use backend='fast'.
+
+    >>> daemon = Daemon(backend='fast')
+    >>> asyncio.run(daemon.serve_stdio())
+    """
+    def __init__(self, backend='textx', workers=None, cache_dir=None):
+        """
+        backend: str
+            'textx' or 'fast', see Parser.
+
+        workers: int
+            number of threads parsing the requests. The textX parses run
+            one at a time, whatever the number of threads.
+
+        cache_dir: str
+            directory of the lowered models cache, used for the files.
+        """
+        self.parser   = Parser(backend=backend, cache_dir=cache_dir)
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+
+        # imports sympde
+        load_backend()
+
+        self.requests = 0
+        self.errors   = 0
+        self.started  = time.time()
+
+        self._stopped = None
+
+    async def handle(self, request):
+        """Returns the response to a request, given as a dictionary."""
+        self.requests += 1
+        rid = request.get('id', None) if isinstance(request, dict) else None
+
+        try:
+            result = await self._dispatch(request)
+
+        except Exception as e:
+            self.errors += 1
+            return {'id': rid, 'ok': False, 'error': _format_error(e)}
+
+        return {'id': rid, 'ok': True, 'result': result}
+
+    async def _dispatch(self, request):
+        if not isinstance(request, dict):
+            raise ValueError('a request must be a JSON object')
+
+        method = request.get('method', None)
+        if not( method in _methods ):
+            raise ValueError('Unknown method {}, available: {}'
+                             .format(method, ', '.join(_methods)))
+
+        if method == 'ping':
+            return 'pong'
+
+        if method == 'stats':
+            return {'requests': self.requests,
+                    'errors':   self.errors,
+                    'uptime':   time.time() - self.started}
+
+        if method == 'shutdown':
+            self.stop()
+            return None
+
+        # ... parse or lower
+        code     = request.get('code', None)
+        filename = request.get('filename', None)
+        if code is None and filename is None:
+            raise ValueError('expecting code or filename')
+
+        if code is None:
+            ast = await self.parser.parse_from_file_async(filename,
+                                                          self.executor)
+        else:
+            ast = await self.parser.parse_async(code, self.executor)
+
+        result = {'declarations': [(token.name, token.__class__.__name__)
+                                   for token in ast.declarations]}
+
+        if method == 'lower':
+            names = request.get('names', None)
+            if names is None:
+                names = sorted(ast.namespace.keys())
+
+            result['namespace'] = dict((k, str(ast.namespace[k]))
+                                       for k in names)
+        # ...
+
+        return result
+
+    def stop(self):
+        if not( self._stopped is None ):
+            self._stopped.set()
+
+    #==================================================================
+    async def _until_stopped(self, coro):
+        """Returns the result of a read, or an empty line if the daemon is
+        stopped meanwhile."""
+        read    = asyncio.ensure_future(coro)
+        stopped = asyncio.ensure_future(self._stopped.wait())
+        await asyncio.wait([read, stopped],
+                           return_when=asyncio.FIRST_COMPLETED)
+
+        stopped.cancel()
+        if not read.done():
+            read.cancel()
+            return ''
+        return read.result()
+
+    async def _serve(self, reader, write):
+        """Handles the requests read from a stream, until its end or a
+        shutdown request."""
+        tasks = set()
+
+        async def respond(line):
+            try:
+                request = json.loads(line)
+            except ValueError as e:
+                self.requests += 1
+                self.errors   += 1
+                response = {'id': None, 'ok': False,
+                            'error': 'invalid JSON: {}'.format(e)}
+            else:
+                response = await self.handle(request)
+
+            await write(json.dumps(response) + '\n')
+
+        while not self._stopped.is_set():
+            line = await reader()
+            if not line:
+                break
+
+            if not line.strip():
+                continue
+
+            task = asyncio.ensure_future(respond(line))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+
+        if tasks:
+            await asyncio.wait(tasks)
+
+    async def serve_stdio(self, stdin=None, stdout=None):
+        """Serves the requests read from the standard input, and writes the
+        responses to the standard output."""
+        if stdin is None:
+            stdin = sys.stdin
+        if stdout is None:
+            stdout = sys.stdout
+
+        self._stopped = asyncio.Event()
+        loop  = asyncio.get_running_loop()
+        lines = asyncio.Queue()
+
+        # reading blocks, so it is done in a thread, which must not be
+        # waited for when stopping
+        def read():
+            try:
+                for line in iter(stdin.readline, ''):
+                    loop.call_soon_threadsafe(lines.put_nowait, line)
+                loop.call_soon_threadsafe(lines.put_nowait, '')
+            except RuntimeError:
+                # the event loop is closed
+                pass
+
+        threading.Thread(target=read, daemon=True).start()
+
+        async def reader():
+            return await self._until_stopped(lines.get())
+
+        async def write(txt):
+            stdout.write(txt)
+            stdout.flush()
+
+        await self._serve(reader, write)
+
+    async def serve_socket(self, path):
+        """Serves the requests of the clients connected to a unix socket,
+        until a shutdown request. A socket already at path is replaced;
+        FileExistsError is raised if path is another kind of file."""
+        self._stopped = asyncio.Event()
+
+        async def client(stream_reader, stream_writer):
+            lock = asyncio.Lock()
+
+            async def write(txt):
+                async with lock:
+                    stream_writer.write(txt.encode('utf-8'))
+                    await stream_writer.drain()
+
+            async def reader():
+                return await self._until_stopped(stream_reader.readline())
+
+            try:
+                await self._serve(reader, write)
+            finally:
+                stream_writer.close()
+
+        # a socket left by a previous daemon is replaced, any other file is
+        # kept
+        if _remove_socket(path) is False:
+            raise FileExistsError('{} exists and is not a socket'.format(path))
+
+        server = await asyncio.start_unix_server(client, path=path)
+        try:
+            await self._stopped.wait()
+        finally:
+            server.close()
+            await server.wait_closed()
+            _remove_socket(path)
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+
+def _remove_socket(path):
+    """Removes a unix socket. Returns True if it was removed, None if the
+    path does not exist and False if it is not a socket."""
+    try:
+        mode = os.lstat(path).st_mode
+    except FileNotFoundError:
+        return None
+
+    if not stat.S_ISSOCK(mode):
+        return False
+
+    os.remove(path)
+    return True
+
+def _format_error(e):
+    """Returns the message of an error, with its position if known."""
+    message = '{}: {}'.format(e.__class__.__name__, e)
+    if not( getattr(e, 'line', None) is None ):
+        message = '{} at line {}, col {}'.format(message, e.line,
+                                                  getattr(e, 'col', None))
+    return message
+
+#======================================================================
+def main(argv=None):
+    """Console script serving parse requests, over the standard input and
+    output or a unix socket."""
+    parser = argparse.ArgumentParser(
+        description='Serve Vale parse requests, keeping the parser warm.')
+
+    parser.add_argument('--socket', default=None,
+                        help='path of a unix socket to listen on '
+                             '(default: standard input and output)')
+    parser.add_argument('--backend', default='textx',
+                        choices=['textx', 'fast'],
+                        help='parser backend (default: textx); textX '
+                             'parses are serialized, use fast to parse '
+                             'concurrently')
+    parser.add_argument('-j', '--workers', type=int, default=None,
+                        help='number of parsing threads')
+    parser.add_argument('--cache-dir', default=None,
+                        help='directory of the lowered models cache')
+
+    args = parser.parse_args(argv)
+
+    daemon = Daemon(backend=args.backend, workers=args.workers,
+                    cache_dir=args.cache_dir)
+    try:
+        if args.socket:
+            asyncio.run(daemon.serve_socket(args.socket))
+        else:
+            asyncio.run(daemon.serve_stdio())
+
+    except KeyboardInterrupt:
+        pass
+
+    finally:
+        daemon.close()
+
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
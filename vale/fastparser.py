@@ -0,0 +1,594 @@
+# coding: utf-8
+
+"""Hand-written parser for the Vale grammar.
+
+The code is split in tokens by one regular expression, then parsed by
+recursive descent, following the rules of grammar.tx. Apart from the choice
+between the declarations, the grammar only needs one token of look ahead,
+so that nothing is parsed twice, while the PEG parser of textX backtracks.
+
+The parser produces the same objects as textX: the user classes are
+instantiated without calling their constructors, every attribute of the
+rule is set, with the textX default when absent, and the constructors are
+called at the end of the parse, children first, with the attributes of the
+rule and the parent object. Rules without user class give instances of
+generic classes named after the rule.
+
+>>> model = FastMetamodel(classes=_classes)
+>>> ast = model.model_from_str(instructions)
+"""
+
+import re
+
+#======================================================================
+class ParseError(Exception):
+    """Class representing a syntax error, at the given line and column."""
+    def __init__(self, message, line=None, col=None, filename=None):
+        self.message  = message
+        self.line     = line
+        self.col      = col
+        self.filename = filename
+
+        super(ParseError, self).__init__(message)
+
+    def __str__(self):
+        return '{}:{}:{}: {}'.format(self.filename, self.line, self.col,
+                                     self.message)
+
+class _NoMatch(Exception):
+    pass
+
+#======================================================================
+class Node(object):
+    """Base class of the objects of the rules without user class."""
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+# ... attributes of the rules, with their default values as given by textX
+#     when they are absent; lists are copied
+_rules = {
+    'PDE':                 [('declarations', [])],
+    'Domain':              [('dim', 0), ('filename', ''), ('name', '')],
+    'FunctionSpace':       [('domain', ''), ('kind', ''), ('name', '')],
+    'VectorFunctionSpace': [('domain', ''), ('kind', ''), ('name', '')],
+    'Field':               [('space', ''), ('name', '')],
+    'Function':            [('parameters', []), ('name', '')],
+    'Alias':               [('name', ''), ('rhs', None)],
+    'Equation':            [('trials', None), ('lhs', None), ('rhs', None),
+                            ('tests', None), ('bc', []), ('name', '')],
+    'BoundaryCondition':   [('lhs', None), ('rhs', None), ('boundary', '')],
+    'Real':                [('name', '')],
+    'Complex':             [('name', '')],
+    'LinearForm':          [('name', ''), ('args', None), ('body', None)],
+    'BilinearForm':        [('name', ''), ('args_test', None),
+                            ('args_trial', None), ('body', None)],
+    'SimpleBodyForm':      [('expression', None), ('domain', '')],
+    'ArgFormSep':          [('functions', []), ('space', '')],
+    'ArgFormParen':        [('functions', []), ('space', '')],
+    'Expression':          [('op', [])],
+    'Term':                [('op', [])],
+    'Factor':              [('op', None), ('sign', None), ('trailer', None),
+                            ('exponent', None)],
+    'Trailer':             [('args', [])],
+    'Operand':             [('op', None)],
+    'TestFunction':        [('name', '')],
+}
+# ...
+
+# ... tokens; the numbers are unsigned, a sign is part of a number only
+#     where the grammar expects one, as textX does
+_number_kinds = ('FLOAT', 'INT')
+
+_token_re = re.compile(r'''
+    (?P<STRING>"(\\"|[^"])*"|'(\\'|[^'])*')
+  | (?P<FLOAT>(((\d+\.(\d*)?|\.\d+)([eE][+-]?\d+)?)|((\d+)([eE][+-]?\d+)))
+              (?<=[\w\.])(?![\w\.]))
+  | (?P<INT>[0-9]+)
+  | (?P<ID>[^\d\W]\w*\b)
+  | (?P<OP>\*\*|::|[(),=:<>+\-*/])
+''', re.VERBOSE)
+
+# whitespaces and comments
+_skip_re = re.compile(r'(?:[ \t\r\n]+|\#.*)*')
+
+def tokenize(text):
+    """Returns the tokens of a Vale code, as a list of (kind, value, start,
+    end) tuples, ending with an EOF token."""
+    tokens = []
+    append = tokens.append
+
+    skip  = _skip_re.match
+    match = _token_re.match
+
+    n   = len(text)
+    pos = skip(text, 0).end()
+    while pos < n:
+        m = match(text, pos)
+        if m is None:
+            append(('ERROR', text[pos], pos, pos + 1))
+            break
+
+        end = m.end()
+        append((m.lastgroup, m.group(), pos, end))
+        pos = skip(text, end).end()
+
+    append(('EOF', None, n, n))
+    return tokens
+# ...
+
+#======================================================================
+class FastMetamodel(object):
+    """Class parsing Vale codes, with the interface of a textX metamodel.
+
+    classes: list
+        the user classes, matched by name with the rules of the grammar.
+    """
+    def __init__(self, classes=None):
+        if classes is None:
+            classes = []
+
+        user = dict((cls.__name__, cls) for cls in classes)
+
+        self.classes = {}
+        for rule in _rules:
+            if rule in user:
+                self.classes[rule] = user[rule]
+            else:
+                self.classes[rule] = type(rule, (Node,), {})
+
+        self.user_classes = frozenset(user[rule] for rule in _rules
+                                      if rule in user)
+
+    def model_from_str(self, text, file_name=None):
+        """Parses a Vale code and returns its PDE object."""
+        return _Parse(self, text, file_name).run()
+
+    def model_from_file(self, filename):
+        with open(filename) as f:
+            return self.model_from_str(f.read(), file_name=filename)
+
+#======================================================================
+class _Parse(object):
+    """State of the parse of one code."""
+    def __init__(self, metamodel, text, filename):
+        self.metamodel = metamodel
+        self.classes   = metamodel.classes
+        self.user      = metamodel.user_classes
+        self.text      = text
+        self.filename  = filename
+
+        self.tokens = tokenize(text)
+        self.i      = 0
+
+        # objects whose constructor is called at the end, with their
+        # attributes
+        self.created = []
+
+        # furthest position where a token did not match, and the expected
+        # tokens
+        self.error_pos = -1
+        self.expected  = []
+
+    # ... helpers
+    def make(self, rule, start, **attrs):
+        """Creates the object of a rule, starting at the token start, and
+        sets it as the parent of its children."""
+        cls = self.classes[rule]
+        obj = cls.__new__(cls)
+
+        for k, default in _rules[rule]:
+            if not( k in attrs ):
+                if default.__class__ is list:
+                    default = []
+                attrs[k] = default
+
+        obj.__dict__.update(attrs)
+        obj._tx_position = self.tokens[start][2]
+
+        # children of the object
+        for v in attrs.values():
+            if isinstance(v, Node) or v.__class__ in self.user:
+                v.parent = obj
+
+            elif v.__class__ is list:
+                for x in v:
+                    if isinstance(x, Node) or x.__class__ in self.user:
+                        x.parent = obj
+
+        if cls in self.user:
+            self.created.append((obj, attrs))
+
+        return obj
+
+    def fail(self, expected):
+        start = self.tokens[self.i][2]
+        if start > self.error_pos:
+            self.error_pos = start
+            self.expected  = [expected]
+
+        elif start == self.error_pos and not( expected in self.expected ):
+            self.expected.append(expected)
+
+        raise _NoMatch()
+
+    def peek(self, value, k=0):
+        """Returns True if the k-th next token is the operator or keyword
+        value."""
+        kind, v, pos, end = self.tokens[self.i + k]
+        return v == value and kind in ('OP', 'ID')
+
+    def expect(self, value):
+        """Consumes the operator or keyword value."""
+        kind, v, pos, end = self.tokens[self.i]
+        if not( v == value and kind in ('OP', 'ID') ):
+            self.fail(repr(value))
+        self.i += 1
+
+    def accept(self, value):
+        """Consumes the operator or keyword value if it is the next token."""
+        kind, v, pos, end = self.tokens[self.i]
+        if v == value and kind in ('OP', 'ID'):
+            self.i += 1
+            return True
+        return False
+
+    def ident(self):
+        kind, v, pos, end = self.tokens[self.i]
+        if not( kind == 'ID' ):
+            self.fail('ID')
+        self.i += 1
+        return v
+
+    def string(self):
+        kind, v, pos, end = self.tokens[self.i]
+        if not( kind == 'STRING' ):
+            self.fail('STRING')
+        self.i += 1
+        return v[1:-1].replace(r'\"', r'"').replace(r"\'", "'")
+
+    def signed(self, kinds):
+        """Returns the number of the given kinds, with its sign if it is
+        written right before it, or None."""
+        tokens = self.tokens
+        i = self.i
+
+        sign = ''
+        kind, v, _, end = tokens[i]
+        if kind == 'OP' and v in ('+', '-'):
+            k, n, s, e = tokens[i + 1]
+            if not( k in kinds and s == end ):
+                return None
+            sign = v
+            kind, v = k, n
+            i += 1
+
+        if not( kind in kinds ):
+            return None
+
+        self.i = i + 1
+        if kind == 'INT':
+            return int(sign + v)
+        return float(sign + v)
+
+    # ... rules
+    def pde(self):
+        declarations = []
+        while not( self.tokens[self.i][0] == 'EOF' ):
+            declarations.append(self.declaration())
+
+        return self.make('PDE', 0, declarations=declarations)
+
+    def declaration(self):
+        """Tries the declarations in the order of the grammar."""
+        i = self.i
+        n = len(self.created)
+        for rule in (self.domain, self.space, self.field, self.real,
+                     self.complex, self.function, self.equation, self.alias,
+                     self.form):
+            try:
+                return rule()
+            except _NoMatch:
+                self.i = i
+                del self.created[n:]
+
+        raise _NoMatch()
+
+    def domain(self):
+        start = self.i
+        self.expect('Domain')
+        self.expect('(')
+
+        attrs = {}
+        if self.accept('dim'):
+            self.expect('=')
+            dim = self.signed(('INT',))
+            if dim is None:
+                self.fail('INT')
+            attrs['dim'] = dim
+
+        if self.accept('filename'):
+            self.expect('=')
+            attrs['filename'] = self.string()
+
+        self.expect(')')
+        self.definition()
+        attrs['name'] = self.ident()
+        return self.make('Domain', start, **attrs)
+
+    def space(self):
+        start = self.i
+        kind, v, pos, end = self.tokens[self.i]
+        if not( kind == 'ID' and v in ('FunctionSpace',
+                                       'VectorFunctionSpace') ):
+            self.fail("'FunctionSpace' or 'VectorFunctionSpace'")
+        self.i += 1
+
+        self.expect('(')
+        attrs = {'domain': self.ident()}
+        if self.accept(','):
+            self.expect('kind')
+            self.expect('=')
+            attrs['kind'] = self.string()
+        self.expect(')')
+
+        self.definition()
+        attrs['name'] = self.ident()
+        return self.make(v, start, **attrs)
+
+    def field(self):
+        start = self.i
+        self.expect('Field')
+        self.expect('(')
+        space = self.ident()
+        self.expect(')')
+        self.definition()
+        return self.make('Field', start, space=space, name=self.ident())
+
+    def function(self):
+        start = self.i
+        self.expect('Function')
+        self.expect('(')
+
+        parameters = []
+        if self.tokens[self.i][0] == 'ID':
+            parameters.append(self.ident())
+            while self.accept(','):
+                parameters.append(self.ident())
+
+        self.expect(')')
+        self.definition()
+        return self.make('Function', start, parameters=parameters,
+                         name=self.ident())
+
+    def real(self):
+        start = self.i
+        self.expect('Real')
+        self.definition()
+        return self.make('Real', start, name=self.ident())
+
+    def complex(self):
+        start = self.i
+        self.expect('Complex')
+        self.definition()
+        return self.make('Complex', start, name=self.ident())
+
+    def alias(self):
+        start = self.i
+        name = self.ident()
+        self.definition()
+        return self.make('Alias', start, name=name, rhs=self.expression())
+
+    def definition(self):
+        # DEF: "::" | "="
+        if not( self.accept('::') or self.accept('=') ):
+            self.fail("'::' or '='")
+
+    def equation(self):
+        start = self.i
+        self.expect('find')
+        trials = self.argform()
+        self.expect('such')
+        self.expect('that')
+
+        lhs = self.expression()
+        self.expect('=')
+        rhs = self.expression()
+
+        self.expect('forall')
+        tests = self.argform()
+
+        attrs = {'trials': trials, 'lhs': lhs, 'rhs': rhs, 'tests': tests}
+        if self.accept('and'):
+            bc = [self.boundary_condition()]
+            while self.accept('and'):
+                bc.append(self.boundary_condition())
+            attrs['bc'] = bc
+
+        if self.accept('label'):
+            self.expect(':')
+            attrs['name'] = self.string()
+
+        return self.make('Equation', start, **attrs)
+
+    def boundary_condition(self):
+        start = self.i
+        lhs = self.expression()
+        self.expect('=')
+        rhs = self.expression()
+        self.expect('on')
+        return self.make('BoundaryCondition', start, lhs=lhs, rhs=rhs,
+                         boundary=self.string())
+
+    def form(self):
+        start = self.i
+        name = self.ident()
+        self.expect('(')
+        args = self.argform()
+
+        if self.accept(','):
+            args_trial = self.argform()
+            self.expect(')')
+            self.definition()
+            return self.make('BilinearForm', start, name=name,
+                             args_test=args, args_trial=args_trial,
+                             body=self.body())
+
+        self.expect(')')
+        self.definition()
+        return self.make('LinearForm', start, name=name, args=args,
+                         body=self.body())
+
+    def body(self):
+        start = self.i
+        if not self.accept('<'):
+            return self.expression()
+
+        expression = self.expression()
+        self.expect('>')
+
+        # SUBSCRIPT is also the first character of an identifier
+        attrs = {'expression': expression}
+        kind, v, pos, end = self.tokens[self.i]
+        if kind == 'ID' and v == '_':
+            self.i += 1
+            attrs['domain'] = self.ident()
+
+        elif kind == 'ID' and v.startswith('_') and not v[1].isdigit():
+            self.i += 1
+            attrs['domain'] = v[1:]
+
+        return self.make('SimpleBodyForm', start, **attrs)
+
+    def argform(self):
+        start = self.i
+        if self.accept('('):
+            functions = self.test_functions()
+            self.expect(')')
+            rule = 'ArgFormParen'
+        else:
+            functions = self.test_functions()
+            rule = 'ArgFormSep'
+
+        self.expect('::')
+        return self.make(rule, start, functions=functions, space=self.ident())
+
+    def test_functions(self):
+        functions = [self.make('TestFunction', self.i, name=self.ident())]
+        while self.accept(','):
+            functions.append(self.make('TestFunction', self.i,
+                                       name=self.ident()))
+        return functions
+
+    # ... expressions
+    def expression(self):
+        start = self.i
+        op = [self.term()]
+        tokens = self.tokens
+        while True:
+            kind, v, pos, end = tokens[self.i]
+            if not( kind == 'OP' and v in ('+', '-') ):
+                break
+            self.i += 1
+            op.append(v)
+            op.append(self.term())
+        return self.make('Expression', start, op=op)
+
+    def term(self):
+        start = self.i
+        op = [self.factor()]
+        tokens = self.tokens
+        while True:
+            kind, v, pos, end = tokens[self.i]
+            if not( kind == 'OP' and v in ('*', '/') ):
+                break
+            self.i += 1
+            op.append(v)
+            op.append(self.factor())
+        return self.make('Term', start, op=op)
+
+    def factor(self):
+        # Factor: (sign=PlusOrMinus)? op=Operand (trailer=Trailer)?
+        #         ('**' exponent=Factor)?
+        start = self.i
+        kind, v, pos, end = self.tokens[self.i]
+
+        sign = None
+        if kind == 'OP' and v in ('+', '-'):
+            sign = v
+            self.i += 1
+
+        op = self.operand()
+
+        trailer = None
+        if self.peek('('):
+            trailer = self.trailer()
+
+        exponent = None
+        if self.accept('**'):
+            exponent = self.factor()
+
+        return self.make('Factor', start, op=op, sign=sign, trailer=trailer,
+                         exponent=exponent)
+
+    def trailer(self):
+        start = self.i
+        self.expect('(')
+        args = []
+        if not self.peek(')'):
+            args.append(self.expression())
+            while self.accept(','):
+                args.append(self.expression())
+        self.expect(')')
+        return self.make('Trailer', start, args=args)
+
+    def operand(self):
+        # Operand: (op=NUMBER) | (op=ID) | (LPAREN op=Expression RPAREN)
+        start = self.i
+        number = self.signed(_number_kinds)
+        if not( number is None ):
+            return self.make('Operand', start, op=number)
+
+        kind, v, pos, end = self.tokens[self.i]
+        if kind == 'ID':
+            self.i += 1
+            return self.make('Operand', start, op=v)
+
+        if kind == 'OP' and v == '(':
+            self.i += 1
+            op = self.expression()
+            self.expect(')')
+            return self.make('Operand', start, op=op)
+
+        self.fail('NUMBER or ID or LPAREN')
+
+    # ...
+    def run(self):
+        """Parses the code, then calls the constructors of the user
+        classes."""
+        try:
+            model = self.pde()
+        except _NoMatch:
+            raise self.error()
+
+        for obj, attrs in self.created:
+            parent = obj.__dict__.get('parent', None)
+            if not( parent is None ):
+                attrs['parent'] = parent
+            obj.__init__(**attrs)
+
+        return model
+
+    def error(self):
+        """Returns the ParseError at the furthest position reached."""
+        text = self.text
+        pos  = max(self.error_pos, 0)
+
+        line = text.count('\n', 0, pos) + 1
+        col  = pos - text.rfind('\n', 0, pos)
+
+        context = text[max(pos - 10, 0):pos] + '*' + text[pos:pos + 10]
+        message = 'Expected {} => {!r}'.format(' or '.join(self.expected),
+                                                context)
+
+        return ParseError(message, line=line, col=col,
+                          filename=self.filename)
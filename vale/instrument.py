@@ -0,0 +1,272 @@
+# coding: utf-8
+
+import sys
+import time
+import threading
+import tracemalloc
+
+#======================================================================
+class Event(object):
+    """Class representing a measured phase.
+
+    * phase: grammar, cache, model_from_str, declaration or lower
+    * name: the name of the declaration, or the class of the lowered node
+    * kind: the class of the declaration
+    * time: the elapsed time in seconds, including the nested phases
+    * self_time: the elapsed time in seconds, without the nested phases
+    * allocated: the memory allocated, in bytes, if allocations are traced
+    """
+    def __init__(self, phase, name=None, kind=None, time=0., self_time=0.,
+                 allocated=None):
+        self.phase     = phase
+        self.name      = name
+        self.kind      = kind
+        self.time      = time
+        self.self_time = self_time
+        self.allocated = allocated
+
+    def as_dict(self):
+        return {'phase':     self.phase,
+                'name':      self.name,
+                'kind':      self.kind,
+                'time':      self.time,
+                'self_time': self.self_time,
+                'allocated': self.allocated}
+
+    def __str__(self):
+        txt = '{:15s} {:20s} {:10.3f} ms'.format(self.phase,
+                                                 str(self.name or ''),
+                                                 self.time * 1e3)
+        if not( self.allocated is None ):
+            txt += ' {:10.1f} KiB'.format(self.allocated / 1024.)
+        return txt
+
+#======================================================================
+class Instrumentation(object):
+    """Class measuring the time, and optionally the memory allocations, of
+    the parsing phases:
+
+    * grammar: loading the metamodel
+    * cache: loading a lowered model from the cache
+    * model_from_str: the textX parse, including the nested phases
+    * declaration: the constructor of a declaration, e.g. a13
+    * lower: the lowering of an expression node
+
+    Every measured phase is given to the callbacks, as an Event, and kept
+    for the report.
+
+    >>> instrumentation = Instrumentation(callbacks=[print_event])
+    >>> ast = Parser(instrumentation=instrumentation).parse_from_file(filename)
+    >>> instrumentation.report()
+    """
+    def __init__(self, callbacks=None, allocations=False):
+        """
+        callbacks: list
+            functions called with every Event.
+
+        allocations: bool
+            if True, the memory allocations are traced using tracemalloc,
+            which slows down the parsing.
+        """
+        if callbacks is None:
+            callbacks = []
+
+        self.callbacks   = list(callbacks)
+        self.allocations = allocations
+        self.events      = []
+
+        # True if tracemalloc was started by this object, and the number of
+        # phases measuring the allocations, in all the threads
+        self._tracing = False
+        self._active  = 0
+        self._lock    = threading.Lock()
+
+        # phases being measured, per thread
+        self._local = threading.local()
+
+    def add_callback(self, callback):
+        self.callbacks.append(callback)
+
+    def clear(self):
+        self.events = []
+
+    def _stack(self):
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = []
+            self._local.stack = stack
+        return stack
+
+    def begin(self, phase):
+        """Starts measuring a phase."""
+        memory = None
+        if self.allocations:
+            with self._lock:
+                self._active += 1
+                if not tracemalloc.is_tracing():
+                    tracemalloc.start()
+                    self._tracing = True
+                memory = tracemalloc.get_traced_memory()[0]
+
+        # the last item is the time spent in the nested phases
+        self._stack().append([phase, time.perf_counter(), memory, 0.])
+
+    def end(self, name=None, kind=None):
+        """Stops measuring the current phase and returns its Event."""
+        te = time.perf_counter()
+
+        stack = self._stack()
+        phase, tb, memory, nested = stack.pop()
+
+        elapsed = te - tb
+        if stack:
+            stack[-1][3] += elapsed
+
+        allocated = None
+        if not( memory is None ):
+            with self._lock:
+                allocated = tracemalloc.get_traced_memory()[0] - memory
+
+                # stop tracing once no phase is measured, in any thread
+                self._active -= 1
+                if self._tracing and self._active == 0:
+                    tracemalloc.stop()
+                    self._tracing = False
+
+        event = Event(phase, name=name, kind=kind, time=elapsed,
+                      self_time=elapsed - nested, allocated=allocated)
+
+        self.events.append(event)
+        for callback in self.callbacks:
+            callback(event)
+
+        return event
+
+    def report(self):
+        """Returns the measures as a dictionary.
+
+        * phases: the number of calls, time, self time and allocations of
+          every phase
+        * declarations: the measures of every declaration constructor
+        * events: all the measured events
+        """
+        phases = {}
+        for e in self.events:
+            p = phases.setdefault(e.phase, {'count': 0, 'time': 0.,
+                                            'self_time': 0., 'allocated': 0})
+            p['count']     += 1
+            p['time']      += e.time
+            p['self_time'] += e.self_time
+            if not( e.allocated is None ):
+                p['allocated'] += e.allocated
+
+        declarations = [e.as_dict() for e in self.events
+                        if e.phase == 'declaration']
+
+        return {'phases':       phases,
+                'declarations': declarations,
+                'events':       [e.as_dict() for e in self.events]}
+
+#======================================================================
+def print_event(event):
+    """Callback printing the measured phases, except the lowering of the
+    expression nodes."""
+    if not( event.phase == 'lower' ):
+        sys.stdout.write('{}\n'.format(event))
+
+#======================================================================
+class RuleProfile(object):
+    """Class counting, for every rule of a textX grammar, how often it is
+    tried while parsing:
+
+    * calls: the number of attempts to match the rule
+    * failures: the attempts that did not match
+    * retries: the attempts at a position where the rule was already tried,
+      i.e. the input parsed again after a backtrack
+
+    The Arpeggio parsing expressions are patched inside the with statement,
+    for all the parsers of the process; the caller makes sure that no other
+    parse runs meanwhile.
+
+    >>> with RuleProfile() as profile:
+    ...     metamodel.model_from_str(instructions)
+    >>> print(profile)
+    """
+    def __init__(self):
+        self.rules = {}
+
+        # (rule, position) pairs already tried
+        self._tried = set()
+
+        self._saved = None
+
+    def record(self, rule, position, matched):
+        counts = self.rules.get(rule, None)
+        if counts is None:
+            counts = [0, 0, 0]
+            self.rules[rule] = counts
+
+        counts[0] += 1
+        if not matched:
+            counts[1] += 1
+
+        key = (rule, position)
+        if key in self._tried:
+            counts[2] += 1
+        else:
+            self._tried.add(key)
+
+    def _wrap(self, parse):
+        from arpeggio import NoMatch
+
+        record = self.record
+        def wrapper(expression, parser):
+            # only the rules of the grammar, not the expressions made by
+            # textX for the assignments
+            rule = expression.rule_name
+            if not rule or rule.startswith('__'):
+                return parse(expression, parser)
+
+            position = parser.position
+            try:
+                result = parse(expression, parser)
+            except NoMatch:
+                record(rule, position, False)
+                raise
+
+            record(rule, position, True)
+            return result
+
+        return wrapper
+
+    def __enter__(self):
+        from arpeggio import ParsingExpression, Match
+
+        self._saved = [(cls, cls.__dict__['parse'])
+                       for cls in (ParsingExpression, Match)]
+        for cls, parse in self._saved:
+            cls.parse = self._wrap(parse)
+
+        return self
+
+    def __exit__(self, *args):
+        for cls, parse in self._saved:
+            cls.parse = parse
+        self._saved = None
+
+    def report(self):
+        """Returns the counts of every rule as a dictionary."""
+        return dict((rule, {'calls': c[0], 'failures': c[1], 'retries': c[2]})
+                    for rule, c in self.rules.items())
+
+    def __str__(self):
+        lines = ['{:25s} {:>10s} {:>10s} {:>10s}'.format('rule', 'calls',
+                                                         'failures',
+                                                         'retries')]
+
+        # the most backtracked rules first
+        rules = sorted(self.rules.items(), key=lambda x: (-x[1][2], x[0]))
+        for rule, c in rules:
+            lines.append('{:25s} {:10d} {:10d} {:10d}'.format(rule, *c))
+
+        return '\n'.join(lines)
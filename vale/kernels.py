@@ -0,0 +1,408 @@
+# coding: utf-8
+
+import re
+import keyword
+import threading
+
+import numpy as np
+
+from sympy import Symbol, Indexed, IndexedBase, Dummy, Add, Mul
+from sympy import lambdify, preorder_traversal, sympify, default_sort_key
+from sympy.core.function import AppliedUndef
+
+# Kernels already generated, by integrand and functions of the form
+_kernels = {}
+_kernels_lock = threading.Lock()
+
+# Integrands already expanded to terminal derivatives, see terminal_expr
+_terminal_exprs = {}
+
+# The partial derivatives, by direction
+_partials = ['dx', 'dy', 'dz']
+
+# Order of the differential operators; the partial derivatives are dx, dy,
+# dz, dx1, ...
+_derivatives = {'grad': 1, 'div': 1, 'rot': 1, 'curl': 1,
+                'laplace': 2, 'hessian': 2}
+_partial_derivative = re.compile(r'^d[xyz][0-9]*$')
+
+#======================================================================
+def is_kernel_atom(expr):
+    """Returns True if a node of an integrand is an input of its kernel.
+
+    The symbols, the objects of the backend (test functions and their
+    derivatives, fields, constants, coordinates) and the indexed components
+    are given as arrays, while the sympy operations and functions are
+    evaluated using NumPy.
+    """
+    if isinstance(expr, (Symbol, Indexed, AppliedUndef)):
+        return True
+
+    if expr.is_number:
+        return False
+
+    module = expr.__class__.__module__ or ''
+    if not module.startswith('sympy.'):
+        return True
+
+    return not expr.args
+
+def kernel_atoms(expr):
+    """Returns the inputs of the kernel of an integrand, sorted."""
+    atoms = set()
+
+    nodes = preorder_traversal(expr)
+    for node in nodes:
+        if is_kernel_atom(node):
+            atoms.add(node)
+            nodes.skip()
+
+    return sorted(atoms, key=default_sort_key)
+
+def derivative_order(expr):
+    """Returns the highest derivative order in an expression."""
+    orders = {}
+
+    # post-order walk, without recursion
+    stack = [(expr, False)]
+    while stack:
+        node, visited = stack.pop()
+        if not visited:
+            stack.append((node, True))
+            stack.extend((arg, False) for arg in node.args)
+            continue
+
+        order = max([orders[arg] for arg in node.args] or [0])
+
+        name = getattr(node.func, '__name__', '')
+        name = name.lower() if isinstance(name, str) else ''
+        if _partial_derivative.match(name):
+            order += 1
+        else:
+            order += _derivatives.get(name, 0)
+
+        orders[node] = order
+
+    return orders[expr]
+
+#======================================================================
+def _backend():
+    from . import syntax
+    syntax.load_backend()
+    return syntax
+
+def _dimension(expr, syntax):
+    """Returns the dimension of the domain of the functions and fields of
+    an expression, or None if it has none."""
+    for node in preorder_traversal(expr):
+        space = getattr(node, 'space', None)
+        if space is None:
+            continue
+
+        dim = getattr(space, 'ldim', None)
+        if dim is None:
+            dim = getattr(getattr(space, 'domain', None), 'dim', None)
+        if not( dim is None ):
+            return int(dim)
+
+    return None
+
+def _component(expr, i):
+    try:
+        return expr[i]
+    except TypeError:
+        return IndexedBase(expr)[i]
+
+def _elementwise(f, *args):
+    if isinstance(args[0], list):
+        return [_elementwise(f, *xs) for xs in zip(*args)]
+    return f(*args)
+
+def _entries(a):
+    if isinstance(a, list):
+        return [x for ai in a for x in _entries(ai)]
+    return [a]
+
+def _partial_atom(k, atom, syntax):
+    """Returns the derivative of an input in the direction k."""
+    functions = (syntax.sym_TestFunction, syntax.sym_VectorTestFunction,
+                 syntax.sym_Field, syntax.sym_VectorField)
+    normals   = (syntax.sym_NormalVector, syntax.sym_TangentVector)
+
+    # ... coordinates, constants and the components of the normal vectors
+    if isinstance(atom, Symbol) and not isinstance(atom, functions):
+        return 1 if atom.name == 'xyz'[k] else 0
+
+    if isinstance(atom, Indexed) and isinstance(atom.base.label, normals):
+        return 0
+    # ...
+
+    return syntax._known_operators[_partials[k]](atom)
+
+def _partial(k, expr, syntax):
+    """Returns the derivative of a scalar expression in the direction k,
+    written using the derivatives of its inputs."""
+    expr = sympify(expr)
+    if expr.is_number:
+        return 0
+
+    atoms = kernel_atoms(expr)
+    if atoms == [expr]:
+        return _partial_atom(k, expr, syntax)
+
+    # ... chain rule, the inputs being replaced by dummy symbols
+    dummies = [Dummy() for atom in atoms]
+    back    = dict(zip(dummies, atoms))
+    expr    = expr.xreplace(dict(zip(atoms, dummies)))
+
+    return Add(*[expr.diff(d).xreplace(back) * _partial_atom(k, atom, syntax)
+                 for d, atom in zip(dummies, atoms)])
+
+def _terminal(expr, dim, syntax):
+    """Expands an expression to terminal derivatives. Returns a scalar
+    expression, or a list for a vector and a list of rows for a matrix."""
+    vectors = (syntax.sym_VectorTestFunction, syntax.sym_VectorField,
+               syntax.sym_NormalVector, syntax.sym_TangentVector)
+    if isinstance(expr, vectors):
+        if dim is None:
+            raise ValueError('the dimension of {} can not be found'.format(expr))
+        return [_component(expr, i) for i in range(dim)]
+
+    if not expr.args or isinstance(expr, Indexed):
+        return expr
+
+    args = [_terminal(a, dim, syntax) for a in expr.args]
+
+    ops  = syntax._known_operators
+    name = None
+    for key, op in ops.items():
+        if expr.func is op:
+            name = key
+            break
+
+    if name is None:
+        if isinstance(expr, Add):
+            result = args[0]
+            for a in args[1:]:
+                result = _elementwise(lambda x, y: x + y, result, a)
+            return result
+
+        if isinstance(expr, Mul):
+            scalars = [a for a in args if not isinstance(a, list)]
+            tensors = [a for a in args if isinstance(a, list)]
+            if len(tensors) > 1:
+                raise ValueError('product of vectors in {}, use dot or '
+                                 'inner'.format(expr))
+            c = Mul(*scalars)
+            if tensors:
+                return _elementwise(lambda x: c*x, tensors[0])
+            return c
+
+        if any(isinstance(a, list) for a in args):
+            raise ValueError('{} can not be applied to a vector'.format(
+                             expr.func))
+        return expr.func(*args)
+
+    if dim is None:
+        raise ValueError('the dimension of {} can not be found'.format(expr))
+
+    d = lambda k, a: _elementwise(lambda x: _partial(k, x, syntax), a)
+
+    if name in _partials:
+        return d(_partials.index(name), args[0])
+
+    if name == 'grad':
+        a = args[0]
+        if isinstance(a, list):
+            return [[_partial(k, ai, syntax) for k in range(dim)] for ai in a]
+        return [_partial(k, a, syntax) for k in range(dim)]
+
+    if name == 'div':
+        return Add(*[_partial(k, ai, syntax) for k, ai in enumerate(args[0])])
+
+    if name == 'laplace':
+        return _elementwise(lambda x: Add(*[_partial(k, _partial(k, x, syntax),
+                                                     syntax)
+                                            for k in range(dim)]), args[0])
+
+    if name == 'hessian':
+        a = args[0]
+        return [[_partial(i, _partial(j, a, syntax), syntax)
+                 for j in range(dim)] for i in range(dim)]
+
+    if name in ('rot', 'curl'):
+        a = args[0]
+        if not isinstance(a, list):
+            return [_partial(1, a, syntax), -_partial(0, a, syntax)]
+        if len(a) == 2:
+            return _partial(0, a[1], syntax) - _partial(1, a[0], syntax)
+        return [_partial(1, a[2], syntax) - _partial(2, a[1], syntax),
+                _partial(2, a[0], syntax) - _partial(0, a[2], syntax),
+                _partial(0, a[1], syntax) - _partial(1, a[0], syntax)]
+
+    if name == 'dot':
+        a, b = args
+        if isinstance(a[0], list):
+            return [Add(*[x*y for x, y in zip(row, b)]) for row in a]
+        return Add(*[x*y for x, y in zip(a, b)])
+
+    if name == 'inner':
+        a, b = args
+        if not isinstance(a, list):
+            return a*b
+        return Add(*[x*y for x, y in zip(_entries(a), _entries(b))])
+
+    if name == 'cross':
+        a, b = args
+        if len(a) == 2:
+            return a[0]*b[1] - a[1]*b[0]
+        return [a[1]*b[2] - a[2]*b[1],
+                a[2]*b[0] - a[0]*b[2],
+                a[0]*b[1] - a[1]*b[0]]
+
+    if name == 'bracket':
+        a, b = args
+        return (_partial(0, a, syntax)*_partial(1, b, syntax) -
+                _partial(1, a, syntax)*_partial(0, b, syntax))
+
+    raise NotImplementedError('{} can not be expanded'.format(name))
+
+def terminal_expr(expr):
+    """Returns an integrand in which the differential operators (grad,
+    dot, inner, div, rot, curl, laplace, ...) are expanded to the partial
+    derivatives of the components of the functions, e.g. dot(grad(v),
+    grad(u)) to dx(u)*dx(v) + dy(u)*dy(v), so that every input of its
+    kernel depends on one function only."""
+    expr = sympify(expr)
+
+    found = _terminal_exprs.get(expr, None)
+    if found is None:
+        syntax = _backend()
+
+        found = _terminal(expr, _dimension(expr, syntax), syntax)
+        if isinstance(found, list):
+            raise ValueError('the integrand {} is not a scalar'.format(expr))
+        found = sympify(found)
+
+        _terminal_exprs[expr] = found
+
+    return found
+
+def _atom_name(atom, names):
+    """Returns a valid and unused argument name for an atom, e.g. dx_v for
+    dx(v)."""
+    name = re.sub(r'\W+', '_', str(atom)).strip('_') or 'arg'
+    if name[0].isdigit() or keyword.iskeyword(name):
+        name = '_' + name
+
+    base = name
+    i = 1
+    while name in names:
+        name = '{}_{}'.format(base, i)
+        i += 1
+
+    return name
+
+#======================================================================
+class Kernel(object):
+    """Class representing the vectorized evaluation of an integrand.
+
+    Every input of the integrand (the test and trial functions and their
+    derivatives, the fields, constants and coordinates) is given by its
+    name, e.g. dx_v for dx(v), as a NumPy array of its values. The arrays
+    are broadcast together, so that the integrand is evaluated over all the
+    quadrature points and basis functions in one call, e.g. using the shapes
+    (n_test, 1, n_quad) for the test functions, (1, n_trial, n_quad) for the
+    trial functions, (n_quad,) for the fields and coordinates, and scalars
+    for the constants. The differential operators are expanded, see
+    terminal_expr, so that every input depends on one function at most.
+
+    >>> kernel = get_by_name(ast, 'l5').kernel
+    >>> kernel.names
+    ['phi', 'v']
+    >>> values = kernel(phi=phi, v=v)
+    """
+    def __init__(self, expr, functions=()):
+        """
+        expr: sympy expression
+            the integrand of the form.
+
+        functions: list
+            the test and trial functions of the form.
+        """
+        # the integrand of a constant form is a python number
+        expr  = terminal_expr(expr)
+        atoms = kernel_atoms(expr)
+
+        names = []
+        for atom in atoms:
+            names.append(_atom_name(atom, names))
+
+        symbols = [Symbol(name) for name in names]
+        self.expr     = expr
+        self.atoms    = dict(zip(names, atoms))
+        self.names    = names
+        self.function = lambdify(symbols,
+                                 expr.xreplace(dict(zip(atoms, symbols))),
+                                 modules='numpy', dummify=False)
+
+        # ... the basis functions, and the coefficients of the form
+        functions = list(functions)
+        self.basis        = [name for name, atom in zip(names, atoms)
+                             if any(atom.has(f) for f in functions)]
+        self.coefficients = [name for name in names
+                             if not( name in self.basis )]
+        # ...
+
+    def __call__(self, *args, **kwargs):
+        """Evaluates the integrand. The values are given in the order of
+        names, or by name."""
+        if len(args) > len(self.names):
+            raise TypeError('expecting {} values, given {}'.format(
+                            len(self.names), len(args)))
+
+        values = dict(zip(self.names, args))
+        for name, value in kwargs.items():
+            if not( name in self.atoms ):
+                raise TypeError('unknown argument {}'.format(name))
+            if name in values:
+                raise TypeError('argument {} given twice'.format(name))
+            values[name] = value
+
+        missing = [name for name in self.names if not( name in values )]
+        if missing:
+            raise TypeError('missing values for {}'.format(', '.join(missing)))
+
+        values = [np.asarray(values[name]) for name in self.names]
+        out = self.function(*values)
+
+        # ... constant integrands, or integrands not using all the inputs
+        shape = np.broadcast_shapes(*[v.shape for v in values])
+        if not( np.shape(out) == shape ):
+            out = np.broadcast_to(out, shape).copy()
+        # ...
+
+        return out
+
+    def __str__(self):
+        return 'Kernel({}) = {}'.format(', '.join(self.names), self.expr)
+
+#======================================================================
+def get_kernel(expr, functions=()):
+    """Returns the kernel of an integrand, generated once per process."""
+    key = (expr, tuple(functions))
+
+    kernel = _kernels.get(key, None)
+    if kernel is None:
+        with _kernels_lock:
+            kernel = _kernels.get(key, None)
+            if kernel is None:
+                kernel = Kernel(expr, functions=functions)
+                _kernels[key] = kernel
+
+    return kernel
+
+def clear_kernels():
+    with _kernels_lock:
+        _kernels.clear()
+        _terminal_exprs.clear()
@@ -0,0 +1,228 @@
+# coding: utf-8
+
+import os
+import json
+from collections.abc import Mapping
+
+import numpy as np
+
+# Name of the manifest looked for when a directory is given
+MANIFEST = 'mesh.json'
+
+#======================================================================
+def open_array(spec, directory):
+    """Returns a read-only memory map of an array described in a manifest.
+
+    spec is the name of a .npy file, or a dictionary describing a raw
+    binary file: {"file": ..., "dtype": ..., "shape": [...], "offset": 0}.
+    Relative names are relative to the directory of the manifest.
+    """
+    if isinstance(spec, str):
+        spec = {'file': spec}
+
+    filename = os.path.join(directory, spec['file'])
+
+    if filename.endswith('.npy'):
+        return np.load(filename, mmap_mode='r')
+
+    shape = spec.get('shape', None)
+    if not( shape is None ):
+        shape = tuple(shape)
+
+    return np.memmap(filename, dtype=spec.get('dtype', 'float64'), mode='r',
+                     offset=spec.get('offset', 0), shape=shape)
+
+def file_stamps(filenames):
+    """Returns the (name, modification time, size) of files, the time and
+    size of a missing file being None."""
+    stamps = []
+    for filename in filenames:
+        try:
+            st = os.stat(filename)
+        except OSError:
+            stamps.append((filename, None, None))
+        else:
+            stamps.append((filename, st.st_mtime_ns, st.st_size))
+    return stamps
+
+#======================================================================
+class Boundaries(Mapping):
+    """Class giving the indices of the boundary facets of a mesh, by name
+    of boundary. The index arrays are computed on first access."""
+    def __init__(self, mesh, names):
+        self.mesh  = mesh
+        self.names = list(names)
+
+    def __getitem__(self, name):
+        if not( name in self.names ):
+            raise KeyError(name)
+        return self.mesh.boundary(name)
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def __len__(self):
+        return len(self.names)
+
+#======================================================================
+class Mesh(object):
+    """Class representing a mesh stored in files, described by a JSON
+    manifest:
+
+    {"dim": 2,
+     "nodes": "nodes.npy",
+     "cells": {"file": "cells.bin", "dtype": "int64", "shape": [n, 3]},
+     "facets": "facets.npy",
+     "facet_tags": "tags.npy",
+     "boundaries": {"Gamma_1": 1, "Gamma_2": "gamma_2.npy"}}
+
+    * nodes: the coordinates of the nodes, (n_nodes, dim)
+    * cells: the connectivity of the cells, (n_cells, n_vertices)
+    * facets, facet_tags: the connectivity of the boundary facets, and their
+      tag
+    * boundaries: for every named boundary, the tag of its facets, or an
+      array of the indices of its facets
+
+    The arrays are memory mapped when first used, and are never copied; the
+    index arrays of the boundaries are computed when first used.
+
+    >>> mesh = Mesh('mesh.json')
+    >>> mesh.cells.shape
+    >>> mesh.boundaries['Gamma_1']
+    """
+    def __init__(self, filename):
+        if os.path.isdir(filename):
+            filename = os.path.join(filename, MANIFEST)
+
+        with open(filename) as f:
+            manifest = json.load(f)
+
+        for key in ['dim', 'nodes', 'cells']:
+            if not( key in manifest ):
+                raise ValueError('{}: missing {}'.format(filename, key))
+
+        self.filename  = os.path.abspath(filename)
+        self.directory = os.path.dirname(self.filename)
+        self.dim       = int(manifest['dim'])
+        self.manifest  = manifest
+
+        self._arrays     = {}
+        self._boundaries = {}
+
+    def array(self, key):
+        """Returns the memory map of an array of the manifest."""
+        arr = self._arrays.get(key, None)
+        if arr is None:
+            if not( key in self.manifest ):
+                raise ValueError('{}: no {} array'.format(self.filename, key))
+            arr = open_array(self.manifest[key], self.directory)
+            self._arrays[key] = arr
+        return arr
+
+    @property
+    def nodes(self):
+        return self.array('nodes')
+
+    @property
+    def cells(self):
+        return self.array('cells')
+
+    @property
+    def facets(self):
+        return self.array('facets')
+
+    @property
+    def facet_tags(self):
+        return self.array('facet_tags')
+
+    @property
+    def boundary_names(self):
+        return sorted(self.manifest.get('boundaries', {}).keys())
+
+    @property
+    def boundaries(self):
+        return Boundaries(self, self.boundary_names)
+
+    def boundary(self, name):
+        """Returns the indices of the facets of a named boundary."""
+        indices = self._boundaries.get(name, None)
+        if indices is None:
+            spec = self.manifest.get('boundaries', {}).get(name, None)
+            if spec is None:
+                raise KeyError('{}: unknown boundary {}'.format(self.filename,
+                                                                name))
+
+            if isinstance(spec, int):
+                # the facets are scanned chunk by chunk, so that only the
+                # indices are held in memory
+                tags  = self.facet_tags
+                chunk = 1 << 20
+                parts = [np.flatnonzero(tags[k:k + chunk] == spec) + k
+                         for k in range(0, len(tags), chunk)]
+                indices = np.concatenate(parts) if parts else np.zeros(0, int)
+
+            else:
+                indices = open_array(spec, self.directory)
+
+            self._boundaries[name] = indices
+        return indices
+
+    def files(self):
+        """Returns the names of the manifest and of the files of the
+        arrays."""
+        specs  = [self.manifest[k] for k in ['nodes', 'cells', 'facets',
+                                             'facet_tags']
+                  if k in self.manifest]
+        specs += [spec for spec in self.manifest.get('boundaries', {}).values()
+                  if not isinstance(spec, int)]
+
+        names = [spec if isinstance(spec, str) else spec['file']
+                 for spec in specs]
+        return [self.filename] + [os.path.join(self.directory, name)
+                                  for name in names]
+
+    def stamp(self):
+        """Returns the (name, modification time, size) of the files of the
+        mesh, which change when the mesh is written again."""
+        return file_stamps(self.files())
+
+    def __getstate__(self):
+        # the memory maps are opened again after unpickling
+        state = dict(self.__dict__)
+        state['_arrays']     = {}
+        state['_boundaries'] = {}
+        return state
+
+    def __str__(self):
+        return 'Mesh({})'.format(self.filename)
+
+#======================================================================
+def write_mesh(directory, nodes, cells, facets=None, facet_tags=None,
+               boundaries=None):
+    """Writes a mesh as .npy files and a manifest in a directory, and
+    returns the name of the manifest.
+
+    boundaries: dict
+        the tag of the facets of every named boundary.
+    """
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    nodes = np.asarray(nodes)
+    manifest = {'dim': nodes.shape[1]}
+
+    arrays = [('nodes', nodes), ('cells', cells), ('facets', facets),
+              ('facet_tags', facet_tags)]
+    for key, arr in arrays:
+        if not( arr is None ):
+            np.save(os.path.join(directory, '{}.npy'.format(key)), arr)
+            manifest[key] = '{}.npy'.format(key)
+
+    if boundaries:
+        manifest['boundaries'] = dict(boundaries)
+
+    filename = os.path.join(directory, MANIFEST)
+    with open(filename, 'w') as f:
+        json.dump(manifest, f, indent=2)
+
+    return filename
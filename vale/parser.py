@@ -1,25 +1,298 @@
 # coding: utf-8
 
 import os
-from sympy import Symbol, sympify
+import copy
+import pickle
+import hashlib
+import threading
 
 #from .utilities import grad, d_var, inner, outer, cross, dot
 from .syntax import (PDE,
                      Expression, Term, Operand,
-                     Factor, Trailer, Power,
+                     Factor, Trailer,
                      LinearForm, BilinearForm,
                      BodyForm, SimpleBodyForm,
                      Equation, Alias,
                      Domain, FunctionSpace, VectorFunctionSpace, Field, Function,
-                     Real, Complex)
+                     Real, Complex,
+                     declarations_index)
 
-from textx.metamodel import metamodel_from_str
+from .session import Session
+from .instrument import RuleProfile
+from .fastparser import FastMetamodel
+
+# ... textX instruments the user classes while building a model, which is
+#     not thread safe. The lock is held for the whole textX parse, lowering
+#     included, so that textX parses are serialized
+_model_lock = threading.Lock()
+# ...
+
+# ... process-wide cache of compiled metamodels
+_metamodels      = {}
+_metamodels_lock = threading.Lock()
+
+def grammar_key(grammar, classes=None):
+    """
+    Returns the key under which the metamodel of a grammar is cached.
+
+    The key is made of the sha1 hash of the grammar text and the tuple of
+    user classes, since textX binds these classes to the metamodel.
+    """
+    digest = hashlib.sha1(grammar.encode('utf-8')).hexdigest()
+    if classes is None:
+        classes = ()
+    return (digest, tuple(classes))
+
+def get_metamodel(grammar, classes=None, memoization=False):
+    """
+    Returns the textX metamodel for the given grammar and user classes.
+
+    The grammar is only compiled the first time a (grammar, classes) pair is
+    requested in the current process; later calls return the same metamodel.
+
+    With memoization, the parser remembers the result of every rule at every
+    position (packrat parsing). This only pays off for grammars which
+    backtrack a lot; grammar.tx does not, and is parsed faster without.
+    """
+    from textx.metamodel import metamodel_from_str
+
+    key = grammar_key(grammar, classes) + (memoization,)
+
+    # the lock makes sure that concurrent parsers compile the grammar once
+    with _metamodels_lock:
+        model = _metamodels.get(key, None)
+        if model is None:
+            if classes is None:
+                model = metamodel_from_str(grammar, memoization=memoization)
+            else:
+                model = metamodel_from_str(grammar, classes=classes,
+                                           memoization=memoization)
+
+            _metamodels[key] = model
+
+    return model
+
+def clear_metamodel_cache():
+    """Removes all the compiled metamodels from the cache."""
+    with _metamodels_lock:
+        _metamodels.clear()
+
+def profile_rules(instructions, grammar=None, memoization=False):
+    """
+    Parses a code with textX, without the user classes, and returns the
+    RuleProfile of the grammar, counting the attempts, failures and retries
+    of every rule. The Vale grammar is used if no grammar is given.
+    """
+    if grammar is None:
+        dir_path = os.path.dirname(os.path.realpath(__file__))
+        with open(os.path.join(dir_path, 'grammar.tx')) as f:
+            grammar = f.read()
+
+    model = get_metamodel(grammar, memoization=memoization)
+
+    # the profile patches the parsers of all the threads
+    with _model_lock:
+        with RuleProfile() as profile:
+            model.model_from_str(instructions)
+
+    return profile
+# ...
+
+# ... content-addressed cache of lowered models
+def model_key(instructions, grammar, directory=''):
+    """
+    Returns the cache key of a Vale code.
+
+    The key is the sha256 hash of the code, the grammar, the vale version
+    and the directory against which the files named in the code (e.g.
+    meshes) are resolved; changing any of them invalidates the cached
+    models. Editing a mesh is detected when loading the model, see
+    load_model.
+    """
+    from vale import __version__
+
+    h = hashlib.sha256()
+    for txt in [instructions, grammar, str(__version__), directory]:
+        h.update(txt.encode('utf-8'))
+        h.update(b'\0')
+    return h.hexdigest()
+
+def dump_model(ast, filename):
+    """
+    Serializes the lowered namespace of an AST in a file.
+
+    Only the declaration names, the namespace (forms, spaces, equations,
+    ...) and the lowered attributes listed in the _cached attribute of the
+    declarations are stored; the textX objects are not. The modification
+    times and sizes of the mesh files are stored too. Returns True if the
+    model could be serialized.
+    """
+    # lazy attributes, e.g. the plan of an equation, are computed here
+    try:
+        declarations = [(token.__class__.__name__, token.name,
+                         dict((k, getattr(token, k))
+                              for k in getattr(token, '_cached', ())))
+                        for token in ast.declarations]
+    except Exception:
+        return False
+
+    files = []
+    for token in ast.declarations:
+        mesh = getattr(token, 'mesh', None)
+        if not( mesh is None ):
+            files += mesh.stamp()
+
+    data = {'declarations': declarations,
+            'namespace':    dict(ast.namespace),
+            'files':        files}
+
+    try:
+        txt = pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL)
+    except Exception:
+        return False
+
+    # ... write to a temporary file first, so that concurrent readers never
+    #     see a partial model
+    tmp = '{}.{}.tmp'.format(filename, os.getpid())
+    with open(tmp, 'wb') as f:
+        f.write(txt)
+    os.replace(tmp, filename)
+    # ...
+
+    return True
+
+def _restore(cls, **attrs):
+    """Creates an instance of cls without calling its constructor."""
+    obj = cls.__new__(cls)
+    for k,v in attrs.items():
+        setattr(obj, k, v)
+    return obj
+
+def load_model(filename):
+    """
+    Loads a model serialized by dump_model and returns its AST, or None if
+    the file can not be read.
+
+    The returned PDE object has the same declarations (names and types) and
+    namespace as the parsed one, but no textX information. None is also
+    returned if a file read by the model, e.g. a mesh, changed since it was
+    stored.
+    """
+    try:
+        with open(filename, 'rb') as f:
+            data = pickle.load(f)
+    except Exception:
+        return None
+
+    files = data.get('files', [])
+    if files:
+        from .mesh import file_stamps
+
+        if not( file_stamps([f[0] for f in files]) == list(files) ):
+            return None
+
+    session = Session()
+    session.namespace.update(data['namespace'])
+    namespace = session.namespace
+
+    classes = dict((cls.__name__, cls) for cls in _classes)
+    declarations = []
+    for item in data['declarations']:
+        cls_name, name = item[:2]
+        cls = classes[cls_name]
+
+        # only the attributes still cached by the class are restored
+        attrs = dict(item[2]) if len(item) > 2 else {}
+        attrs = dict((k, v) for k, v in attrs.items()
+                     if k in getattr(cls, '_cached', ()))
+        declarations.append(_restore(cls, name=name,
+                                     namespace=namespace, **attrs))
+
+    return _restore(PDE, declarations=declarations, namespace=namespace,
+                    session=session, index=declarations_index(declarations))
+# ...
+
+# ... splitting of a Vale code in declarations
+_continuation_words = ('and', 'forall', 'such', 'that', 'label', 'on')
+_continuation_chars = ('+', '-', '*', '/', '=', ',', ')', '>', '_', ':')
+_open_chars         = ('+', '-', '*', '/', '=', ',', '(', '<', '_', ':')
+
+def _is_open(words, code):
+    """Returns True if the declaration given by its code is not complete."""
+    if code.count('(') > code.count(')'):
+        return True
+
+    if code.count('<') > code.count('>'):
+        return True
+
+    if code.rstrip().endswith(_open_chars):
+        return True
+
+    # an equation is complete once its test functions are given
+    if words and words[0] == 'find' and not('forall' in words):
+        return True
+
+    return False
+
+def iter_declarations(lines):
+    """
+    Splits the lines of a Vale code in chunks of declarations and yields
+    them as (line number, text) tuples.
+
+    A declaration starts on a line that is not indented, unless the previous
+    declaration is not complete (unbalanced parenthesis, trailing operator,
+    equation without its test functions) or the line starts with an operator
+    or a keyword continuing an equation (and, forall, label, ...). Blank
+    lines and comments between declarations are ignored.
+    """
+    chunk  = []
+    code   = ''
+    words  = []
+    lineno = 0
+    for i, line in enumerate(lines):
+        line_code = line.split('#', 1)[0]
+        stripped  = line_code.strip()
+        if not stripped:
+            continue
+
+        line_words = stripped.split()
+        new = ( chunk and
+                not line[0].isspace() and
+                not line_words[0] in _continuation_words and
+                not stripped.startswith(_continuation_chars) and
+                not _is_open(words, code) )
+
+        if new:
+            yield lineno, ''.join(chunk)
+            chunk = []
+            code  = ''
+            words = []
+
+        if not chunk:
+            lineno = i + 1
+
+        chunk.append(line if line.endswith('\n') else line + '\n')
+        code  += line_code + ' '
+        words += line_words
+
+    if chunk:
+        yield lineno, ''.join(chunk)
+
+def split_declarations(instructions):
+    """Returns the chunks of declarations of a Vale code, as a list of
+    (line number, text) tuples. See iter_declarations."""
+    return list(iter_declarations(instructions.splitlines(True)))
+# ...
 
 # ...
 def get_by_name(ast, name):
     """
     Returns an object from the AST by giving its name.
     """
+    index = getattr(ast, 'index', None)
+    if not( index is None ):
+        return index.get(name, None)
+
     for token in ast.declarations:
         if token.name == name:
             return token
@@ -37,6 +310,24 @@ def ast_to_dict(ast):
     return tokens
 # ...
 
+# ... user classes of the Vale grammar
+_classes = [PDE,
+            Expression, Term, Operand,
+            Factor, Trailer,
+            LinearForm, BilinearForm,
+            BodyForm, SimpleBodyForm,
+            Domain, FunctionSpace, VectorFunctionSpace,
+            Field, Function,
+            Equation, Alias,
+            Real, Complex
+            ]
+# ...
+
+# ... parsers of the Vale code: textX, or the hand-written parser, which
+#     needs neither textX nor Arpeggio and does not backtrack
+_backends = ('textx', 'fast')
+# ...
+
 class BasicParser(object):
     """ Class for a Parser using TextX.
 
@@ -56,7 +347,8 @@ class BasicParser(object):
     >>> parser.parse_from_file("tests/inputs/1d/poisson.vl")
     """
     def __init__(self, grammar=None, filename=None, \
-                 classes=None):
+                 classes=None, instrumentation=None, backend='textx',
+                 memoization=False):
         """Parser constructor.
 
         grammar : str
@@ -68,7 +360,25 @@ class BasicParser(object):
         classes : list
             a list of Python classes to be used to describe the grammar. Take a
             look at TextX documentation for more details.
+
+        instrumentation: Instrumentation
+            if given, the parsing phases are measured.
+
+        backend: str
+            'textx', or 'fast' for the hand-written parser of fastparser,
+            which only implements grammar.tx.
+
+        memoization: bool
+            if True, textX memoizes the rules, see get_metamodel.
         """
+        if not( backend in _backends ):
+            raise ValueError('Unknown backend {}, available: {}'
+                             .format(backend, ', '.join(_backends)))
+
+        self.backend         = backend
+        self.instrumentation = instrumentation
+        if instrumentation:
+            instrumentation.begin('grammar')
 
         _grammar = grammar
 
@@ -87,13 +397,17 @@ class BasicParser(object):
         self.grammar = _grammar
         # ...
 
-        # ...
-        if classes is None:
-            self.model = metamodel_from_str(_grammar)
+        # ... the metamodel is shared by all parsers using the same grammar
+        if backend == 'textx':
+            self.model = get_metamodel(_grammar, classes=classes,
+                                       memoization=memoization)
         else:
-            self.model = metamodel_from_str(_grammar, classes=classes)
+            self.model = FastMetamodel(classes=classes)
         # ...
 
+        if instrumentation:
+            instrumentation.end()
+
     def parse(self, instructions):
         """Parse a set of instructions with respect to the grammar.
 
@@ -101,7 +415,20 @@ class BasicParser(object):
             list of instructions to parse.
         """
         # ... parse the DSL code
-        return self.model.model_from_str(instructions)
+        instrumentation = self.instrumentation
+        if instrumentation:
+            instrumentation.begin('model_from_str')
+
+        try:
+            if self.backend == 'textx':
+                with _model_lock:
+                    return self.model.model_from_str(instructions)
+
+            return self.model.model_from_str(instructions)
+
+        finally:
+            if instrumentation:
+                instrumentation.end()
         # ...
 
     def parse_from_file(self, filename):
@@ -130,22 +457,50 @@ class Parser(BasicParser):
     Linear and Bilinear Forms to define their dependencies: user_fields,
     user_functions and user_constants.
 
+    Every parse is done in its own Session, holding the namespace of the
+    lowered objects, so that several models can be parsed in the same
+    process, possibly from different threads. The session is available as
+    the session attribute of the returned AST. With the textX backend, the
+    parses of different threads are serialized; concurrent parses should
+    use backend='fast', and parallel ones several processes, see
+    vale.batch.
+
+    Lowered models can be cached on disk by giving a directory, using the
+    cache_dir argument or the VALE_CACHE_DIR environment variable. The cache
+    is keyed by the content of the Vale file, the grammar and the vale
+    version.
+
+    The time and memory spent in the parsing phases (grammar loading, textX,
+    declaration constructors, lowering) are measured by giving an
+    Instrumentation.
+
+    The code is parsed by textX, or by a hand-written recursive descent
+    parser, giving the same AST, using backend='fast'; the latter is much
+    faster on large files.
     """
     def __init__(self, **kwargs):
         """parser constructor.
 
         It takes the same arguments as the Parser class.
+
+        cache_dir: str
+            directory where lowered models are cached.
+
+        instrumentation: Instrumentation
+            if given, the parsing phases are measured.
+
+        backend: str
+            'textx' (default) or 'fast'.
+
+        memoization: bool
+            if True, textX memoizes the rules.
         """
-        classes = [PDE,
-                   Expression, Term, Operand,
-                   Factor, Trailer, Power,
-                   LinearForm, BilinearForm,
-                   BodyForm, SimpleBodyForm,
-                   Domain, FunctionSpace, VectorFunctionSpace,
-                   Field, Function,
-                   Equation, Alias,
-                   Real, Complex
-                   ]
+        instrumentation = kwargs.pop('instrumentation', None)
+        backend         = kwargs.pop('backend', 'textx')
+        memoization     = kwargs.pop('memoization', False)
+
+        self.cache_dir = kwargs.pop('cache_dir',
+                                    os.environ.get('VALE_CACHE_DIR', None))
 
         try:
             filename = kwargs["filename"]
@@ -153,7 +508,178 @@ class Parser(BasicParser):
             filename = "grammar.tx"
 
         super(Parser, self).__init__(filename = filename,
-                                     classes=classes)
+                                     classes=_classes,
+                                     instrumentation=instrumentation,
+                                     backend=backend,
+                                     memoization=memoization)
+
+    def parse(self, instructions, session=None):
+        """Parse a set of instructions with respect to the grammar and returns
+        the AST.
+
+        instructions: str
+            the instructions to parse.
+
+        session: Session
+            session in which the declarations are lowered. A new session is
+            created if not given.
+        """
+        if session is None:
+            session = Session()
+
+        session.instrumentation = self.instrumentation
+
+        with session:
+            ast = super(Parser, self).parse(instructions)
+
+        ast.session = session
+
+        return ast
+
+    async def parse_async(self, instructions, executor=None):
+        """Parse a set of instructions in a thread, without blocking the
+        event loop, and returns the AST.
+
+        With the textX backend, the parses run one at a time whatever the
+        number of threads of the executor; use backend='fast' to parse
+        concurrently, or a process pool (see vale.batch) to use several
+        cores.
+
+        instructions: str
+            the instructions to parse.
+
+        executor: concurrent.futures.Executor
+            executor running the parse. The default executor of the event
+            loop is used if not given.
+
+        >>> ast = await parser.parse_async(instructions)
+        """
+        import asyncio
+
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(executor, self.parse, instructions)
+
+    async def parse_from_file_async(self, filename, executor=None):
+        """Same as parse_from_file, without blocking the event loop. See
+        parse_async."""
+        import asyncio
+
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(executor, self.parse_from_file,
+                                          filename)
+
+    def parse_incremental(self, instructions, ast=None):
+        """Parse a set of instructions declaration by declaration, reusing
+        the lowered declarations of a previous AST.
+
+        instructions: str
+            the instructions to parse.
+
+        ast: PDE
+            an AST returned by parse_incremental for a previous version of
+            the instructions.
+
+        Only the new or modified declarations, and the ones depending on
+        them, are lowered again. Their names are given by the rebuilt
+        attribute of the returned AST. The other declarations are shallow
+        copies of the previous ones, so that the previous AST is not
+        modified.
+        """
+        chunks = [text for lineno, text in split_declarations(instructions)]
+
+        # ...
+        if ast is None:
+            session = Session()
+            previous = {}
+            dirty = set()
+
+        else:
+            session = ast.session.copy()
+            previous = dict(ast.chunks)
+
+            # declarations that were modified or removed
+            texts = set(chunks)
+            names = [token.name for text, tokens in ast.chunks
+                     if not( text in texts ) for token in tokens]
+
+            defined = [k for name in names
+                       for k in session.definitions.get(name, [])]
+
+            dirty = set(names) | session.dependents(defined)
+
+            # remove their names from the namespace
+            for name in dirty:
+                for k in session.definitions.pop(name, []):
+                    if k in session.namespace:
+                        session.undefine(k)
+                session.dependencies.pop(name, None)
+        # ...
+
+        # ...
+        declarations = []
+        new_chunks   = []
+        rebuilt      = []
+        for text in chunks:
+            tokens = previous.get(text, None)
+            if ( tokens is None or
+                 any(token.name in dirty for token in tokens) ):
+                tokens = self.parse(text, session=session).declarations
+                rebuilt += [token.name for token in tokens]
+
+            else:
+                # the tokens of the previous AST keep its namespace
+                tokens = [copy.copy(token) for token in tokens]
+                for token in tokens:
+                    token.namespace = session.namespace
+
+            new_chunks.append((text, tokens))
+            declarations += tokens
+        # ...
+
+        with session:
+            ast = PDE(declarations=declarations)
+
+        ast.session = session
+        ast.chunks  = new_chunks
+        ast.rebuilt = rebuilt
+
+        return ast
+
+    def iter_parse_from_file(self, filename, session=None):
+        """Parse a file declaration by declaration, and yields every
+        declaration (Domain, Space, Field, Form, Equation, ...) as soon as it
+        is lowered.
+
+        filename: str
+            a file containing the instructions to parse.
+
+        session: Session
+            session in which the declarations are lowered. A new session is
+            created if not given.
+
+        The file is read line by line, so that only the declaration being
+        parsed is kept in memory, in addition to the lowered namespace. The
+        declarations are split as in split_declarations.
+        """
+        if session is None:
+            session = Session()
+            session.settings['directory'] = os.path.dirname(
+                                            os.path.abspath(filename))
+
+        with open(filename) as f:
+            for lineno, text in iter_declarations(f):
+                try:
+                    ast = self.parse(text, session=session)
+
+                except Exception as e:
+                    # textX positions are relative to the declaration
+                    if getattr(e, 'line', None):
+                        e.line += lineno - 1
+                        e.filename = filename
+                    raise
+
+                for token in ast.declarations:
+                    yield token
 
     def parse_from_file(self, filename):
         """Parse a set of instructions with respect to the grammar and returns
@@ -162,15 +688,47 @@ class Parser(BasicParser):
         filename: str
             a file containing the instructions to parse.
         """
-        ast = super(Parser, self).parse_from_file(filename)
+        # ... read a DSL code
+        f = open(filename)
+        instructions = f.read()
+        f.close()
+        # ...
+
+        # files named in the code, e.g. meshes, are relative to the file
+        directory = os.path.dirname(os.path.abspath(filename))
+
+        # ... look for an already lowered model
+        cache = None
+        if self.cache_dir:
+            key   = model_key(instructions, self.grammar, directory)
+            cache = os.path.join(self.cache_dir, '{}.pkl'.format(key))
+
+            if os.path.isfile(cache):
+                instrumentation = self.instrumentation
+                if instrumentation:
+                    instrumentation.begin('cache')
+
+                ast = load_model(cache)
+
+                if instrumentation:
+                    instrumentation.end(filename)
+
+                if not( ast is None ):
+                    return ast
+        # ...
+
+        session = Session()
+        session.settings['directory'] = directory
+
+        ast = self.parse(instructions, session=session)
+
+        # ...
+        if cache:
+            if not os.path.isdir(self.cache_dir):
+                os.makedirs(self.cache_dir)
 
-        # ... annotating the AST
-        for token in ast.declarations:
-            ns = token.namespace
-            print(ns[token.name], type(ns[token.name]))
-#            annotate_form(token, ast)
+            dump_model(ast, cache)
         # ...
-        print('done.')
 
         return ast
 
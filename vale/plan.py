@@ -0,0 +1,160 @@
+# coding: utf-8
+
+import json
+
+from sympy import sympify
+
+from .kernels import kernel_atoms, derivative_order, _atom_name
+from .blocks import function_uses, block_structure
+
+#======================================================================
+class Contribution(object):
+    """Class representing a nonzero block of one side of an equation.
+
+    * block: the index of the test function, and of the trial function for
+      the left hand side
+    * test, trial: the names of the functions
+    * test_space, trial_space: the names of their spaces
+    * integrand: the lowered integrand of the block, expanded to terminal
+      derivatives
+    * derivatives: the highest derivative order of every function
+    * coefficients: the names of the other inputs, e.g. fields, constants
+      and coordinates, as for a Kernel
+    """
+    def __init__(self, block, integrand, test, trial=None):
+        atoms = kernel_atoms(integrand)
+
+        functions = [test] if trial is None else [test, trial]
+        uses = dict(function_uses(integrand, functions))
+
+        self.block       = block
+        self.integrand   = integrand
+        self.test        = test.name
+        self.test_space  = _space_name(test)
+        self.trial       = None if trial is None else trial.name
+        self.trial_space = None if trial is None else _space_name(trial)
+
+        self.derivatives = {}
+        for f in functions:
+            orders = [derivative_order(a) for a in atoms if f in uses[a]]
+            self.derivatives[f.name] = max(orders or [0])
+
+        names = []
+        for atom in atoms:
+            names.append(_atom_name(atom, names))
+        self.coefficients = [name for name, atom in zip(names, atoms)
+                             if not uses[atom]]
+
+    def as_dict(self):
+        return {'block':        list(self.block),
+                'test':         self.test,
+                'test_space':   self.test_space,
+                'trial':        self.trial,
+                'trial_space':  self.trial_space,
+                'integrand':    str(self.integrand),
+                'derivatives':  dict(self.derivatives),
+                'coefficients': list(self.coefficients)}
+
+#======================================================================
+class AssemblyPlan(object):
+    """Class representing what is needed to assemble an equation:
+
+    * bilinear: the Contributions of the left hand side, by block
+    * linear: the Contributions of the right hand side, by test function
+    * bilinear_forms, linear_forms: the names of the forms applied in the
+      equation, in the order of their declaration
+    * test_spaces, trial_spaces: the names of the spaces of the functions
+    * conditions: the essential boundary conditions, as dictionaries with
+      the boundary name, the lowered lhs and rhs, and the derivative order
+      of the lhs
+    * boundaries: the facet indices of every boundary, if the domain is
+      read from a mesh, see vale.mesh
+    * derivatives: the highest derivative order of every function
+
+    The plan of an equation is computed on its first use, or when the
+    model is stored in the model cache. A plan can be pickled, or converted
+    to JSON using as_dict, the expressions being then given as strings.
+
+    >>> plan = get_by_name(ast, 'poisson').plan
+    >>> [c.block for c in plan.bilinear]
+    [(0, 0)]
+    """
+    def __init__(self, name, bilinear, linear, test_spaces, trial_spaces,
+                 conditions, bilinear_forms=(), linear_forms=(),
+                 boundaries=None):
+        self.name           = name
+        self.bilinear       = list(bilinear)
+        self.linear         = list(linear)
+        self.test_spaces    = list(test_spaces)
+        self.trial_spaces   = list(trial_spaces)
+        self.conditions     = list(conditions)
+        self.bilinear_forms = list(bilinear_forms)
+        self.linear_forms   = list(linear_forms)
+        self.boundaries     = boundaries
+
+    @property
+    def derivatives(self):
+        orders = {}
+        for c in self.bilinear + self.linear:
+            for k, n in c.derivatives.items():
+                orders[k] = max(orders.get(k, 0), n)
+        return orders
+
+    def as_dict(self):
+        conditions = [{'boundary': c['boundary'],
+                       'lhs':      str(c['lhs']),
+                       'rhs':      str(c['rhs']),
+                       'order':    c['order']} for c in self.conditions]
+
+        return {'name':           self.name,
+                'bilinear':       [c.as_dict() for c in self.bilinear],
+                'linear':         [c.as_dict() for c in self.linear],
+                'test_spaces':    list(self.test_spaces),
+                'trial_spaces':   list(self.trial_spaces),
+                'conditions':     conditions,
+                'bilinear_forms': list(self.bilinear_forms),
+                'linear_forms':   list(self.linear_forms),
+                'derivatives':    self.derivatives}
+
+    def to_json(self, **kwargs):
+        return json.dumps(self.as_dict(), **kwargs)
+
+def _space_name(f):
+    space = getattr(f, 'space', None)
+    return getattr(space, 'name', None if space is None else str(space))
+
+#======================================================================
+def assembly_plan(name, lhs, rhs, test_functions, trial_functions,
+                  conditions=(), bilinear_forms=(), linear_forms=(),
+                  boundaries=None):
+    """Returns the AssemblyPlan of an equation.
+
+    conditions: list
+        (boundary name, lhs, rhs) of every essential boundary condition.
+    """
+    tests  = list(test_functions)
+    trials = list(trial_functions)
+
+    # ... nonzero blocks of the left hand side, and of the right hand side
+    blocks   = block_structure(lhs, tests, trials)
+    bilinear = [Contribution((i, j), blocks[i, j], tests[i], trials[j])
+                for i, j in blocks.nonzero]
+
+    blocks = block_structure(rhs, tests)
+    linear = [Contribution((i,), blocks[i,], tests[i])
+              for (i,) in blocks.nonzero]
+    # ...
+
+    conditions = [{'boundary': bnd,
+                   'lhs':      bc_lhs,
+                   'rhs':      bc_rhs,
+                   'order':    derivative_order(sympify(bc_lhs))}
+                  for bnd, bc_lhs, bc_rhs in conditions]
+
+    return AssemblyPlan(name, bilinear, linear,
+                        [_space_name(v) for v in tests],
+                        [_space_name(u) for u in trials],
+                        conditions,
+                        bilinear_forms=bilinear_forms,
+                        linear_forms=linear_forms,
+                        boundaries=boundaries)
@@ -0,0 +1,242 @@
+# coding: utf-8
+
+import threading
+from contextlib import contextmanager
+
+# Sessions activated in the current thread
+_local = threading.local()
+
+# Known operators, functions and constants, filled by load_backend. They
+# cannot be redefined by a declaration.
+builtins = {}
+
+#======================================================================
+class Session(object):
+    """Class holding the state of a parse.
+
+    The namespace in which declarations are lowered, as well as the tables
+    used during the lowering, belong to a session instead of being global.
+    A session is activated using a with statement; the syntax classes
+    then work on the active session of the current thread.
+
+    >>> session = Session()
+    >>> with session:
+    ...     ast = parser.parse(instructions)
+    """
+    def __init__(self):
+        self.namespace   = {}
+        self.stack       = {}
+        self.settings    = {}
+
+        # table of lowered expressions, used to share subexpressions
+        self.expressions = {}
+
+        # test functions by (space, name, kind), and components of the
+        # spaces, shared by the declarations
+        self.functions = {}
+        self.spaces    = {}
+
+        # meshes of the domains read from files, by name of domain
+        self.meshes = {}
+
+        # results of the forms applied inside other forms, by form and
+        # arguments, and the number of lookups in this table
+        self.applications = {}
+        self.application_hits   = 0
+        self.application_misses = 0
+
+        # names read and defined by every declaration
+        self.dependencies = {}
+        self.definitions  = {}
+
+        # Instrumentation measuring the lowering, if any
+        self.instrumentation = None
+
+        # names read and defined by the declaration being lowered
+        self._reads   = set()
+        self._defines = []
+
+        # builtins, namespace and local names in one table, built on the
+        # first lookup
+        self._symbols = None
+
+        # local names, e.g. test functions, of the active scopes
+        self._locals = set()
+
+    @property
+    def symbols(self):
+        """Returns the table of all the names that can be looked up."""
+        if self._symbols is None:
+            symbols = dict(self.namespace)
+            symbols.update(builtins)
+            self._symbols = symbols
+        return self._symbols
+
+    def lookup(self, name):
+        """Returns the object with the given name, and records it as a
+        dependency of the declaration being lowered. Raises a KeyError if
+        the name is not known."""
+        obj = self.symbols[name]
+        if not( name in self._locals ):
+            self._reads.add(name)
+        return obj
+
+    def define(self, name, value):
+        """Inserts an object in the namespace."""
+        self.namespace[name] = value
+        self._defines.append(name)
+
+        if not( self._symbols is None or name in builtins ):
+            self._symbols[name] = value
+
+    def undefine(self, name):
+        """Removes an object from the namespace."""
+        self.namespace.pop(name)
+
+        if not( self._symbols is None or name in builtins ):
+            self._symbols.pop(name, None)
+
+    @contextmanager
+    def scope(self, objects):
+        """Makes the given objects, e.g. the test and trial functions of a
+        form, known by their name inside a with statement. They shadow the
+        namespace, and are removed when leaving the statement."""
+        names = [v.name for v in objects]
+        if len(set(names)) < len(names):
+            raise ValueError('{} defined more than once'.format(names))
+
+        # as for the namespace, builtins are not shadowed
+        objects = [v for v in objects if not( v.name in builtins )]
+        names   = [v.name for v in objects]
+
+        symbols = self.symbols
+        saved   = [(k, symbols.get(k, None), k in symbols) for k in names]
+        outer   = self._locals
+
+        symbols.update((v.name, v) for v in objects)
+        self._locals = outer.union(names)
+        try:
+            yield self
+        finally:
+            self._locals = outer
+            for k, v, found in saved:
+                if found:
+                    symbols[k] = v
+                else:
+                    symbols.pop(k)
+
+    def apply(self, form, args):
+        """Returns form(*args), e.g. a12(v,p) inside a13. The result is
+        computed once per form and arguments, and then reused."""
+        key = (form, tuple(args))
+        try:
+            expr = self.applications.get(key, None)
+        except TypeError:
+            # unhashable arguments
+            return form(*args)
+
+        if expr is None:
+            self.application_misses += 1
+            expr = form(*args)
+            self.applications[key] = expr
+        else:
+            self.application_hits += 1
+
+        return expr
+
+    def applications_report(self):
+        """Returns the number of hits and misses of the form applications
+        table, and its hit rate."""
+        hits   = self.application_hits
+        misses = self.application_misses
+        total  = hits + misses
+
+        return {'hits':   hits,
+                'misses': misses,
+                'rate':   float(hits) / total if total else 0.}
+
+    def begin_declaration(self):
+        """Starts recording the names read and defined by a declaration."""
+        self._reads   = set()
+        self._defines = []
+
+    def reads(self):
+        """Returns the names read so far by the declaration being
+        lowered."""
+        return set(self._reads)
+
+    def end_declaration(self, name):
+        """Stops recording the names read and defined by a declaration.
+
+        Local names, such as test functions, are neither dependencies nor
+        definitions of the declaration.
+        """
+        defines = [k for k in self._defines if k in self.namespace]
+        reads   = [k for k in self._reads if k in self.namespace]
+
+        self.definitions[name]  = defines
+        self.dependencies[name] = set(reads).difference(self._defines)
+
+        self._reads   = set()
+        self._defines = []
+
+    def dependents(self, names):
+        """Returns the declarations depending, directly or not, on the given
+        names."""
+        names = set(names)
+        found = set()
+
+        changed = True
+        while changed:
+            changed = False
+            for decl, deps in self.dependencies.items():
+                if decl in found:
+                    continue
+
+                if deps & names:
+                    found.add(decl)
+                    names.update(self.definitions.get(decl, []))
+                    changed = True
+
+        return found
+
+    def copy(self):
+        """Returns a new session with a copy of the state of this one."""
+        other = Session()
+        other.namespace    = dict(self.namespace)
+        other.stack        = dict(self.stack)
+        other.settings     = dict(self.settings)
+        other.expressions  = dict(self.expressions)
+        other.applications = dict(self.applications)
+        other.meshes       = dict(self.meshes)
+        other.functions    = dict(self.functions)
+        other.spaces       = dict(self.spaces)
+        other.dependencies = dict(self.dependencies)
+        other.definitions  = dict(self.definitions)
+        other.instrumentation = self.instrumentation
+        return other
+
+    def __enter__(self):
+        sessions = getattr(_local, 'sessions', None)
+        if sessions is None:
+            sessions = []
+            _local.sessions = sessions
+
+        sessions.append(self)
+        return self
+
+    def __exit__(self, *args):
+        _local.sessions.pop()
+
+# Session used when no session is active, e.g. when the syntax classes are
+# given to a BasicParser
+_default_session = Session()
+
+#======================================================================
+def get_session():
+    """Returns the active session of the current thread."""
+    sessions = getattr(_local, 'sessions', None)
+    if sessions:
+        return sessions[-1]
+
+    return _default_session
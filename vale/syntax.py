@@ -1,9 +1,7 @@
 # coding: utf-8
 
-from sympy import Tuple
-from sympy import Function
-from sympy import pi
-from sympy import Pow
+import os
+from functools import wraps
 
 #from vale.utilities import (grad, d_var, inner, outer, cross, dot, \
 #                           replace_symbol_derivatives)
@@ -11,81 +9,280 @@ from sympy import Pow
 DEBUG = False
 #DEBUG = True
 
-from pyccel.ast.utilities import math_functions as _known_functions_math
-
-from sympde.topology import Domain              as sym_Domain
-from sympde.topology import Boundary            as sym_Boundary
-from sympde.topology import NormalVector        as sym_NormalVector
-from sympde.topology import TangentVector       as sym_TangentVector
-from sympde.topology import FunctionSpace       as sym_FunctionSpace
-from sympde.topology import VectorFunctionSpace as sym_VectorFunctionSpace
-from sympde.topology import ProductSpace        as sym_ProductSpace
-from sympde.topology import Field               as sym_Field
-from sympde.topology import VectorField         as sym_VectorField
-from sympde.topology import TestFunction        as sym_TestFunction
-from sympde.topology import VectorTestFunction  as sym_VectorTestFunction
-from sympde.topology import Constant            as sym_Constant
-
-from sympde.expr     import LinearForm          as sym_LinearForm
-from sympde.expr     import BilinearForm        as sym_BilinearForm
-from sympde.expr     import Equation            as sym_Equation
-from sympde.expr     import EssentialBC         as sym_EssentialBC
-
-from sympde.calculus import grad, dot, inner, cross, rot, curl, div
-from sympde.calculus import laplace, hessian, bracket
-from sympde.topology import (dx, dy, dz)
-
-_known_operators = {
-    'dx':      dx,
-    'dy':      dy,
-    'dz':      dz,
-    'grad':    grad,
-    'dot':     dot,
-    'inner':   inner,
-    'cross':   cross,
-    'rot':     rot,
-    'curl':    curl,
-    'div':     div,
-    'laplace': laplace,
-    'hessian': hessian,
-    'bracket': bracket,
-}
-
-_known_constants_math = {'pi':pi}
-
-# Global variable namespace
-namespace = {}
-stack     = {}
-settings  = {}
+from .session import get_session, builtins
+
+# ... sympy, sympde and pyccel are only imported when the first declaration
+#     is lowered, by load_backend, so that importing vale stays cheap
+_backend_loaded = False
+
+_known_operators      = {}
+_known_functions_math = {}
+_known_constants_math = {}
+
+def load_backend():
+    """Imports the sympy, sympde and pyccel objects used to lower the
+    declarations and builds the tables of known operators, functions and
+    constants. Only the first call does something."""
+    global _backend_loaded
+
+    global Basic, Expr, Tuple, Add, Mul, Pow
+    global sym_Domain, sym_Boundary, sym_NormalVector, sym_TangentVector
+    global sym_FunctionSpace, sym_VectorFunctionSpace, sym_ProductSpace
+    global sym_Field, sym_VectorField
+    global sym_TestFunction, sym_VectorTestFunction, sym_Constant
+    global sym_LinearForm, sym_BilinearForm, sym_Equation, sym_EssentialBC
+
+    if _backend_loaded:
+        return
+
+    from sympy import Basic
+    from sympy import Expr
+    from sympy import Tuple
+    from sympy import pi
+    from sympy import Add
+    from sympy import Mul
+    from sympy import Pow
+
+    from pyccel.ast.utilities import math_functions
+
+    from sympde.topology import Domain              as sym_Domain
+    from sympde.topology import Boundary            as sym_Boundary
+    from sympde.topology import NormalVector        as sym_NormalVector
+    from sympde.topology import TangentVector       as sym_TangentVector
+    from sympde.topology import FunctionSpace       as sym_FunctionSpace
+    from sympde.topology import VectorFunctionSpace as sym_VectorFunctionSpace
+    from sympde.topology import ProductSpace        as sym_ProductSpace
+    from sympde.topology import Field               as sym_Field
+    from sympde.topology import VectorField         as sym_VectorField
+    from sympde.topology import TestFunction        as sym_TestFunction
+    from sympde.topology import VectorTestFunction  as sym_VectorTestFunction
+    from sympde.topology import Constant            as sym_Constant
+
+    from sympde.expr     import LinearForm          as sym_LinearForm
+    from sympde.expr     import BilinearForm        as sym_BilinearForm
+    from sympde.expr     import Equation            as sym_Equation
+    from sympde.expr     import EssentialBC         as sym_EssentialBC
+
+    from sympde.calculus import grad, dot, inner, cross, rot, curl, div
+    from sympde.calculus import laplace, hessian, bracket
+    from sympde.topology import (dx, dy, dz)
+
+    _known_operators.update({
+        'dx':      dx,
+        'dy':      dy,
+        'dz':      dz,
+        'grad':    grad,
+        'dot':     dot,
+        'inner':   inner,
+        'cross':   cross,
+        'rot':     rot,
+        'curl':    curl,
+        'div':     div,
+        'laplace': laplace,
+        'hessian': hessian,
+        'bracket': bracket,
+    })
+
+    _known_functions_math.update(math_functions)
+    _known_constants_math.update({'pi':pi})
+
+    # ... one table, where operators take precedence over functions, and
+    #     functions over constants
+    builtins.update(_known_constants_math)
+    builtins.update(_known_functions_math)
+    builtins.update(_known_operators)
+    # ...
+
+    _backend_loaded = True
+# ...
 
 #======================================================================
 def insert_namespace(key, value):
-    if key in namespace.keys():
+    session = get_session()
+    if key in session.namespace.keys():
         raise ValueError('{} already defined'.format(key))
 
-    namespace[key] = value
+    session.define(key, value)
+
+#======================================================================
+def declaration(init):
+    """Decorator for the constructors of declarations.
+
+    The names read and defined while lowering the declaration are recorded
+    in the active session, and the constructor is measured if the session
+    is instrumented.
+    """
+    @wraps(init)
+    def wrapper(self, **kwargs):
+        if not _backend_loaded:
+            load_backend()
+
+        session = get_session()
+        session.begin_declaration()
+
+        instrumentation = session.instrumentation
+        if instrumentation is None:
+            init(self, **kwargs)
+
+        else:
+            instrumentation.begin('declaration')
+            try:
+                init(self, **kwargs)
+            finally:
+                instrumentation.end(getattr(self, 'name', None),
+                                    kind=self.__class__.__name__)
+
+        session.end_declaration(self.name)
+
+    return wrapper
+
+#======================================================================
+def split_space(space):
+    """Returns the spaces of the components of a space, e.g. (W, V) for
+    U = W*V, or (V,) for V. The result is computed once per session."""
+    spaces = get_session().spaces
+    components = spaces.get(space, None)
+    if components is None:
+        if isinstance(space, sym_ProductSpace):
+            components = tuple(space.spaces)
+        else:
+            components = (space,)
+        spaces[space] = components
+    return components
+
+def form_function(space, name):
+    """Returns the test function of a space with a given name. The
+    functions are shared by all the declarations of a session."""
+    if isinstance(space, sym_FunctionSpace):
+        kind = sym_TestFunction
+
+    elif isinstance(space, sym_VectorFunctionSpace):
+        kind = sym_VectorTestFunction
+
+    else:
+        raise TypeError('{} is not a function space'.format(space))
+
+    functions = get_session().functions
+    key = (space, name, kind)
+
+    v = functions.get(key, None)
+    if v is None:
+        v = kind(space, name=name)
+        functions[key] = v
+    return v
+
+def form_functions(args):
+    """Returns the test functions of the arguments of a form or equation,
+    e.g. [v, q] for (v,q)::U."""
+    space  = get_session().lookup(args.space)
+    spaces = split_space(space)
+
+    assert(len(spaces) == len(args.functions))
+
+    return [form_function(V, i.name) for i,V in zip(args.functions, spaces)]
+
+#======================================================================
+def hashcons(expr):
+    """Returns the unique shared instance of a lowered sympy expression."""
+    if not isinstance(expr, Basic):
+        return expr
+
+    # the class is part of the key, since some numbers compare equal to
+    # numbers of a different type
+    expressions = get_session().expressions
+    return expressions.setdefault((expr.__class__, expr), expr)
+
+#======================================================================
+def is_nary(args):
+    """Returns True if the lowered args can be combined in one n-ary sympy
+    Add or Mul.
+
+    This is the case if they are sympy expressions, or numbers, with the
+    default arithmetic; objects overriding it (a higher _op_priority) are
+    combined one operation at a time. At least one expression is needed,
+    otherwise numbers are combined by Python.
+    """
+    found = False
+    for a in args:
+        if isinstance(a, (int, float)):
+            continue
+
+        if not isinstance(a, Expr):
+            return False
+
+        if not( a._op_priority == Expr._op_priority ):
+            return False
+
+        found = True
+
+    return found
 
 #======================================================================
 class BasicPDE(object):
 
     def __init__(self, **kwargs):
-        self.namespace = namespace
+        self.namespace = get_session().namespace
 
 #======================================================================
 class PDE(BasicPDE):
     """Class for PDE syntax."""
     def __init__(self, **kwargs):
         self.declarations = kwargs.pop('declarations')
+        self.index        = declarations_index(self.declarations)
         BasicPDE.__init__(self, **kwargs)
 
+    @property
+    def dag(self):
+        """The common subexpressions of all the forms and equations, computed
+        on first use. See vale.cse."""
+        dag = getattr(self, '_dag', None)
+        if dag is None:
+            from .cse import common_subexpressions
+
+            dag = common_subexpressions(self)
+            self._dag = dag
+        return dag
+
+def declarations_index(declarations):
+    """Returns a dictionary giving the first declaration of every name."""
+    index = {}
+    for token in declarations:
+        index.setdefault(token.name, token)
+    return index
+
 #======================================================================
 class Domain(BasicPDE):
     """Class representing a Domain."""
+
+    # attributes kept in the model cache, see dump_model
+    _cached = ('mesh',)
+
+    @declaration
     def __init__(self, **kwargs):
         name = kwargs.pop('name')
         dim  = kwargs.pop('dim', None)
         filename = kwargs.pop('filename', None)
 
+        # ... the mesh is read from a manifest, see vale.mesh
+        mesh = None
+        if filename:
+            from .mesh import Mesh
+
+            session = get_session()
+
+            directory = session.settings.get('directory', None)
+            if not( directory is None ):
+                filename = os.path.join(directory, filename)
+
+            mesh = Mesh(filename)
+            if dim and not( dim == mesh.dim ):
+                raise ValueError('{}: expecting dim={}, found {}'
+                                 .format(filename, dim, mesh.dim))
+
+            dim = mesh.dim
+            session.meshes[name] = mesh
+        # ...
+
         expr = self
         if not( dim is None ):
             atom = sym_Domain(name, dim=dim)
@@ -99,9 +296,7 @@ class Domain(BasicPDE):
             insert_namespace('nn', sym_NormalVector('nn'))
             insert_namespace('tt', sym_TangentVector('tt'))
 
-        elif not( filename is None ):
-            raise NotImplementedError('')
-
+        self.mesh = mesh
         self.name = name
         BasicPDE.__init__(self, **kwargs)
 
@@ -109,12 +304,15 @@ class Domain(BasicPDE):
 # TODO kind is not used yet
 class FunctionSpace(BasicPDE):
     """Class representing a Finite Element FunctionSpace."""
+    @declaration
     def __init__(self, **kwargs):
+        session = get_session()
+
         name   = kwargs.pop('name')
         domain = kwargs.pop('domain')
         kind   = kwargs.pop('kind', 'h1')
 
-        domain = namespace[domain]
+        domain = session.lookup(domain)
         V = sym_FunctionSpace(name, domain)
 
         insert_namespace(name, V)
@@ -126,15 +324,18 @@ class FunctionSpace(BasicPDE):
 # TODO kind is not used yet
 class VectorFunctionSpace(BasicPDE):
     """Class representing a Finite Element VectorFunctionSpace."""
+    @declaration
     def __init__(self, **kwargs):
+        session = get_session()
+
         name   = kwargs.pop('name')
         domain = kwargs.pop('domain')
         kind   = kwargs.pop('kind', 'h1')
 
-        domain = namespace[domain]
+        domain = session.lookup(domain)
         V = sym_VectorFunctionSpace(name, domain)
 
-        namespace[name] = V
+        insert_namespace(name, V)
 
         self.name = name
         BasicPDE.__init__(self, **kwargs)
@@ -143,11 +344,14 @@ class VectorFunctionSpace(BasicPDE):
 #======================================================================
 class Field(BasicPDE):
     """Class representing a Field."""
+    @declaration
     def __init__(self, **kwargs):
+        session = get_session()
+
         name  = kwargs.pop('name')
         space = kwargs.pop('space')
 
-        space = namespace[space]
+        space = session.lookup(space)
         if isinstance(space, sym_FunctionSpace):
             v = sym_Field(space, name=name)
 
@@ -162,6 +366,7 @@ class Field(BasicPDE):
 #======================================================================
 class Alias(BasicPDE):
     """Class representing an Alias."""
+    @declaration
     def __init__(self, **kwargs):
         name  = kwargs.pop('name')
         rhs = kwargs.pop('rhs')
@@ -176,7 +381,21 @@ class Alias(BasicPDE):
 #      - add name/label
 class Equation(BasicPDE):
     """Class representing an Equation."""
+
+    # attributes kept in the model cache, see dump_model
+    _cached = ('lhs_integrand', 'rhs_integrand',
+               'test_functions', 'trial_functions', 'boundaries',
+               'conditions', 'bilinear_forms', 'linear_forms', 'plan')
+
+    conditions     = ()
+    bilinear_forms = ()
+    linear_forms   = ()
+
+    @declaration
     def __init__(self, **kwargs):
+        session   = get_session()
+        namespace = session.namespace
+
         name  = kwargs.pop('name', 'equation')
 
         tests  = kwargs.pop('tests')
@@ -185,110 +404,127 @@ class Equation(BasicPDE):
         rhs    = kwargs.pop('rhs')
         bc     = kwargs.pop('bc', None)
 
-        # ... create test functions
-        args = tests
-        space = namespace[args.space]
+        local_functions = []
 
-        if isinstance(space, sym_ProductSpace):
-            space = space.spaces
-        else:
-            space = [space]
-
-        assert(len(space) == len(args.functions))
-
-        functions = []
-        for i,V in zip(args.functions, space):
-            if isinstance(V, sym_FunctionSpace):
-                v = sym_TestFunction(V, name=i.name)
+        # ... create test functions
+        functions = form_functions(tests)
+        local_functions += functions
+        self.test_functions = tuple(functions)
 
-            elif isinstance(V, sym_VectorFunctionSpace):
-                v = sym_VectorTestFunction(V, name=i.name)
+        if len(functions) == 1:
+            functions = functions[0]
 
-            functions.append(v)
+        test_functions = functions
+        # ...
 
-        for v in functions:
-            insert_namespace(v.name, v)
+        # ... create trial functions
+        functions = form_functions(trials)
+        local_functions += functions
+        self.trial_functions = tuple(functions)
 
         if len(functions) == 1:
             functions = functions[0]
 
-        test_functions = functions
+        trial_functions = functions
         # ...
 
-        # ... create trial functions
-        args = trials
-        space = namespace[args.space]
+        # ... test and trial functions are only known inside the equation
+        with session.scope(local_functions):
+            # ... prepare boundary conditions
+            self.boundaries = None
+            conditions = []
+            if bc:
+                # TODO get domain from space
+                domain = [k for k,v in namespace.items() if isinstance(v, sym_Domain)]
+                mesh   = session.meshes.get(domain[0], None)
+                domain = session.lookup(domain[0])
 
-        if isinstance(space, sym_ProductSpace):
-            space = space.spaces
-        else:
-            space = [space]
+                # ... named boundaries of a mesh are resolved on first use
+                if not( mesh is None ):
+                    from .mesh import Boundaries
 
-        assert(len(space) == len(args.functions))
-        functions = []
-        for i,V in zip(args.functions, space):
-            if isinstance(V, sym_FunctionSpace):
-                v = sym_TestFunction(V, name=i.name)
+                    names = [b.boundary for b in bc]
+                    for bnd in names:
+                        if not( bnd in mesh.boundary_names ):
+                            raise ValueError('Unknown boundary {} in {}'
+                                             .format(bnd, mesh.filename))
 
-            elif isinstance(V, sym_VectorFunctionSpace):
-                v = sym_VectorTestFunction(V, name=i.name)
+                    self.boundaries = Boundaries(mesh, names)
+                # ...
 
-            functions.append(v)
+                _bc = []
+                for b in bc:
+                    bnd     = b.boundary
+                    bnd     = sym_Boundary(bnd, domain)
 
-        for v in functions:
-            insert_namespace(v.name, v)
+                    bnd_lhs = b.lhs.expr
+                    bnd_rhs = b.rhs.expr
 
-        if len(functions) == 1:
-            functions = functions[0]
+                    sym_bc = sym_EssentialBC(bnd_lhs, bnd_rhs, bnd)
+                    _bc.append(sym_bc)
 
-        trial_functions = functions
-        # ...
+                    conditions.append((b.boundary, bnd_lhs, bnd_rhs))
 
-        # ... prepare boundary conditions
-        if bc:
-            # TODO get domain from space
-            domain = [i for i in namespace.values() if isinstance(i, sym_Domain)]
-            domain = domain[0]
+                bc = _bc
+            # ...
 
-            _bc = []
-            for b in bc:
-                bnd     = b.boundary
-                bnd     = sym_Boundary(bnd, domain)
+            rhs = rhs.expr
+            lhs = lhs.expr
+        # ...
 
-                bnd_lhs = b.lhs.expr
-                bnd_rhs = b.rhs.expr
+        self.lhs_integrand = lhs
+        self.rhs_integrand = rhs
+        self.conditions    = tuple(conditions)
 
-                sym_bc = sym_EssentialBC(bnd_lhs, bnd_rhs, bnd)
-                _bc.append(sym_bc)
+        # ... the forms applied in the equation, for the assembly plan
+        reads = session.reads()
+        forms = [k for k in namespace if k in reads]
 
-            bc = _bc
+        self.bilinear_forms = tuple(k for k in forms
+                                    if isinstance(namespace[k],
+                                                  sym_BilinearForm))
+        self.linear_forms   = tuple(k for k in forms
+                                    if isinstance(namespace[k],
+                                                  sym_LinearForm))
         # ...
 
         # ... define sympde Equation
-        rhs = rhs.expr
-        lhs = lhs.expr
-
         atom = sym_Equation(lhs, rhs, bc=bc)
         insert_namespace(name, atom)
         # ...
 
-        # ... clean namespace
-        if not isinstance(test_functions, (tuple, list, Tuple)):
-            test_functions = [test_functions]
-
-        if not isinstance(trial_functions, (tuple, list, Tuple)):
-            trial_functions = [trial_functions]
-
-        for v in test_functions + trial_functions:
-            namespace.pop(v.name)
-        # ...
-
         self.name = name
         BasicPDE.__init__(self, **kwargs)
 
+    @property
+    def plan(self):
+        """The assembly plan of the equation. See vale.plan.
+
+        It is computed on first use, or when the model is stored in the
+        model cache, so that a model loaded from the cache has it; the
+        parse itself never computes it."""
+        plan = getattr(self, '_plan', None)
+        if plan is None:
+            from .plan import assembly_plan
+
+            plan = assembly_plan(self.name,
+                                 self.lhs_integrand, self.rhs_integrand,
+                                 self.test_functions, self.trial_functions,
+                                 conditions=self.conditions,
+                                 bilinear_forms=self.bilinear_forms,
+                                 linear_forms=self.linear_forms,
+                                 boundaries=self.boundaries)
+            self._plan = plan
+        return plan
+
+    @plan.setter
+    def plan(self, plan):
+        self._plan = plan
+
 #======================================================================
 class Real(BasicPDE):
     """Class representing a Real number."""
+    @declaration
     def __init__(self, **kwargs):
         name  = kwargs.pop('name')
 
@@ -301,6 +537,7 @@ class Real(BasicPDE):
 #======================================================================
 class Complex(BasicPDE):
     """Class representing a Complex number."""
+    @declaration
     def __init__(self, **kwargs):
         name  = kwargs.pop('name')
 
@@ -313,6 +550,7 @@ class Complex(BasicPDE):
 # TODO
 class Function(object):
     """Class representing a Function."""
+    @declaration
     def __init__(self, **kwargs):
         """
         A Function has the following attributs
@@ -330,100 +568,110 @@ class Function(object):
         self.name       = kwargs.pop('name')
         self.parameters = kwargs.pop('parameters', {})
 
-        namespace[self.name] = self
+        insert_namespace(self.name, self)
 
 
 #======================================================================
-class LinearForm(BasicPDE):
-    """Class representing a Linear Form."""
+class BasicForm(BasicPDE):
+    """Base class for the linear and bilinear forms.
 
-    def __init__(self, **kwargs):
-        name = kwargs.pop('name')
-        args = kwargs.pop('args')
-        body = kwargs.pop('body')
+    The lowered integrand, and the test and trial functions, are kept on the
+    declaration.
+    """
+    integrand       = None
+    test_functions  = ()
+    trial_functions = ()
 
-        # ... create test functions
-        space = namespace[args.space]
+    # attributes kept in the model cache, see dump_model
+    _cached = ('integrand', 'test_functions', 'trial_functions')
 
-        if isinstance(space, sym_ProductSpace):
-            space = space.spaces
-        else:
-            space = [space]
+    @property
+    def kernel(self):
+        """The vectorized NumPy kernel of the integrand. See vale.kernels."""
+        from .kernels import get_kernel
 
-        assert(len(space) == len(args.functions))
+        functions = list(self.test_functions) + list(self.trial_functions)
+        return get_kernel(self.integrand, functions)
 
-        functions = []
-        for i,V in zip(args.functions, space):
-            if isinstance(V, sym_FunctionSpace):
-                v = sym_TestFunction(V, name=i.name)
+    def compile(self, folder=None, use_pyccel=None):
+        """Returns the element kernels of the form, compiled by pyccel if
+        available. See vale.codegen."""
+        from .codegen import compile_form
 
-            elif isinstance(V, sym_VectorFunctionSpace):
-                v = sym_VectorTestFunction(V, name=i.name)
+        return compile_form(self, folder=folder, use_pyccel=use_pyccel)
 
-            functions.append(v)
+#======================================================================
+class LinearForm(BasicForm):
+    """Class representing a Linear Form."""
 
-        for v in functions:
-            insert_namespace(v.name, v)
+    @declaration
+    def __init__(self, **kwargs):
+        session = get_session()
+
+        name = kwargs.pop('name')
+        args = kwargs.pop('args')
+        body = kwargs.pop('body')
+
+        local_functions = []
+
+        # ... create test functions
+        functions = form_functions(args)
+        local_functions += functions
+        self.test_functions = tuple(functions)
 
         if len(functions) == 1:
             functions = functions[0]
         # ...
 
-        # ...
-        if isinstance(body, SimpleBodyForm):
-            expression = body.expression.expr
+        # ... test and trial functions are only known inside the form
+        with session.scope(local_functions):
+            if isinstance(body, SimpleBodyForm):
+                expression = body.expression.expr
 
-        elif isinstance(body, Expression):
-            expression = body.expr
+            elif isinstance(body, Expression):
+                expression = body.expr
         # ...
 
+        self.integrand = expression
+
         atom = sym_LinearForm(functions, expression)
         insert_namespace(name, atom)
 
-        # ... clean namespace
-        if not isinstance(functions, (tuple, list, Tuple)):
-            functions = [functions]
-
-        for v in functions:
-            namespace.pop(v.name)
-        # ...
-
         self.name = name
         BasicPDE.__init__(self, **kwargs)
 
 #======================================================================
-class BilinearForm(BasicPDE):
+class BilinearForm(BasicForm):
     """Class representing a Bilinear Form."""
 
+    @property
+    def blocks(self):
+        """The (test function, trial function) blocks of the integrand,
+        computed on first use. See vale.blocks."""
+        blocks = getattr(self, '_blocks', None)
+        if blocks is None:
+            from .blocks import block_structure
+
+            blocks = block_structure(self.integrand, self.test_functions,
+                                     self.trial_functions)
+            self._blocks = blocks
+        return blocks
+
+    @declaration
     def __init__(self, **kwargs):
+        session = get_session()
+
         name       = kwargs.pop('name')
         args_test  = kwargs.pop('args_test')
         args_trial = kwargs.pop('args_trial')
         body       = kwargs.pop('body')
 
-        # ... create test functions
-        args = args_test
-        space = namespace[args.space]
-
-        if isinstance(space, sym_ProductSpace):
-            space = space.spaces
-        else:
-            space = [space]
-
-        assert(len(space) == len(args.functions))
-
-        functions = []
-        for i,V in zip(args.functions, space):
-            if isinstance(V, sym_FunctionSpace):
-                v = sym_TestFunction(V, name=i.name)
-
-            elif isinstance(V, sym_VectorFunctionSpace):
-                v = sym_VectorTestFunction(V, name=i.name)
+        local_functions = []
 
-            functions.append(v)
-
-        for v in functions:
-            insert_namespace(v.name, v)
+        # ... create test functions
+        functions = form_functions(args_test)
+        local_functions += functions
+        self.test_functions = tuple(functions)
 
         if len(functions) == 1:
             functions = functions[0]
@@ -432,27 +680,9 @@ class BilinearForm(BasicPDE):
         # ...
 
         # ... create trial functions
-        args = args_trial
-        space = namespace[args.space]
-
-        if isinstance(space, sym_ProductSpace):
-            space = space.spaces
-        else:
-            space = [space]
-
-        assert(len(space) == len(args.functions))
-        functions = []
-        for i,V in zip(args.functions, space):
-            if isinstance(V, sym_FunctionSpace):
-                v = sym_TestFunction(V, name=i.name)
-
-            elif isinstance(V, sym_VectorFunctionSpace):
-                v = sym_VectorTestFunction(V, name=i.name)
-
-            functions.append(v)
-
-        for v in functions:
-            insert_namespace(v.name, v)
+        functions = form_functions(args_trial)
+        local_functions += functions
+        self.trial_functions = tuple(functions)
 
         if len(functions) == 1:
             functions = functions[0]
@@ -460,29 +690,21 @@ class BilinearForm(BasicPDE):
         trial_functions = functions
         # ...
 
-        # ...
-        if isinstance(body, SimpleBodyForm):
-            expression = body.expression.expr
+        # ... test and trial functions are only known inside the form
+        with session.scope(local_functions):
+            if isinstance(body, SimpleBodyForm):
+                expression = body.expression.expr
 
-        elif isinstance(body, Expression):
-            expression = body.expr
+            elif isinstance(body, Expression):
+                expression = body.expr
         # ...
 
+        self.integrand = expression
+
         args = (test_functions, trial_functions)
         atom = sym_BilinearForm(args, expression)
         insert_namespace(name, atom)
 
-        # ... clean namespace
-        if not isinstance(test_functions, (tuple, list, Tuple)):
-            test_functions = [test_functions]
-
-        if not isinstance(trial_functions, (tuple, list, Tuple)):
-            trial_functions = [trial_functions]
-
-        for v in test_functions + trial_functions:
-            namespace.pop(v.name)
-        # ...
-
         self.name = name
         BasicPDE.__init__(self, **kwargs)
 
@@ -507,28 +729,92 @@ class SimpleBodyForm(BodyForm):
 
 
 #======================================================================
-class Trailer(object):
-    """Class representing a trailer."""
-    def __init__(self, **kwargs):
-        self.args = kwargs.pop('args', [])
+_missing = object()
+
+def lower(node):
+    """Returns the lowered expression of a node, after lowering the nodes
+    below it.
+
+    The tree is walked with an explicit stack, children first, instead of
+    recursive calls, so that the nesting depth of an expression is not
+    limited by the Python recursion limit.
+    """
+    expr = node._expr
+    if not( expr is _missing ):
+        return expr
+
+    if not _backend_loaded:
+        load_backend()
+
+    instrumentation = get_session().instrumentation
+
+    # nodes whose children are being lowered
+    stack = [(node, None)]
+    while stack:
+        node, children = stack[-1]
+
+        if children is None:
+            children = node._children()
+            stack[-1] = (node, children)
+
+            pending = [c for c in children if c._expr is _missing]
+            if pending:
+                stack.extend((c, None) for c in reversed(pending))
+                continue
+
+        stack.pop()
+        args = [c._expr for c in children]
+
+        if instrumentation is None:
+            node._expr = hashcons(node._lower(*args))
+
+        else:
+            instrumentation.begin('lower')
+            try:
+                node._expr = hashcons(node._lower(*args))
+            finally:
+                instrumentation.end(node.__class__.__name__)
+
+    return node._expr
+
+#======================================================================
+class BasicExpr(object):
+    """Base class for the nodes that are lowered to a sympy expression.
+
+    A node is lowered once, by calling its _lower method with the lowered
+    expressions of the nodes returned by _children; the result is cached
+    and shared with identical subexpressions. See lower.
+    """
+    _expr = _missing
 
     @property
     def expr(self):
-        return [i.expr for i in self.args]
+        expr = self._expr
+        if expr is _missing:
+            expr = lower(self)
+        return expr
+
+    def _children(self):
+        return []
+
+    def _lower(self, *args):
+        raise NotImplementedError('{} does not define _lower'
+                                  .format(self.__class__.__name__))
 
 #======================================================================
-class Power(object):
-    """Class representing a power."""
+class Trailer(BasicExpr):
+    """Class representing a trailer."""
     def __init__(self, **kwargs):
-        self.arg = kwargs.pop('arg', None)
-        self.op  = kwargs.pop('op',  None)
+        self.args = kwargs.pop('args', [])
 
-    @property
-    def expr(self):
-        return Pow(self.op.expr, self.arg.expr, evaluate=False)
+    def _children(self):
+        return self.args
+
+    def _lower(self, *args):
+        return list(args)
 
 #======================================================================
-class ExpressionElement(object):
+class ExpressionElement(BasicExpr):
     """Class representing an element of an expression."""
     def __init__(self, **kwargs):
 
@@ -544,51 +830,114 @@ class ExpressionElement(object):
 
 #======================================================================
 class Factor(ExpressionElement):
-    """Class representing a signed factor."""
+    """Class representing a signed factor, with an optional exponent."""
     def __init__(self, **kwargs):
         self.sign = kwargs.pop('sign', '+')
         self.trailer = kwargs.pop('trailer', [])
+        self.exponent = kwargs.pop('exponent', None)
         super(Factor, self).__init__(**kwargs)
 
-    @property
-    def expr(self):
-        expr = self.op.expr
-        trailer = self.trailer
-        if trailer:
-            expr = expr(*trailer.expr)
+    def _children(self):
+        children = [self.op]
+        if self.trailer:
+            children.append(self.trailer)
+        if self.exponent:
+            children.append(self.exponent)
+        return children
+
+    def _lower(self, expr, *args):
+        args = list(args)
+        if self.trailer:
+            if isinstance(expr, (sym_LinearForm, sym_BilinearForm)):
+                expr = get_session().apply(expr, args.pop(0))
+            else:
+                expr = expr(*args.pop(0))
+
+        # the exponent binds tighter than the sign: -x**2 is -(x**2)
+        if self.exponent:
+            expr = Pow(expr, args.pop(0), evaluate=False)
 
         return -expr if self.sign == '-' else expr
 
 
 #======================================================================
 class Term(ExpressionElement):
-    @property
-    def expr(self):
-        ret = self.op[0].expr
-        for operation, operand in zip(self.op[1::2], self.op[2::2]):
-            if operation == '*':
-                ret *= operand.expr
+    def _children(self):
+        return self.op[0::2]
+
+    def _lower(self, *factors):
+        if len(factors) == 1:
+            return factors[0]
+
+        inverse = [False] + [operation == '/' for operation in self.op[1::2]]
+
+        # ... the leading numbers are combined by Python, as when folding one
+        #     operation at a time, so that 1/2*x gives 0.5*x as (1/2)*x does
+        ret = factors[0]
+        k = 1
+        while ( k < len(factors) and isinstance(ret, (int, float)) and
+                isinstance(factors[k], (int, float)) ):
+            if inverse[k]:
+                ret /= factors[k]
             else:
-                ret /= operand.expr
+                ret *= factors[k]
+            k += 1
+
+        if k == len(factors):
+            return ret
+
+        factors = [ret] + list(factors[k:])
+        inverse = [False] + inverse[k:]
+        # ...
+
+        # ... one n-ary Mul instead of a Mul per operation
+        if is_nary(factors):
+            args = [Pow(f, -1) if inv else f for f, inv in zip(factors, inverse)]
+            return Mul(*args)
+        # ...
+
+        ret = factors[0]
+        for f, inv in zip(factors[1:], inverse[1:]):
+            if inv:
+                ret /= f
+            else:
+                ret *= f
         return ret
 
 
 #======================================================================
 class Expression(ExpressionElement):
-    @property
-    def expr(self):
-        ret = self.op[0].expr
-        for operation, operand in zip(self.op[1::2], self.op[2::2]):
-            if operation == '+':
-                ret += operand.expr
+    def _children(self):
+        return self.op[0::2]
+
+    def _lower(self, *terms):
+        if len(terms) == 1:
+            return terms[0]
+
+        # ... one n-ary Add instead of an Add per operation
+        signs = ['+'] + self.op[1::2]
+
+        if is_nary(terms):
+            args = [-t if sign == '-' else t for t, sign in zip(terms, signs)]
+            return Add(*args)
+        # ...
+
+        ret = terms[0]
+        for t, sign in zip(terms[1:], signs[1:]):
+            if sign == '-':
+                ret -= t
             else:
-                ret -= operand.expr
+                ret += t
         return ret
 
 #======================================================================
 class Operand(ExpressionElement):
-    @property
-    def expr(self):
+    def _children(self):
+        if isinstance(self.op, ExpressionElement):
+            return [self.op]
+        return []
+
+    def _lower(self, *args):
 #        if DEBUG:
 #        if True:
 #            print("> Operand ")
@@ -599,19 +948,13 @@ class Operand(ExpressionElement):
             return op
 
         elif isinstance(op, str):
-            if op in _known_operators.keys():
-                return _known_operators[op]
-
-            if op in _known_functions_math.keys():
-                return _known_functions_math[op]
-
-            if op in _known_constants_math.keys():
-                return _known_constants_math[op]
-
-            if not(op in namespace.keys()):
+            try:
+                return get_session().lookup(op)
+            except KeyError:
                 raise ValueError('{} not found'.format(op))
 
-            return namespace[op]
+        elif isinstance(op, ExpressionElement):
+            return args[0]
 
 #        elif type(op) == list:
 #            # op is a list
@@ -0,0 +1,26 @@
+# coding: utf-8
+
+import os
+
+from vale.batch import compile_files
+
+base_dir = os.path.dirname(os.path.realpath(__file__))
+data_dir = os.path.join(base_dir, 'data')
+
+#==============================================================================
+def test_compile_files(tmpdir):
+    # a file that does not parse must not stop the others
+    bad = tmpdir.join('bad.vl')
+    bad.write('Domain(dim=2) :: \n')
+
+    output_dir = str(tmpdir.join('output'))
+    report = compile_files([data_dir, str(bad)], processes=2,
+                           output_dir=output_dir)
+
+    assert(len(report.results) == 2)
+    assert(len(report.failures) == 1)
+    assert(report.failures[0].filename == str(bad))
+
+    ok = [r for r in report.results if r.ok][0]
+    assert(os.path.isfile(ok.output))
+    assert(report.throughput > 0.)
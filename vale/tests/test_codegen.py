@@ -0,0 +1,127 @@
+# coding: utf-8
+
+import os
+
+import numpy as np
+
+from vale.parser import Parser, get_by_name
+
+base_dir = os.path.dirname(os.path.realpath(__file__))
+data_dir = os.path.join(base_dir, 'data')
+
+#==============================================================================
+def test_element_kernels(tmpdir):
+    filename = os.path.join(data_dir, 'pde.vl')
+    ast = Parser().parse_from_file(filename)
+
+    n_test, n_trial, n_quad = 3, 4, 5
+    v   = np.random.random((n_test, n_quad))
+    u   = np.random.random((n_trial, n_quad))
+    phi = np.random.random(n_quad)
+    w   = np.random.random(n_quad)
+
+    # pyccel is used if found, the results are the same
+    folder = str(tmpdir)
+
+    kernel = get_by_name(ast, 'a1').compile(folder=folder).blocks[0, 0]
+    assert(np.allclose(kernel(w, u=u, v=v), np.einsum('iq,jq,q->ij', v, u, w)))
+    assert("def kernel(u : 'float[:,:]', v : 'float[:,:]'" in kernel.source)
+
+    kernel = get_by_name(ast, 'l5').compile(folder=folder).blocks[0,]
+    assert(np.allclose(kernel(w, phi=phi, v=v), (np.exp(-phi)*v).dot(w)))
+
+    # only the nonzero blocks
+    kernels = get_by_name(ast, 'a13').compile(folder=folder)
+    assert(sorted(kernels.blocks) == [(0, 0), (0, 1), (1, 0)])
+
+def test_numpy_fallback(tmpdir):
+    code = """
+Domain(dim=2)        :: Omega
+FunctionSpace(Omega) :: V
+Real                 :: alpha
+
+l1(v::V) = < alpha*x*v >
+l2(v::V) = < 2 >
+"""
+    ast = Parser().parse(code)
+
+    v = np.random.random((3, 4))
+    x = np.linspace(0., 1., 4)
+    w = np.ones(4)
+
+    kernels = get_by_name(ast, 'l1').compile(use_pyccel=False)
+    assert(not kernels.compiled)
+
+    kernel = kernels.blocks[0,]
+    assert(kernel.kinds == {'alpha': 'constant', 'x': 'field', 'v': 'test'})
+    assert(np.allclose(kernel(w, alpha=2., x=x, v=v), 2*(x*v).sum(axis=1)))
+
+    # kernels are shared by hash and build options
+    l1 = get_by_name(ast, 'l1')
+    assert(l1.compile(use_pyccel=False).blocks[0,] is kernel)
+    other = l1.compile(folder=str(tmpdir), use_pyccel=True).blocks[0,]
+    assert(not( other is kernel ))
+    assert(l1.compile(folder=str(tmpdir), use_pyccel=True).blocks[0,] is other)
+
+    # the size of a constant form is given by out
+    kernel = get_by_name(ast, 'l2').compile(use_pyccel=False).blocks[0,]
+    out = kernel(w, out=np.zeros(3))
+    assert(np.allclose(out, 8.))
+
+def test_cache_folder(tmpdir, monkeypatch):
+    import tempfile
+    from vale import codegen
+
+    # a per-user folder, not a shared temporary one
+    monkeypatch.delenv('VALE_CACHE_DIR', raising=False)
+    monkeypatch.setenv('XDG_CACHE_HOME', str(tmpdir))
+    folder = codegen.default_cache_dir()
+    assert(folder == str(tmpdir.join('vale', 'kernels')))
+    assert(not folder.startswith(tempfile.gettempdir() + '/vale-kernels'))
+
+    codegen.private_folder(folder)
+    assert(os.stat(folder).st_mode & 0o777 == 0o700)
+
+    # extensions are never imported from a folder writable by others
+    shared = tmpdir.join('shared')
+    shared.mkdir()
+    shared.chmod(0o777)
+    try:
+        codegen.private_folder(str(shared))
+    except PermissionError:
+        pass
+    else:
+        assert(False)
+
+def test_form_lookup(monkeypatch):
+    from vale import codegen
+
+    code = """
+Domain(dim=2)        :: Omega
+FunctionSpace(Omega) :: V
+
+l1(v::V) = < x*v >
+"""
+    ast = Parser().parse(code)
+    l1 = get_by_name(ast, 'l1')
+
+    kernel = l1.compile(use_pyccel=False).blocks[0,]
+
+    # the kernel of a known form is found without generating its source
+    def fail(*args, **kwargs):
+        raise AssertionError('ElementKernel built again')
+    monkeypatch.setattr(codegen, 'ElementKernel', fail)
+
+    assert(l1.compile(use_pyccel=False).blocks[0,] is kernel)
+
+#==============================================================================
+# CLEAN UP SYMPY NAMESPACE
+#==============================================================================
+
+def teardown_module():
+    from sympy import cache
+    cache.clear_cache()
+
+def teardown_function():
+    from sympy import cache
+    cache.clear_cache()
@@ -0,0 +1,56 @@
+# coding: utf-8
+
+import os
+
+from vale.parser import Parser
+from vale.cost import cost_report, main
+
+base_dir = os.path.dirname(os.path.realpath(__file__))
+data_dir = os.path.join(base_dir, 'data')
+
+#==============================================================================
+def test_cost_report():
+    filename = os.path.join(data_dir, 'pde.vl')
+    ast = Parser().parse_from_file(filename)
+
+    report = cost_report(ast)
+    assert([c.name for c in report.costs][:3] == ['l1', 'l2', 'l3'])
+
+    # transcendental calls
+    assert(report['l4'].calls == {'sin': 2})
+    assert(report['l5'].calls == {'exp': 1})
+    assert(report['l4'].flops > report['l1'].flops == 0)
+
+    # the operators are counted on the terminal derivatives
+    assert(report['a3'].flops == 3)
+    assert(report['m2'].flops == 7)
+    assert(report['a4'].flops == report['a2'].flops + report['a3'].flops + 1)
+
+    # derivative orders
+    assert([report[k].derivative_order for k in ['l1', 'l2', 'l3']] ==
+           [0, 1, 2])
+
+    # blocks of the product spaces
+    assert(report['a13'].blocks == 3 and report['a13'].shape == (2, 2))
+    assert(report['poisson'].kind == 'Equation')
+
+    assert(report.sorted('transcendentals')[0].name == 'l4')
+
+def test_cli(capsys):
+    filename = os.path.join(data_dir, 'pde.vl')
+    assert(main([filename, '--sort', 'flops']) == 0)
+
+    lines = capsys.readouterr().out.splitlines()
+    assert(lines[1].split()[0] == 'a13')
+
+#==============================================================================
+# CLEAN UP SYMPY NAMESPACE
+#==============================================================================
+
+def teardown_module():
+    from sympy import cache
+    cache.clear_cache()
+
+def teardown_function():
+    from sympy import cache
+    cache.clear_cache()
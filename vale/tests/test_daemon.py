@@ -0,0 +1,141 @@
+# coding: utf-8
+
+import os
+import sys
+import json
+import asyncio
+import subprocess
+
+from vale.parser import Parser
+from vale.daemon import Daemon
+
+base_dir = os.path.dirname(os.path.realpath(__file__))
+data_dir = os.path.join(base_dir, 'data')
+
+code = """
+Domain(dim=2)        :: Omega
+FunctionSpace(Omega) :: V
+l{i}(v::V) = < {i}*v >
+"""
+
+#==============================================================================
+def test_parse_async():
+    pde = Parser()
+
+    async def parse_all():
+        return await asyncio.gather(*[pde.parse_async(code.format(i=i))
+                                      for i in range(4)])
+
+    asts = asyncio.run(parse_all())
+    for i, ast in enumerate(asts):
+        assert('l{}'.format(i) in ast.namespace)
+
+def test_daemon():
+    daemon = Daemon()
+    filename = os.path.join(data_dir, 'pde.vl')
+
+    requests = [{'id': 1, 'method': 'parse', 'code': code.format(i=1)},
+                {'id': 2, 'method': 'lower', 'filename': filename,
+                 'names': ['l5']},
+                {'id': 3, 'method': 'lower', 'code': 'x = (1'},
+                {'id': 4, 'method': 'eval'}]
+
+    async def handle_all():
+        return await asyncio.gather(*[daemon.handle(r) for r in requests])
+
+    r1, r2, r3, r4 = asyncio.run(handle_all())
+    daemon.close()
+
+    assert(r1['ok'])
+    assert([k for k, kind in r1['result']['declarations']] ==
+           ['Omega', 'V', 'l1'])
+
+    assert(r2['ok'] and list(r2['result']['namespace']) == ['l5'])
+
+    # errors are reported, with their position
+    assert(not r3['ok'] and 'line 1' in r3['error'])
+    assert(not r4['ok'] and r4['id'] == 4)
+
+def test_daemon_stdio():
+    requests = [{'id': 1, 'method': 'ping'},
+                {'id': 2, 'method': 'parse', 'code': code.format(i=2)},
+                {'id': 3, 'method': 'shutdown'}]
+    txt = '\n'.join(json.dumps(r) for r in requests) + '\n'
+
+    # the daemon stops on the shutdown request, without waiting for the end
+    # of its input
+    p = subprocess.Popen([sys.executable, '-m', 'vale.daemon',
+                          '--backend', 'fast'],
+                         stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+    p.stdin.write(txt.encode())
+    p.stdin.flush()
+    out, err = p.communicate(timeout=60)
+
+    responses = dict((r['id'], r)
+                     for r in map(json.loads, out.decode().splitlines()))
+    assert(sorted(responses) == [1, 2, 3])
+    assert(responses[1]['result'] == 'pong')
+    assert(responses[2]['ok'])
+
+def test_daemon_socket(tmpdir):
+    path   = str(tmpdir.join('vale.sock'))
+    daemon = Daemon(backend='fast')
+
+    async def client():
+        # waits for the server
+        while not os.path.exists(path):
+            await asyncio.sleep(0.01)
+
+        reader, writer = await asyncio.open_unix_connection(path)
+        responses = []
+        for r in [{'id': 1, 'method': 'lower', 'code': code.format(i=3)},
+                  {'id': 2, 'method': 'stats'},
+                  {'id': 3, 'method': 'shutdown'}]:
+            writer.write((json.dumps(r) + '\n').encode())
+            await writer.drain()
+            responses.append(json.loads(await reader.readline()))
+
+        writer.close()
+        return responses
+
+    async def run():
+        server = asyncio.ensure_future(daemon.serve_socket(path))
+        responses = await client()
+        await server
+        return responses
+
+    r1, r2, r3 = asyncio.run(run())
+    daemon.close()
+
+    assert(r1['result']['namespace']['l3'])
+    assert(r2['result']['requests'] == 2)
+    assert(r3['ok'] and not os.path.exists(path))
+
+def test_socket_path(tmpdir):
+    # a file which is not a socket is never removed
+    path = tmpdir.join('vale.sock')
+    path.write('data')
+
+    daemon = Daemon(backend='fast')
+    try:
+        asyncio.run(daemon.serve_socket(str(path)))
+    except FileExistsError:
+        pass
+    else:
+        assert(False)
+    finally:
+        daemon.close()
+
+    assert(path.read() == 'data')
+
+#==============================================================================
+# CLEAN UP SYMPY NAMESPACE
+#==============================================================================
+
+def teardown_module():
+    from sympy import cache
+    cache.clear_cache()
+
+def teardown_function():
+    from sympy import cache
+    cache.clear_cache()
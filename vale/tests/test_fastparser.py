@@ -0,0 +1,90 @@
+# coding: utf-8
+
+import os
+from glob import glob
+
+from vale.parser import Parser, get_metamodel
+from vale.fastparser import FastMetamodel, ParseError
+
+base_dir = os.path.dirname(os.path.realpath(__file__))
+data_dir = os.path.join(base_dir, 'data')
+
+# corner cases of the grammar: signed numbers, powers, keywords used as names
+codes = ["x = a + 2*-1 - 1.5e3",
+         "x = -1**2 + 2 ** 3 ** 4 * 2 - dx(u)**-2",
+         "x = 1e-3 ** -2.5 / (a - b)",
+         "x = f(a)*(b) + g()",
+         "Domain :: x",
+         "Domain(dim=-2) :: O",
+         "Domain(filename='mesh.h5') :: O",
+         "FunctionSpace(O, kind='l2') :: V",
+         "Function(x,y) :: f",
+         "l(v,w::V) = < v >_Omega\nm(v::V) = < v > _ O",
+         "a((v1,v2)::X, u::X) = < v1*u >  # comment",
+         "find u :: V such that u = f() forall v :: V "
+         "and u = 0 on 'G' and u=1 on \"H\""]
+
+def dump(obj):
+    """Returns the attributes of a parsed object, recursively."""
+    if isinstance(obj, list):
+        return [dump(x) for x in obj]
+
+    if not hasattr(obj, '__dict__'):
+        return obj
+
+    attrs = vars(obj)
+    return (obj.__class__.__name__,
+            attrs.get('_tx_position'),
+            [(k, dump(attrs[k])) for k in sorted(attrs)
+             if not( k.startswith('_') or k == 'parent' )])
+
+#==============================================================================
+def test_conformance():
+    grammar = Parser().grammar
+    textx   = get_metamodel(grammar)
+    fast    = FastMetamodel()
+
+    corpus = []
+    for filename in sorted(glob(os.path.join(data_dir, '*.vl'))):
+        with open(filename) as f:
+            corpus.append(f.read())
+
+    for code in corpus + codes:
+        assert(dump(fast.model_from_str(code)) ==
+               dump(textx.model_from_str(code)))
+
+def test_lowering():
+    filename = os.path.join(data_dir, 'pde.vl')
+
+    ast  = Parser().parse_from_file(filename)
+    fast = Parser(backend='fast').parse_from_file(filename)
+
+    assert([token.name for token in fast.declarations] ==
+           [token.name for token in ast.declarations])
+
+    assert(sorted(fast.namespace) == sorted(ast.namespace))
+    for k,v in ast.namespace.items():
+        assert(str(fast.namespace[k]) == str(v))
+
+def test_errors():
+    fast = FastMetamodel()
+    for code, line in [("x = (", 1), ("Real :: a\nx = a +\n", 3),
+                       ("l(v::V) = < v\n", 2), ("x = 1 $ 2", 1)]:
+        try:
+            fast.model_from_str(code)
+        except ParseError as e:
+            assert(e.line == line)
+        else:
+            assert(False)
+
+#==============================================================================
+# CLEAN UP SYMPY NAMESPACE
+#==============================================================================
+
+def teardown_module():
+    from sympy import cache
+    cache.clear_cache()
+
+def teardown_function():
+    from sympy import cache
+    cache.clear_cache()
@@ -0,0 +1,27 @@
+# coding: utf-8
+
+import sys
+import subprocess
+
+# maximum time in seconds spent in 'import vale'
+IMPORT_TIME_BUDGET = 0.25
+
+_code = '''
+import sys, time
+tb = time.perf_counter()
+import vale
+te = time.perf_counter()
+heavy = ['sympy', 'sympde', 'pyccel', 'textx']
+print(te - tb)
+print(' '.join(m for m in heavy if m in sys.modules))
+'''
+
+#==============================================================================
+def test_import_time():
+    # a new interpreter is needed, since vale is already imported here
+    out = subprocess.check_output([sys.executable, '-c', _code])
+    elapsed, modules = out.decode().split('\n')[:2]
+
+    # sympy, sympde, pyccel and textx are imported on first use
+    assert(modules.strip() == '')
+    assert(float(elapsed) < IMPORT_TIME_BUDGET)
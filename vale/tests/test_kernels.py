@@ -0,0 +1,134 @@
+# coding: utf-8
+
+import os
+
+import numpy as np
+
+from vale.parser import Parser, get_by_name
+
+base_dir = os.path.dirname(os.path.realpath(__file__))
+data_dir = os.path.join(base_dir, 'data')
+
+#==============================================================================
+def test_kernels():
+    filename = os.path.join(data_dir, 'pde.vl')
+    ast = Parser().parse_from_file(filename)
+
+    n_test, n_trial, n_quad = 3, 4, 5
+    v   = np.random.random((n_test, 1, n_quad))
+    u   = np.random.random((1, n_trial, n_quad))
+    phi = np.random.random(n_quad)
+
+    # fields are coefficients of the form
+    l5 = get_by_name(ast, 'l5').kernel
+    assert(l5.names == ['phi', 'v'])
+    assert(l5.basis == ['v'] and l5.coefficients == ['phi'])
+    assert(np.allclose(l5(phi=phi, v=v), np.exp(-phi)*v))
+
+    # coordinates, and sympy functions and constants
+    l4 = get_by_name(ast, 'l4').kernel
+    x = y = np.linspace(0., 1., n_quad)
+    expected = 2*np.pi**2*np.sin(np.pi*x)*np.sin(np.pi*y)*v
+    assert(np.allclose(l4(v=v, x=x, y=y), expected))
+
+    # all the basis functions and quadrature points in one call
+    a1 = get_by_name(ast, 'a1').kernel
+    assert(a1(u=u, v=v).shape == (n_test, n_trial, n_quad))
+
+    # one kernel per form
+    assert(get_by_name(ast, 'l5').kernel is l5)
+
+def test_terminal_derivatives():
+    filename = os.path.join(data_dir, 'pde.vl')
+    ast = Parser().parse_from_file(filename)
+
+    n_test, n_trial, n_quad = 3, 4, 5
+    values = {}
+    for name in ['u', 'u_0', 'u_1', 'p']:
+        values[name] = np.random.random((1, n_trial, n_quad))
+    for name in ['v', 'v_0', 'v_1', 'q']:
+        values[name] = np.random.random((n_test, 1, n_quad))
+
+    # every input depends on one function only
+    a3 = get_by_name(ast, 'a3').kernel
+    assert(a3.names == ['dx_u', 'dx_v', 'dy_u', 'dy_v'])
+    assert(sorted(a3.basis) == sorted(a3.names))
+
+    d = dict((k, values[k[3:]]) for k in a3.names)
+    expected = d['dx_u']*d['dx_v'] + d['dy_u']*d['dy_v']
+    assert(np.allclose(a3(**d), expected))
+
+    # the components of vector functions
+    m2 = get_by_name(ast, 'm2').kernel
+    assert(m2.names == ['dx_u_0', 'dx_u_1', 'dx_v_0', 'dx_v_1',
+                        'dy_u_0', 'dy_u_1', 'dy_v_0', 'dy_v_1'])
+
+    d = dict((k, values[k[3:]]) for k in m2.names)
+    expected = sum(d['{}_u_{}'.format(x, i)]*d['{}_v_{}'.format(x, i)]
+                   for x in ['dx', 'dy'] for i in range(2))
+    assert(np.allclose(m2(**d), expected))
+
+    # a product space
+    a13 = get_by_name(ast, 'a13').kernel
+    assert(a13.names == ['p', 'q'] + m2.names)
+    assert(a13.coefficients == [])
+
+    d = dict((k, values[k if k in ['p', 'q'] else k[3:]]) for k in a13.names)
+    div_u = d['dx_u_0'] + d['dy_u_1']
+    div_v = d['dx_v_0'] + d['dy_v_1']
+    expected = m2(**dict((k, d[k]) for k in m2.names))
+    expected += - d['p']*div_v + d['q']*div_u
+    assert(np.allclose(a13(**d), expected))
+
+def test_constants():
+    code = """
+Domain(dim=2)        :: Omega
+FunctionSpace(Omega) :: V
+Real                 :: alpha
+
+l1(v::V) = < alpha >
+l2(v::V) = < 2 >
+"""
+    ast = Parser().parse(code)
+
+    l1 = get_by_name(ast, 'l1').kernel
+    assert(l1.names == ['alpha'] and l1.coefficients == ['alpha'])
+    assert(l1(3.) == 3.)
+
+    l2 = get_by_name(ast, 'l2').kernel
+    assert(l2.names == [] and l2() == 2)
+
+def test_shared_dag():
+    filename = os.path.join(data_dir, 'pde.vl')
+    ast = Parser().parse_from_file(filename)
+
+    dag = ast.dag
+    assert(dag is ast.dag)
+
+    # a2 is shared with a4, a12 with a13 and a1 with the equation
+    separate, shared = dag.count_ops()
+    assert(shared < separate)
+
+    n_quad = 5
+    values = dict((name, np.random.random(n_quad)) for name in dag.names)
+    out = dag(**values)
+
+    assert(list(out) == [k for k,e in dag.roots.items()])
+    for name in ['a4', 'a13', 'l5']:
+        kernel = get_by_name(ast, name).kernel
+        args = dict((k, values[n]) for k in kernel.names
+                    for n, atom in dag.atoms.items()
+                    if atom == kernel.atoms[k])
+        assert(np.allclose(out[name], kernel(**args)))
+
+#==============================================================================
+# CLEAN UP SYMPY NAMESPACE
+#==============================================================================
+
+def teardown_module():
+    from sympy import cache
+    cache.clear_cache()
+
+def teardown_function():
+    from sympy import cache
+    cache.clear_cache()
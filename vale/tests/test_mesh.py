@@ -0,0 +1,113 @@
+# coding: utf-8
+
+import numpy as np
+
+from vale.parser import Parser, get_by_name, model_key, load_model
+from vale.mesh import Mesh, write_mesh
+
+code = """
+Domain(filename='mesh')    :: Omega
+FunctionSpace(Omega)       :: V
+
+a1(v::V, u::V) = < dx(v)*dx(u) >
+l1(v::V)       = < x*v >
+
+find u :: V such that
+  a1(v,u) = l1(v) forall v :: V
+  and u = 0 on 'Gamma_1'
+  and u = 1 on 'Gamma_2'
+  label: 'poisson'
+"""
+
+def unit_square(directory, n=4):
+    """Writes a triangulation of the unit square, with the bottom facets
+    tagged 1 and the others 2."""
+    x = np.linspace(0., 1., n+1)
+    nodes = np.array([(a, b) for b in x for a in x])
+
+    k = lambda i, j: j*(n+1) + i
+    cells = [(k(i,j), k(i+1,j), k(i+1,j+1)) for j in range(n) for i in range(n)]
+    cells += [(k(i,j), k(i+1,j+1), k(i,j+1)) for j in range(n) for i in range(n)]
+
+    facets  = [(k(i,0), k(i+1,0)) for i in range(n)]
+    facets += [(k(n,j), k(n,j+1)) for j in range(n)]
+    facets += [(k(i,n), k(i+1,n)) for i in range(n)]
+    facets += [(k(0,j), k(0,j+1)) for j in range(n)]
+    tags = [1]*n + [2]*(3*n)
+
+    return write_mesh(directory, nodes, np.array(cells), np.array(facets),
+                      np.array(tags), boundaries={'Gamma_1': 1, 'Gamma_2': 2})
+
+#==============================================================================
+def test_mesh(tmpdir):
+    unit_square(str(tmpdir))
+    mesh = Mesh(str(tmpdir))
+
+    assert(mesh.dim == 2 and mesh.cells.shape == (32, 3))
+
+    # the arrays are not loaded in memory
+    assert(isinstance(mesh.nodes, np.memmap))
+    assert(list(mesh.boundaries) == ['Gamma_1', 'Gamma_2'])
+    assert(list(mesh.boundaries['Gamma_1']) == [0, 1, 2, 3])
+    assert(len(mesh.boundary('Gamma_2')) == 12)
+
+def test_domain(tmpdir):
+    unit_square(str(tmpdir.join('mesh')))
+    filename = tmpdir.join('model.vl')
+    filename.write(code)
+
+    # the mesh is relative to the Vale file
+    ast = Parser().parse_from_file(str(filename))
+
+    mesh = get_by_name(ast, 'Omega').mesh
+    assert(mesh.dim == 2 and 'x' in ast.namespace)
+
+    boundaries = get_by_name(ast, 'poisson').boundaries
+    assert(sorted(boundaries) == ['Gamma_1', 'Gamma_2'])
+    assert(len(boundaries['Gamma_1']) == 4)
+
+def test_unknown_boundary(tmpdir):
+    unit_square(str(tmpdir.join('mesh')))
+    filename = tmpdir.join('model.vl')
+    filename.write(code.replace('Gamma_2', 'Gamma_3'))
+
+    try:
+        Parser().parse_from_file(str(filename))
+    except ValueError as e:
+        assert('Gamma_3' in str(e))
+    else:
+        assert(False)
+
+def test_cached_mesh(tmpdir):
+    import pickle
+
+    filename = unit_square(str(tmpdir.join('mesh')))
+    mesh = Mesh(filename)
+    assert(mesh.files()[0] == filename)
+
+    # the same code in another directory has another key
+    assert(not( model_key(code, '', str(tmpdir)) ==
+                model_key(code, '', str(tmpdir.join('other'))) ))
+
+    # a model is not loaded if its mesh changed
+    stamp = mesh.stamp()
+    model = str(tmpdir.join('model.pkl'))
+    with open(model, 'wb') as f:
+        pickle.dump({'declarations': [], 'namespace': {}, 'files': stamp}, f)
+    assert(not( load_model(model) is None ))
+
+    unit_square(str(tmpdir.join('mesh')), n=8)
+    assert(not( Mesh(filename).stamp() == stamp ))
+    assert(load_model(model) is None)
+
+#==============================================================================
+# CLEAN UP SYMPY NAMESPACE
+#==============================================================================
+
+def teardown_module():
+    from sympy import cache
+    cache.clear_cache()
+
+def teardown_function():
+    from sympy import cache
+    cache.clear_cache()
@@ -2,7 +2,8 @@
 
 import os
 
-from vale.parser import Parser
+from vale.parser import Parser, get_by_name, profile_rules
+from vale.kernels import terminal_expr
 
 base_dir = os.path.dirname(os.path.realpath(__file__))
 data_dir = os.path.join(base_dir, 'data')
@@ -16,6 +17,373 @@ def test_1():
     filename = os.path.join(data_dir, 'pde.vl')
     ast = pde.parse_from_file(filename)
 
+#==============================================================================
+def test_metamodel_cache():
+    # the grammar is compiled only once per process
+    p1 = Parser()
+    p2 = Parser()
+
+    assert(p1.model is p2.model)
+
+#==============================================================================
+def test_model_cache(tmpdir):
+    filename = os.path.join(data_dir, 'pde.vl')
+    cache_dir = str(tmpdir)
+
+    # first parse lowers the model and stores it
+    ast = Parser(cache_dir=cache_dir).parse_from_file(filename)
+    assert(len(os.listdir(cache_dir)) == 1)
+
+    expected = dict((k, str(v)) for k,v in ast.namespace.items())
+    names    = [token.name for token in ast.declarations]
+
+    # second parse is loaded from the cache
+    ast = Parser(cache_dir=cache_dir).parse_from_file(filename)
+
+    assert([token.name for token in ast.declarations] == names)
+    assert(dict((k, str(v)) for k,v in ast.namespace.items()) == expected)
+
+def test_cached_plan(tmpdir, monkeypatch):
+    from vale import plan
+
+    filename = os.path.join(data_dir, 'pde.vl')
+    cache_dir = str(tmpdir)
+
+    ast = Parser(cache_dir=cache_dir).parse_from_file(filename)
+    expected = get_by_name(ast, 'poisson').plan.to_json()
+
+    # the plan is stored with the model, and not computed again
+    def fail(*args, **kwargs):
+        raise AssertionError('assembly plan computed again')
+    monkeypatch.setattr(plan, 'assembly_plan', fail)
+
+    ast = Parser(cache_dir=cache_dir).parse_from_file(filename)
+    poisson = get_by_name(ast, 'poisson')
+    assert(not( getattr(poisson, '_plan', None) is None ))
+    assert(poisson.plan.to_json() == expected)
+
+#==============================================================================
+def test_expr_sharing():
+    filename = os.path.join(data_dir, 'pde.vl')
+    ast = Parser().parse_from_file(filename)
+
+    # lowering is done once
+    m2 = get_by_name(ast, 'm2').body.expression
+    assert(m2.expr is m2.expr)
+
+    # identical subexpressions are shared
+    a11 = get_by_name(ast, 'a11').body.expression
+    assert(a11.expr is m2.expr)
+
+#==============================================================================
+def test_sessions():
+    from concurrent.futures import ThreadPoolExecutor
+
+    filename = os.path.join(data_dir, 'pde.vl')
+    pde = Parser()
+
+    # every parse has its own namespace
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        asts = list(executor.map(pde.parse_from_file, [filename]*4))
+
+    expected = dict((k, str(v)) for k,v in asts[0].namespace.items())
+    for ast in asts[1:]:
+        assert(not( ast.session is asts[0].session ))
+        assert(dict((k, str(v)) for k,v in ast.namespace.items()) == expected)
+
+#==============================================================================
+def test_incremental():
+    filename = os.path.join(data_dir, 'pde.vl')
+    with open(filename) as f:
+        code = f.read()
+
+    pde = Parser()
+    ast = pde.parse_incremental(code)
+    assert(len(ast.rebuilt) == len(ast.declarations))
+
+    # editing a2 rebuilds the forms using it, and only them
+    code = code.replace('< laplace(v) * laplace(u) >',
+                        '< laplace(v) * laplace(u) + v * u >')
+    new = pde.parse_incremental(code, ast)
+
+    assert(sorted(new.rebuilt) == ['a2', 'a4', 'a5'])
+
+    # the unchanged declarations are reused, without modifying the old AST
+    l1 = get_by_name(ast, 'l1')
+    assert(get_by_name(new, 'l1').integrand is l1.integrand)
+    assert(get_by_name(new, 'l1').namespace is new.namespace)
+    assert(l1.namespace is ast.namespace)
+    assert(not( new.namespace['a4'] == ast.namespace['a4'] ))
+
+#==============================================================================
+def test_iter_parse():
+    filename = os.path.join(data_dir, 'pde.vl')
+    pde = Parser()
+
+    ast = pde.parse_from_file(filename)
+    tokens = list(pde.iter_parse_from_file(filename))
+
+    assert([token.name for token in tokens] ==
+           [token.name for token in ast.declarations])
+
+    namespace = tokens[0].namespace
+    for k,v in ast.namespace.items():
+        assert(str(namespace[k]) == str(v))
+
+#==============================================================================
+def test_parenthesis():
+    code = """
+Domain(dim=2)        :: Omega
+FunctionSpace(Omega) :: V
+Real                 :: alpha
+
+l1(v::V) = < (1 + alpha*(x + y)) * v >
+"""
+    ast = Parser().parse(code)
+
+    ns = ast.namespace
+    x, y, alpha = ns['x'], ns['y'], ns['alpha']
+    assert(ns['l1'].expr.has(alpha*(x + y)))
+
+#==============================================================================
+def test_power():
+    code = """
+Domain(dim=2) :: Omega
+f = -x**2 + sin(y)**2
+g = -1**2
+"""
+    ast = Parser().parse(code)
+
+    from sympy import sin
+
+    ns = ast.namespace
+    x, y = ns['x'], ns['y']
+    assert(ns['f'] == -x**2 + sin(y)**2)
+    assert(ns['g'].doit() == -1)
+
+#==============================================================================
+def test_numeric_factors():
+    code = """
+Domain(dim=2) :: Omega
+f = 1/2*x
+g = (1/2)*x
+h = x/2
+"""
+    ast = Parser().parse(code)
+
+    from sympy import Float, Rational
+
+    # leading numbers are divided by Python, the others exactly by sympy
+    ns = ast.namespace
+    x = ns['x']
+    assert(ns['f'] == ns['g'] == Float(0.5)*x)
+    assert(ns['f'] is ns['g'])
+    assert(ns['h'] == Rational(1, 2)*x)
+
+#==============================================================================
+def test_deep_lowering():
+    from sympy import Symbol
+    from vale.session import Session
+    from vale.syntax import Expression, Term, Factor, Operand
+
+    # (1 + x*(1 + x*(...))), deeper than the recursion limit
+    def factor(op):
+        return Factor(op=op, sign=None, trailer=None, exponent=None)
+
+    expr = Expression(op=[Term(op=[factor(Operand(op=1))])])
+    for i in range(2000):
+        inner = factor(Operand(op=expr))
+        term  = Term(op=[factor(Operand(op='x')), '*', inner])
+        expr  = Expression(op=[Term(op=[factor(Operand(op=1))]), '+', term])
+
+    x = Symbol('x')
+    with Session() as session:
+        session.define('x', x)
+        e = expr.expr
+
+    assert(e.args[0] == 1 or e.args[1] == 1)
+    assert(e.has(x))
+
+#==============================================================================
+def test_rule_profile():
+    filename = os.path.join(data_dir, 'pde.vl')
+    with open(filename) as f:
+        profile = profile_rules(f.read()).report()
+
+    # every operand is parsed once
+    for rule in ['Expression', 'Term', 'Factor', 'Operand']:
+        assert(profile[rule]['retries'] == 0)
+
+#==============================================================================
+def test_scope():
+    code = """
+Domain(dim=2)        :: Omega
+FunctionSpace(Omega) :: V
+Real                 :: u
+
+l1(v::V)      = < u*v >
+a1(v::V,u::V) = < dx(v)*dx(u) >
+l2(v::V)      = < u*v >
+"""
+    ast = Parser().parse(code)
+    ns  = ast.namespace
+
+    # test and trial functions shadow the namespace, only inside the form
+    assert(ns['l1'].expr.has(ns['u']))
+    assert(not ns['a1'].expr.has(ns['u']))
+    assert(ns['l2'].expr == ns['l1'].expr)
+    assert(not( 'v' in ns ))
+
+    # local names are not dependencies
+    assert(ast.session.dependencies['a1'] == set(['V']))
+
+    assert(get_by_name(ast, 'a1') is ast.index['a1'])
+    assert(get_by_name(ast, 'b1') is None)
+
+#==============================================================================
+def test_applications():
+    code = """
+Domain(dim=2)        :: Omega
+FunctionSpace(Omega) :: V
+
+a1(v::V, u::V) = < dx(v)*dx(u) >
+a2(v::V, u::V) = < v*u >
+
+X = V*V
+b1((v1,v2)::X, (u1,u2)::X) = a1(v1,u1) + a2(v1,u1) + a1(v2,u2)
+b2((v1,v2)::X, (u1,u2)::X) = a1(v1,u1) - a2(v1,u1) + a1(v2,u2)
+"""
+    ast = Parser().parse(code)
+    ns  = ast.namespace
+
+    # a1(v1,u1), a2(v1,u1) and a1(v2,u2) are applied once
+    report = ast.session.applications_report()
+    assert(report['misses'] == 3 and report['hits'] == 3)
+    assert(report['rate'] == 0.5)
+
+    assert(not( ns['b1'].expr == ns['b2'].expr ))
+
+#==============================================================================
+def test_blocks():
+    filename = os.path.join(data_dir, 'pde.vl')
+    ast = Parser().parse_from_file(filename)
+    ns  = ast.namespace
+
+    # U = W*V, there is no coupling between q and p
+    blocks = get_by_name(ast, 'a13').blocks
+    assert(blocks.shape == (2, 2))
+    assert(blocks.nonzero == [(0, 0), (0, 1), (1, 0)])
+    assert(blocks.is_zero(1, 1) and blocks[1, 1] == 0)
+    assert(blocks[0, 0] == terminal_expr(ns['a11'].expr))
+
+    # the sum of the blocks is the integrand
+    blocks = get_by_name(ast, 'a5').blocks
+    assert(blocks.nonzero == [(0, 0), (0, 1), (1, 1)])
+    assert(sum(blocks[k] for k in blocks.nonzero) ==
+           terminal_expr(ns['a5'].expr))
+
+#==============================================================================
+def test_interning():
+    filename = os.path.join(data_dir, 'pde.vl')
+    ast = Parser().parse_from_file(filename)
+
+    # v::V is created once, for all the forms
+    v1 = get_by_name(ast, 'l1').test_functions[0]
+    for name in ['l5', 'a4', 'poisson']:
+        assert(get_by_name(ast, name).test_functions[0] is v1)
+
+    # v::W is another function
+    v2 = get_by_name(ast, 'm1').test_functions[0]
+    assert(not( v2 is v1 ))
+    assert(get_by_name(ast, 'a11').test_functions[0] is v2)
+
+    # U = W*V is split once
+    U = ast.namespace['U']
+    assert(ast.session.spaces[U] == (ast.namespace['W'], ast.namespace['V']))
+
+#==============================================================================
+def test_assembly_plan():
+    import json
+
+    filename = os.path.join(data_dir, 'pde.vl')
+    ast = Parser().parse_from_file(filename)
+
+    # without a model cache, the plan is computed on first use
+    poisson = get_by_name(ast, 'poisson')
+    assert(getattr(poisson, '_plan', None) is None)
+
+    plan = poisson.plan
+    assert(poisson.plan is plan)
+    assert(plan.bilinear_forms == ['a1'] and plan.linear_forms == ['l1'])
+    assert(plan.test_spaces == ['V'] and plan.trial_spaces == ['V'])
+
+    [c] = plan.bilinear
+    assert(c.block == (0, 0) and (c.test, c.trial) == ('v', 'u'))
+    assert(c.integrand == ast.namespace['a1'].expr)
+
+    # Dirichlet and Neumann conditions
+    assert([(c['boundary'], c['order']) for c in plan.conditions] ==
+           [('Gamma_1', 0), ('Gamma_2', 1)])
+
+    # the plan is serializable
+    data = json.loads(plan.to_json())
+    assert(data['linear'][0]['integrand'] == 'v')
+    assert(data['derivatives'] == {'v': 0, 'u': 0})
+
+#==============================================================================
+def test_instrumentation():
+    from vale.instrument import Instrumentation
+
+    names = []
+    def callback(event):
+        if event.phase == 'declaration':
+            names.append(event.name)
+
+    instrumentation = Instrumentation(callbacks=[callback], allocations=True)
+    pde = Parser(instrumentation=instrumentation)
+
+    filename = os.path.join(data_dir, 'pde.vl')
+    ast = pde.parse_from_file(filename)
+
+    assert(names == [token.name for token in ast.declarations])
+
+    report = instrumentation.report()
+    for phase in ['grammar', 'model_from_str', 'declaration', 'lower']:
+        assert(phase in report['phases'])
+
+    a13 = [d for d in report['declarations'] if d['name'] == 'a13'][0]
+    assert(a13['kind'] == 'BilinearForm')
+    assert(a13['time'] >= a13['self_time'] >= 0.)
+    assert(not( a13['allocated'] is None ))
+
+def test_instrumentation_threads():
+    import threading
+    import tracemalloc
+    from vale.instrument import Instrumentation
+
+    instrumentation = Instrumentation(allocations=True)
+
+    # the first thread to end its phase does not stop the tracing of the
+    # other one
+    started  = threading.Event()
+    finished = threading.Event()
+    def measure():
+        instrumentation.begin('thread')
+        started.set()
+        finished.wait()
+        instrumentation.end()
+
+    thread = threading.Thread(target=measure)
+    thread.start()
+    started.wait()
+
+    instrumentation.begin('main')
+    instrumentation.end()
+    assert(tracemalloc.is_tracing())
+
+    finished.set()
+    thread.join()
+    assert(not tracemalloc.is_tracing())
 
 #==============================================================================
 # CLEAN UP SYMPY NAMESPACE